@@ -0,0 +1,185 @@
+'''
+Timing comparisons between gregex's fast paths and the reference (brute-force)
+implementations they replace.
+
+Each benchmark returns a dict of timings (in seconds) rather than printing, so
+results can be collected in a notebook or written out as a table.
+'''
+
+import multiprocessing
+import random
+from collections import OrderedDict
+from timeit import default_timer
+
+import gregex
+from subtree_index import SubtreeIndex
+import bulk_tokenizer
+
+
+def time_calls(f, argument_tuples, repeat=3):
+    '''
+    Returns the best-of-`repeat` wall time (in seconds) of calling `f` on every
+    tuple of arguments in `argument_tuples` in turn.
+    '''
+    argument_tuples = tuple(argument_tuples)
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        for args in argument_tuples:
+            f(*args)
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def instance_patterns(glycan, uncertainty_operator):
+    '''
+    Returns (pattern, glycan) pairs, one for each (left, match, right) split of
+    `glycan` matching `uncertainty_operator`, where the pattern replaces the
+    match with the operator token - i.e. pairs for which `gregex.matches` should
+    succeed.
+    '''
+    splits = gregex.analyze_matches(glycan, uncertainty_operator,
+                                    with_context=True)
+    return tuple((l + uncertainty_operator + r, glycan)
+                 for l, m, r in splits)
+
+
+def benchmark_matches(glycans, uncertainty_operator, repeat=3):
+    '''
+    Times `gregex.matches` against `gregex.matches_by_enumeration` on every
+    instance pattern (see `instance_patterns`) of each glycan in `glycans`.
+
+    Returns a dict with the number of (pattern, glycan) pairs and the best time
+    for each implementation.
+    '''
+    pairs = tuple(pair
+                  for glycan in glycans
+                  for pair in instance_patterns(glycan, uncertainty_operator))
+    for pattern, glycan in pairs:
+        assert gregex.matches(pattern, glycan) == gregex.matches_by_enumeration(pattern, glycan)
+    return {'pairs':len(pairs),
+            'matches':time_calls(gregex.matches, pairs, repeat),
+            'matches_by_enumeration':time_calls(gregex.matches_by_enumeration, pairs, repeat)}
+
+
+def random_glycan(n_residues, rng=random, labels=('A', 'AN', 'F', 'GN', 'M', 'NN', 'S'),
+                  bond_types='ab', bond_locations='2346'):
+    '''
+    Returns a random (syntactically well-formed) linear code expression with
+    `n_residues` residues drawn from `labels`, each attached to a random
+    earlier residue by a random bond.
+    '''
+    root = OrderedDict([('func', rng.choice(labels)), ('args', [])])
+    residues = [root]
+    for _ in range(n_residues - 1):
+        residue = OrderedDict([('func', rng.choice(labels) +
+                                        rng.choice(bond_types) +
+                                        rng.choice(bond_locations)),
+                               ('args', [])])
+        rng.choice(residues)['args'].append(residue)
+        residues.append(residue)
+    return gregex.func_and_args_to_linear_code(root)
+
+
+def random_corpus(n_glycans, min_residues=3, max_residues=15, seed=0):
+    '''
+    Returns `n_glycans` random glycans (see `random_glycan`), reproducibly.
+    '''
+    rng = random.Random(seed)
+    return [random_glycan(rng.randint(min_residues, max_residues), rng)
+            for _ in range(n_glycans)]
+
+
+def benchmark_subtree_index(n_glycans=100000, n_queries=100, seed=0):
+    '''
+    Builds a `SubtreeIndex` over a random corpus of `n_glycans` glycans and
+    times it, querying with `n_queries` subtrees drawn from the corpus.
+
+    Returns a dict with the build time and the mean latency of `containing`
+    and `embedding` queries (in seconds).
+    '''
+    corpus = random_corpus(n_glycans, seed=seed)
+    start = default_timer()
+    index = SubtreeIndex()
+    index.extend(corpus)
+    build_time = default_timer() - start
+
+    rng = random.Random(seed + 1)
+    queries = []
+    for _ in range(n_queries):
+        tree = gregex.parse_exp(rng.choice(corpus), 'func-and-args')
+        subtrees = [subtree for h, subtree in gregex.subtree_hashes(tree)]
+        queries.append(gregex.func_and_args_to_linear_code(rng.choice(subtrees)))
+
+    start = default_timer()
+    for query in queries:
+        index.containing(query)
+    containing_time = default_timer() - start
+
+    start = default_timer()
+    for query in queries:
+        index.embedding(query)
+    embedding_time = default_timer() - start
+
+    return {'glycans':n_glycans,
+            'build':build_time,
+            'containing':containing_time / n_queries,
+            'embedding':embedding_time / n_queries}
+
+
+def benchmark_bulk_tokenizer(n_glycans=100000, n_sampled=2000, seed=0):
+    '''
+    Times `bulk_tokenizer.tokenize_buffer` on a random corpus of `n_glycans`
+    glycans against calling `tokenizer` on each record, the latter
+    extrapolated from `n_sampled` records.
+
+    Returns a dict of the two times (in seconds).
+    '''
+    corpus = random_corpus(n_glycans, seed=seed)
+    buffer = '\n'.join(corpus).encode('ascii')
+
+    start = default_timer()
+    bulk_tokenizer.tokenize_buffer(buffer)
+    bulk_time = default_timer() - start
+
+    start = default_timer()
+    for lce in corpus[:n_sampled]:
+        gregex.tokenizer(lce)
+    per_record_time = (default_timer() - start) * n_glycans / n_sampled
+
+    return {'glycans':n_glycans,
+            'bulk':bulk_time,
+            'per_record':per_record_time}
+
+
+def benchmark_parallel_matches(n_residues=400, uncertainty_operator='_',
+                               substitution='(Ma2)', max_processes=None,
+                               repeat=1, seed=0):
+    '''
+    Times `analyze_matches` (with contexts, checking `substitution`) and
+    `parallel_match_spans` on one random glycan of `n_residues` residues with
+    1, 2, ... `max_processes` worker processes (by default, up to one per
+    core; 1 being the serial implementation), checking that every run agrees
+    with the serial result.
+
+    Returns a dict with the glycan's number of tokens and spans, and for each
+    number of processes the best time of each function (in seconds).
+    '''
+    glycan = random_glycan(n_residues, random.Random(seed))
+    tokens = gregex.tokenizer(glycan)
+    max_processes = max_processes or multiprocessing.cpu_count()
+    serial = gregex.analyze_matches(glycan, uncertainty_operator, substitution, True)
+    result = {'tokens':len(tokens), 'spans':len(serial), 'processes':OrderedDict()}
+    for processes in range(1, max_processes + 1):
+        assert gregex.analyze_matches(glycan, uncertainty_operator, substitution,
+                                      True, processes=processes) == serial
+        result['processes'][processes] = {
+            'analyze_matches':time_calls(gregex.analyze_matches,
+                                         [(glycan, uncertainty_operator, substitution,
+                                           True, False, 0, None, processes)],
+                                         repeat),
+            'parallel_match_spans':time_calls(gregex.parallel_match_spans,
+                                              [(tokens, [uncertainty_operator], processes)],
+                                              repeat)}
+    return result
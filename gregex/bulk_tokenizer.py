@@ -0,0 +1,127 @@
+'''
+Tokenizing whole libraries of linear code expressions at once.
+
+`tokenize_buffer` tokenizes every record of a newline-delimited buffer (bytes,
+or a memory-mapped file via `tokenize_file`) with one compiled regular
+expression scanning a whole chunk of the buffer at a time. The regular
+expression's `findall` produces one small string per token, which a single
+`map` over a dict turns into token ids; records are then split apart with
+NumPy, without a Python-level loop over records or a per-record string. It
+returns
+  - a flat array of token ids (indices into `vocabulary`)
+  - an array of per-record offsets into it: record r's tokens are
+    ids[offsets[r]:offsets[r+1]]
+  - the indices of the records that could not be tokenized (which get no
+    tokens)
+
+`tokenizer` reads expressions right to left, taking the shortest suffix that is
+a token each time. The same is done here by scanning the reversed buffer with
+an alternation of the reversed tokens, shortest first.
+'''
+
+import mmap
+import re
+
+import numpy as np
+
+import gregex
+
+vocabulary = tuple(sorted(set(gregex.parentheses) | gregex.SUs_with_bonds | gregex.SU_bare))
+token_id = dict((token, i) for i, token in enumerate(vocabulary))
+
+separator_id = -1
+error_id = -2
+
+_reversed_tokens = sorted((token[::-1].encode('ascii') for token in vocabulary),
+                          key=lambda token: (len(token), token))
+reversed_token_pattern = re.compile(b'\n|' + b'|'.join(map(re.escape, _reversed_tokens)) + b'|[^\n]')
+reversed_token_id = dict((token[::-1].encode('ascii'), i) for i, token in enumerate(vocabulary))
+reversed_token_id[b'\n'] = separator_id
+for byte in range(256):
+    reversed_token_id.setdefault(bytes(bytearray([byte])), error_id)
+
+
+def _tokenize_chunk(chunk):
+    '''
+    Tokenizes the newline-separated records in `chunk` (no trailing newline)
+    and returns an array of token ids in order, with `separator_id` between
+    records and `error_id` for every untokenizable character.
+    '''
+    matches = reversed_token_pattern.findall(chunk[::-1])
+    ids = np.fromiter(map(reversed_token_id.__getitem__, matches), np.int32, len(matches))
+    return ids[::-1]
+
+
+def _chunks(buffer, chunk_size):
+    '''
+    Splits `buffer` into pieces of about `chunk_size` bytes, each ending just
+    before a newline (which is dropped), so that no record is split.
+    '''
+    start, end = 0, len(buffer)
+    if end > 0 and buffer[end - 1:end] == b'\n':
+        end -= 1
+        if end == 0:
+            yield b''
+    while start < end:
+        stop = end if end - start <= chunk_size else buffer.rfind(b'\n', start, start + chunk_size)
+        if stop <= start:
+            stop = buffer.find(b'\n', start + chunk_size, end)
+            stop = end if stop == -1 else stop
+        yield buffer[start:stop]
+        start = stop + 1
+
+
+def tokenize_buffer(buffer, chunk_size=64 * 1024 * 1024):
+    '''
+    Tokenizes each newline-delimited record of `buffer` (bytes, or anything
+    supporting slicing, `find` and `rfind` like an `mmap.mmap`) and returns
+        (ids, offsets, errors)
+    as described in the module docstring. A final newline ends the last record
+    rather than starting an empty one.
+
+    The buffer is processed in chunks of about `chunk_size` bytes, so at most
+    one chunk at a time is ever copied.
+    '''
+    pieces = [_tokenize_chunk(chunk) for chunk in _chunks(buffer, chunk_size)]
+    n_pieces = len(pieces)
+    if n_pieces == 0:
+        return np.zeros(0, np.int32), np.zeros(1, np.int64), np.zeros(0, np.int64)
+    # chunks were split at (dropped) newlines; put the separators back
+    ids = np.concatenate([piece if i == n_pieces - 1 else np.append(piece, separator_id)
+                          for i, piece in enumerate(pieces)])
+
+    is_separator = ids == separator_id
+    record = np.cumsum(is_separator) - is_separator
+    n_records = int(is_separator.sum()) + 1
+    errors = np.unique(record[ids == error_id])
+
+    keep = ~is_separator & ~np.in1d(record, errors)
+    counts = np.bincount(record[keep], minlength=n_records)
+    offsets = np.zeros(n_records + 1, np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return ids[keep], offsets, errors
+
+
+def tokenize_file(filepath, chunk_size=64 * 1024 * 1024):
+    '''
+    Tokenizes each line of the file at `filepath` (see `tokenize_buffer`),
+    reading it through a memory map.
+    '''
+    with open(filepath, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return tokenize_buffer(b'', chunk_size)
+        try:
+            return tokenize_buffer(buffer, chunk_size)
+        finally:
+            buffer.close()
+
+
+def record_tokens(ids, offsets, record):
+    '''
+    Returns the tokens of `record` (as strings) from the output of
+    `tokenize_buffer`.
+    '''
+    return [vocabulary[i] for i in ids[offsets[record]:offsets[record + 1]]]
@@ -0,0 +1,248 @@
+'''
+Command-line argument handling shared by `python -m gregex`, the gregex server
+(`gregex.server`) and its thin client (`gregex/client.py`).
+
+This module deliberately imports nothing heavier than the standard library, so
+that the client can use it without loading gregex itself.
+'''
+
+import argparse
+from collections import OrderedDict
+import csv
+
+my_desc = """Manipulate or investigate a linear code expression, principally for
+the purpose of investigating uncertainty operators.
+
+Given
+ - a linear code expression representing a single glycan
+   - (Uncertainty operators for bond type or location are also supported,
+     currently.)
+ - and *no* other flags (except optionally -v)
+this returns a Boolean indicating whether the linear code expression is well-
+formed according to the grammar in the module README, or according to the
+grammar in the file passed to -g (written in NLTK's CFG syntax over the same
+tokens). Grammars are compiled once into Earley parse tables that are cached on
+disk (under $GREGEX_CACHE_DIR, or ~/.cache/gregex by default); -p nltk uses
+NLTK's chart parser instead.
+
+If the linear code expression contains uncertainty operator tokens (any number
+of them), this instead returns a Boolean indicating whether some substitution
+of matches for the operators yields a well-formed expression. With -v, a
+witnessing substitution for each operator token is printed as well.
+
+Given
+ - a linear code expression representing a single glycan
+ - the -e flag (and optionally -v)
+this returns the glycan as a Lisp-style s-expression. This permits seeing the
+tree structure of the glycan without resorting to glypy. (Currently gregex does
+no pretty-printing, but every widely-used text editor supports packages that will
+auto-indent Lisp according to common conventions that make tree structure
+apparent.)
+
+Given
+ - a linear code expression representing a single glycan
+ - the -k flag
+this returns the glycan in canonical linear code: at every residue, the branch
+with the lowest linkage position continues the chain and the others are
+parenthesized in descending order of linkage position. Two expressions describe
+the same glycan iff their canonical forms are equal.
+
+Given
+ - a linear code expression representing a single glycan
+ - a similarity index file passed to --similar (built with
+   `python -m gregex.similarity LIBRARY INDEX`)
+this returns the glycans in the index most similar to it (at most --top of
+them), one per line as
+  id\t estimated similarity\t glycan
+With --rerank, candidates are instead ranked by exact tree edit distance, which
+is added as a column before the glycan.
+
+Given
+ - a linear code expression representing a single glycan
+ - a file of motifs passed to --motifs (one linear code fragment per line,
+   optionally preceded by a name and a tab)
+this returns every occurrence of every motif in the glycan, one per line as
+  motif name	 token position
+found in a single pass over the glycan's tokens. A motif's rightmost residue
+matches that residue with any linkage.
+
+Given
+ - a linear code expression representing a single glycan
+   - (Uncertainty operators for bond type or location are also supported,
+     currently.)
+ - one of Krambeck et al. 2009's uncertainty operators ('...', '_', '|')
+this returns a stream of lines (by default) representing information about
+nonempty subsequences of the glycan that match the uncertainty operator.
+
+If the context flag (-c) is not active AND no substitution arg is given, the 
+stream contains only the unique substrings of the glycan that match the 
+operator.
+
+If the context flag is active, each line of the stream contains three tab-
+separated columns:
+  left context\t match\t right context
+
+If a substitution arg is provided (-s), then this also returns an extra column 
+for each match (a boolean) indicating whether both of the following 
+conditions hold:
+ - the substitution matches the operator
+ - the expression resulting from the substitution is syntactically well-formed.
+  - Currently, well-formedness just means that parentheses are balanced in
+    the complete expression post-substitution.
+
+If a directory is passed to --table-dir, the matches are instead written there
+as a table of spans (see gregex.match_tables), computed and saved in chunks of
+about --chunk-rows rows so that even glycans with millions of matches fit in
+memory; rerunning the same command resumes an interrupted table. With
+--compare-with O2, the table instead holds every nonempty span with whether it
+matches each of the two operators. Print a table with
+  python -m gregex.match_tables DIR
+
+If the column name flag (-n) is active, then the output will incldue a column 
+header line before data. 
+
+If a filename is passed to the -x argument, then the script will write all data
+to an xls-formatted file instead of stdout.
+
+If the verbose flag (-v) is active, information will be printed to stdout 
+about calculation.
+"""
+
+
+class RaisingArgumentParser(argparse.ArgumentParser):
+    '''
+    An argument parser that raises ValueError on invalid arguments instead of
+    printing usage and exiting the process.
+    '''
+    def error(self, message):
+        raise ValueError(message)
+
+
+def build_parser(raise_errors=False):
+    '''
+    Returns the argument parser for gregex's command-line interface. If
+    `raise_errors` is True, invalid arguments raise ValueError instead of
+    exiting.
+    '''
+    parser_class = RaisingArgumentParser if raise_errors else argparse.ArgumentParser
+    parser = parser_class(description=my_desc,
+                          formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('lce', metavar ='LCE', 
+                        type=str, nargs='?', default=None,
+                        help='a linear code expression containing no uncertainty operator tokens, or exactly one (or, when checking well-formedness, any number)')
+    parser.add_argument('-e', '--sexp',
+                        action='store_true',
+                        help='If active, all other arguments are ignored and the linear code expression is converted into an s-expression')
+    parser.add_argument('-k', '--canonical',
+                        action='store_true',
+                        help='If active, all other arguments are ignored and the linear code expression is rewritten in canonical form (branches ordered by linkage position).')
+    parser.add_argument('--similar', metavar='INDEX',
+                        type=str, default=None,
+                        help='If provided, all other arguments except --top and --rerank are ignored and the glycans in the similarity index at `INDEX` most similar to the linear code expression are returned.')
+    parser.add_argument('--top', metavar='K',
+                        type=int, default=10,
+                        help='With --similar, the number of similar glycans to return (default: 10).')
+    parser.add_argument('--rerank',
+                        action='store_true',
+                        help='With --similar, rank candidates by exact tree edit distance.')
+    parser.add_argument('--motifs', metavar='MOTIFS',
+                        type=str, default=None,
+                        help='If provided, all other arguments except -n are ignored and the occurrences in the linear code expression of the motifs in the file `MOTIFS` are returned.')
+    parser.add_argument('-o', '--operator', metavar='O',
+                        type=str, nargs=1,
+                        choices=(None, '...', '_', '|'),
+                        help="one of Krambeck et al. 2009's three uncertainty operators, '...', '_', or '|'")
+    parser.add_argument('-c','--contexts',
+                        action='store_true',
+                        help='If active, then each match includes left and right context information.')
+    parser.add_argument('-s','--substitution', metavar='S',
+                        type=str, action='append',
+                        help='If provided, then the script checks whether the single token of a unique uncertainty operator in `LCE` can match `S` and whether the resulting linear code expression is well-formed. If `LCE` contains several operator tokens (and -o is not given), pass -s once per token, in order.')
+    parser.add_argument('--offset', metavar='K',
+                        type=int, default=0,
+                        help='If an operator is provided via -o, skip the first `K` matches (sorted, or in order of position with -c).')
+    parser.add_argument('--limit', metavar='L',
+                        type=int, default=None,
+                        help='If an operator is provided via -o, output at most `L` matches (after --offset).')
+    parser.add_argument('--processes', metavar='N',
+                        type=int, default=1,
+                        help='If an operator is provided via -o, find matches with contexts (-c) or check substitutions (-s) across `N` worker processes (default: 1; 0 for one per core).')
+    parser.add_argument('-n','--namecolumns',
+                        action='store_true',
+                        help='If active, then output will include a column header line')
+    parser.add_argument('-x','--excel', metavar='X',
+                        type=str, nargs=1,
+                        help='If an operator is provided via -o AND a filepath is provided via this arg, then output is written to an excel-formatted file at this location.')
+    parser.add_argument('--table-dir', metavar='DIR',
+                        type=str, default=None,
+                        help='If an operator is provided via -o AND a directory is provided via this arg, then the matches (with contexts, and checked against -s if given) are written to a chunked on-disk table in `DIR` instead of being output; an interrupted run resumes when repeated.')
+    parser.add_argument('--compare-with', metavar='O',
+                        type=str, default=None,
+                        choices=(None, '...', '_', '|'),
+                        help='With --table-dir, instead write every span with whether it matches the operator from -o and the operator `O`.')
+    parser.add_argument('--chunk-rows', metavar='N',
+                        type=int, default=1000000,
+                        help='With --table-dir, the approximate number of rows per chunk file (default: 1000000).')
+    parser.add_argument('-g','--grammar', metavar='G',
+                        type=str, nargs=1,
+                        help='If provided, well-formedness is checked against the grammar in file `G` (in NLTK CFG syntax) instead of the default grammar.')
+    parser.add_argument('-p','--parser', metavar='P',
+                        type=str, nargs=1,
+                        choices=('earley', 'nltk'),
+                        help="The parsing backend used to check well-formedness: 'earley' (default; compiled, cached parse tables) or 'nltk' (NLTK's chart parser)")
+    parser.add_argument('--cache',
+                        action='store_true',
+                        help='If active, results are read from and written to the on-disk result cache (also enabled by setting $GREGEX_RESULT_CACHE=1).')
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help='If active, the result cache is not used even if $GREGEX_RESULT_CACHE is set.')
+    parser.add_argument('--clear-cache',
+                        action='store_true',
+                        help='If active, the result cache is emptied first. (`LCE` may then be omitted.)')
+    parser.add_argument('--cache-size', metavar='MB',
+                        type=int, default=512,
+                        help='The size bound of the result cache in megabytes (default: 512); the least recently used results are evicted beyond it.')
+    parser.add_argument('--time-limit', metavar='SECONDS',
+                        type=float, default=None,
+                        help='If provided, the operation runs in a separate process and is abandoned after `SECONDS` seconds.')
+    parser.add_argument('--memory-limit', metavar='MB',
+                        type=int, default=None,
+                        help='If provided, the operation runs in a separate process allowed `MB` more megabytes of memory.')
+    parser.add_argument('--max-spans', metavar='N',
+                        type=int, default=None,
+                        help='If provided (with -o), the operation is abandoned if the operator has more than `N` matching spans.')
+    parser.add_argument('--fallback',
+                        action='store_true',
+                        help="If active, a well-formedness check with `-p nltk` that exceeds --time-limit or --memory-limit is retried with the 'earley' backend.")
+    parser.add_argument('-v','--verbose',
+                        action='store_true',
+                        help='If active, then prints extra information to stdout')
+    return parser
+
+
+def write_excel(filepath, columns, rows, include_header):
+    '''
+    Writes `rows` (sequences of values for `columns`) to an excel-formatted
+    (csv) file at `filepath`.
+    '''
+    rows_as_dicts = list(map(OrderedDict,
+                             map(lambda row: zip(columns, row),
+                                 rows)))
+    with open(filepath, 'wb') as csv_file:
+        excel_writer = csv.DictWriter(csv_file, fieldnames=columns)
+        if include_header:
+            excel_writer.writeheader()
+        excel_writer.writerows(rows_as_dicts)
+
+
+def emit(result):
+    '''
+    Prints the output lines of a command result (see `gregex.operations`) and
+    writes its table to disk if it has one.
+    '''
+    for line in result['lines']:
+        print(line)
+    table = result.get('table')
+    if table is not None:
+        write_excel(table['filepath'], table['columns'], table['rows'],
+                    table['include_header'])
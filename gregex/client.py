@@ -0,0 +1,68 @@
+'''
+A thin client for the gregex server (`gregex.server`), taking the same
+arguments as `python -m gregex` plus
+    --address HOST:PORT     where the server is listening
+    --batch FILE            run the command for every linear code expression in
+                            FILE (one per line; LCE is then omitted), in a
+                            single request
+
+Run this file directly (`python path/to/gregex/client.py ...`) rather than via
+`python -m`, so that gregex itself - and its heavy dependencies - are never
+imported.
+'''
+
+import argparse
+import json
+import sys
+
+try:
+    from urllib2 import urlopen, Request
+except ImportError:
+    from urllib.request import urlopen, Request
+
+from cli import build_parser, emit
+
+default_address = '127.0.0.1:8765'
+
+
+def request(payload, address=default_address):
+    '''
+    Sends `payload` (a request object or list of them; see `gregex.server`) to
+    the server at `address` and returns the decoded response.
+    '''
+    body = json.dumps(payload).encode('utf-8')
+    http_request = Request('http://{0}/'.format(address), body,
+                           {'Content-Type':'application/json'})
+    return json.loads(urlopen(http_request).read().decode('utf-8'))
+
+
+def main(argv):
+    client_parser = argparse.ArgumentParser(add_help=False)
+    client_parser.add_argument('--address', type=str, default=default_address)
+    client_parser.add_argument('--batch', type=str, default=None)
+    client_args, gregex_argv = client_parser.parse_known_args(argv)
+
+    if client_args.batch is None:
+        build_parser().parse_args(gregex_argv)
+        payload = {'argv':gregex_argv}
+    else:
+        with open(client_args.batch, 'r') as batch_file:
+            lces = [line.strip() for line in batch_file if line.strip() != '']
+        for lce in lces[:1]:
+            build_parser().parse_args([lce] + gregex_argv)
+        payload = [{'argv':[lce] + gregex_argv} for lce in lces]
+
+    response = request(payload, client_args.address)
+    responses = response if isinstance(response, list) else [response]
+    status = 0
+    for each in responses:
+        if 'error' in each:
+            sys.stderr.write(each['error'] + '\n')
+            status = 1
+        else:
+            emit(each)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,245 @@
+'''
+Monosaccharide compositions of glycans, and filtering libraries by
+composition without parsing any trees.
+
+A glycan's composition is the number of residues of each bare saccharide unit
+(see `gregex.SU_bare`): a count vector over `units`. Groupings name sums of
+units, e.g. 'Hex' for M + G + A; in queries and composition strings like
+'Hex5HexNAc4Fuc1', a name is either a group or a single unit.
+
+`CompositionMatrix` holds the compositions of a whole library as one NumPy
+array (one row per glycan), so exact, range and subset queries are vectorized
+comparisons over it. `CompositionMatrix.for_library` saves the matrix next to
+the library file and reuses it until the library changes.
+'''
+
+import os
+import re
+
+import numpy as np
+
+import gregex
+import bulk_tokenizer
+
+units = tuple(sorted(gregex.SU_bare))
+unit_index = dict((unit, i) for i, unit in enumerate(units))
+
+# Linear code's A, G and M are galactose, glucose and mannose; AN and GN are
+# their N-acetylated forms.
+default_groupings = {'Hex':('A', 'G', 'M'),
+                     'HexNAc':('AN', 'GN'),
+                     'Fuc':('F',),
+                     'NeuAc':('NN',),
+                     'NeuGc':('NJ',)}
+
+composition_term_pattern = re.compile(r'([A-Za-z]+)(\d+)')
+
+
+def token_unit(token):
+    '''
+    Returns the bare saccharide unit of a token, or None for a paren.
+    '''
+    if token in gregex.parentheses:
+        return None
+    return gregex.split_bond_information(token)[0]
+
+
+# the unit index of each bulk_tokenizer token id (-1 for parens)
+_token_id_units = np.array([-1 if token_unit(token) is None else unit_index[token_unit(token)]
+                            for token in bulk_tokenizer.vocabulary], dtype=np.int64)
+
+
+def composition_vector(linear_code_expression):
+    '''
+    Returns the composition of a glycan as an array of counts over `units`.
+    '''
+    counts = np.zeros(len(units), dtype=np.int32)
+    for token in gregex.tokenizer(linear_code_expression):
+        unit = token_unit(token)
+        if unit is not None:
+            counts[unit_index[unit]] += 1
+    return counts
+
+
+def unit_mask(name, groupings=default_groupings):
+    '''
+    Returns a boolean array over `units` selecting the units `name` (a group
+    in `groupings`, or a unit) stands for.
+    '''
+    mask = np.zeros(len(units), dtype=bool)
+    if name in groupings:
+        for unit in groupings[name]:
+            mask[unit_index[unit]] = True
+    elif name in unit_index:
+        mask[unit_index[name]] = True
+    else:
+        raise ValueError('Unknown unit or group: {0}'.format(name))
+    return mask
+
+
+def parse_composition(composition):
+    '''
+    Returns a composition given as a string like 'Hex5HexNAc4Fuc1' (or already
+    as a dict) as a dict from names to counts.
+    '''
+    if isinstance(composition, dict):
+        return dict(composition)
+    terms = composition_term_pattern.findall(composition)
+    if composition_term_pattern.sub('', composition).strip() != '' or not terms:
+        raise ValueError('Invalid composition: {0}'.format(composition))
+    result = dict()
+    for name, count in terms:
+        result[name] = result.get(name, 0) + int(count)
+    return result
+
+
+def format_composition(counts, groupings=default_groupings):
+    '''
+    Returns a composition string for a count vector over `units`: one term per
+    group with a nonzero count (in sorted order), then one per ungrouped unit.
+    '''
+    counts = np.asarray(counts)
+    grouped = set(unit for members in groupings.values() for unit in members)
+    terms = [(name, int(counts[unit_mask(name, groupings)].sum()))
+             for name in sorted(groupings)]
+    terms += [(unit, int(counts[unit_index[unit]]))
+              for unit in units if unit not in grouped]
+    return ''.join('{0}{1}'.format(name, count) for name, count in terms if count > 0)
+
+
+class CompositionMatrix(object):
+    '''
+    The compositions of a library of glycans: `counts[r]` is the count vector
+    (over `units`) of record r, and `valid[r]` is False if record r could not be
+    tokenized (its counts are then all zero). Queries return the indices of
+    the matching (valid) records, in order.
+    '''
+    def __init__(self, counts=None, valid=None, groupings=default_groupings):
+        self.counts = np.zeros((0, len(units)), dtype=np.int32) if counts is None else counts
+        self.valid = np.ones(len(self.counts), dtype=bool) if valid is None else valid
+        self.groupings = groupings
+        self._columns = dict()
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def from_tokens(cls, ids, offsets, errors, groupings=default_groupings):
+        '''
+        Builds the matrix from the output of `bulk_tokenizer.tokenize_buffer`.
+        '''
+        n_records = len(offsets) - 1
+        record = np.repeat(np.arange(n_records), np.diff(offsets))
+        unit = _token_id_units[ids]
+        residue = unit >= 0
+        flat = np.bincount(record[residue] * len(units) + unit[residue],
+                           minlength=n_records * len(units))
+        valid = np.ones(n_records, dtype=bool)
+        valid[errors] = False
+        return cls(flat.reshape(n_records, len(units)).astype(np.int32), valid, groupings)
+
+    @classmethod
+    def from_expressions(cls, linear_code_expressions, groupings=default_groupings):
+        buffer = ''.join(lce + '\n' for lce in linear_code_expressions).encode('ascii')
+        return cls.from_tokens(*bulk_tokenizer.tokenize_buffer(buffer), groupings=groupings)
+
+    @classmethod
+    def from_file(cls, filepath, groupings=default_groupings):
+        '''
+        Builds the matrix for a file of linear code expressions (one per line).
+        '''
+        return cls.from_tokens(*bulk_tokenizer.tokenize_file(filepath), groupings=groupings)
+
+    @classmethod
+    def for_library(cls, library_fp, groupings=default_groupings):
+        '''
+        Returns the matrix for the library file at `library_fp`, loaded from
+        `library_fp + '.composition.npz'` if that is at least as new as the
+        library, and otherwise built and saved there.
+        '''
+        matrix_fp = library_fp + '.composition.npz'
+        if os.path.exists(matrix_fp) and os.path.getmtime(matrix_fp) >= os.path.getmtime(library_fp):
+            return cls.load(matrix_fp, groupings)
+        matrix = cls.from_file(library_fp, groupings)
+        matrix.save(matrix_fp)
+        return matrix
+
+    def save(self, filepath):
+        '''
+        Writes the matrix to `filepath` (an .npz file). Groupings are not
+        saved; they are just a view on the counts.
+        '''
+        temp_fp = '{0}.{1}.tmp.npz'.format(filepath, os.getpid())
+        np.savez(temp_fp, counts=self.counts, valid=self.valid,
+                 units=np.array(units))
+        os.rename(temp_fp, filepath)
+
+    @classmethod
+    def load(cls, filepath, groupings=default_groupings):
+        saved = np.load(filepath)
+        if tuple(saved['units']) != units:
+            raise ValueError('{0} was saved with different saccharide units'.format(filepath))
+        return cls(saved['counts'], saved['valid'], groupings)
+
+    def column(self, name):
+        '''
+        Returns the count of `name` (a group or unit) in every record.
+        '''
+        if name not in self._columns:
+            self._columns[name] = self.counts[:, unit_mask(name, self.groupings)].sum(axis=1)
+        return self._columns[name]
+
+    def only(self, composition):
+        '''
+        Returns a boolean array marking the records with no residues of any
+        unit not named in `composition`.
+        '''
+        covered = np.zeros(len(units), dtype=bool)
+        for name in composition:
+            covered |= unit_mask(name, self.groupings)
+        return self.counts[:, ~covered].sum(axis=1) == 0
+
+    def select(self, keep):
+        return np.flatnonzero(keep & self.valid)
+
+    def exact(self, composition):
+        '''
+        Returns the records whose composition is exactly `composition` (see
+        `parse_composition`): every named count is as given, and there are no
+        residues of any other unit.
+        '''
+        composition = parse_composition(composition)
+        keep = self.only(composition)
+        for name, count in composition.items():
+            keep &= self.column(name) == count
+        return self.select(keep)
+
+    def in_range(self, lower=None, upper=None):
+        '''
+        Returns the records with at least `lower[name]` and at most
+        `upper[name]` of each name given in the compositions `lower` and
+        `upper` (names not given are unconstrained).
+        '''
+        keep = np.ones(len(self), dtype=bool)
+        for name, count in parse_composition(lower or {}).items():
+            keep &= self.column(name) >= count
+        for name, count in parse_composition(upper or {}).items():
+            keep &= self.column(name) <= count
+        return self.select(keep)
+
+    def containing(self, composition):
+        '''
+        Returns the records whose composition includes `composition`.
+        '''
+        return self.in_range(lower=composition)
+
+    def contained_in(self, composition):
+        '''
+        Returns the records whose composition is included in `composition`: at
+        most the given count of each name, and no residues of any other unit.
+        '''
+        composition = parse_composition(composition)
+        keep = self.only(composition)
+        for name, count in composition.items():
+            keep &= self.column(name) <= count
+        return self.select(keep)
@@ -0,0 +1,237 @@
+'''
+Tree edit distances between glycans, for clustering related structures and
+ranking near misses.
+
+Glycans are compared as their canonical trees (see `gregex.canonicalize_tree`),
+so the order branches happen to be written in doesn't matter, using Zhang and
+Shasha's ordered tree edit distance. (Unordered tree edit distance is NP-hard
+in general; on canonical trees the ordered distance is an upper bound on it
+that agrees with it whenever corresponding branches sort the same way.)
+
+Edit operations are deleting a residue, inserting one, and relabelling one,
+with costs given by an `EditCosts`.
+'''
+
+import multiprocessing
+from collections import Counter
+
+import numpy as np
+
+import gregex
+
+
+class EditCosts(object):
+    '''
+    Costs of edit operations on residues, each labelled by
+    (bare saccharide unit, bond type, bond location):
+      - inserting or deleting a residue costs `residue_costs[unit]`
+        (`default_residue_cost` for units not listed)
+      - relabelling a residue costs
+          - `unit_substitution_cost` (by default, the larger of the two
+            residues' costs) if the units differ, plus
+          - `bond_type_cost` if the bond types differ, plus
+          - `bond_location_cost` if the bond locations differ
+    '''
+    def __init__(self, residue_costs=None, default_residue_cost=1.0,
+                 unit_substitution_cost=None, bond_type_cost=0.5,
+                 bond_location_cost=0.5):
+        self.residue_costs = dict() if residue_costs is None else dict(residue_costs)
+        self.default_residue_cost = default_residue_cost
+        self.unit_substitution_cost = unit_substitution_cost
+        self.bond_type_cost = bond_type_cost
+        self.bond_location_cost = bond_location_cost
+
+    def indel(self, label):
+        return self.residue_costs.get(label[0], self.default_residue_cost)
+
+    def relabel(self, label_a, label_b):
+        cost = 0.0
+        if label_a[0] != label_b[0]:
+            if self.unit_substitution_cost is not None:
+                cost += self.unit_substitution_cost
+            else:
+                cost += max(self.indel(label_a), self.indel(label_b))
+        if label_a[1] != label_b[1]:
+            cost += self.bond_type_cost
+        if label_a[2] != label_b[2]:
+            cost += self.bond_location_cost
+        return cost
+
+    def minimum_unit_cost(self):
+        '''
+        A lower bound on the cost of any edit that changes a residue's unit.
+        '''
+        costs = [self.default_residue_cost] + list(self.residue_costs.values())
+        if self.unit_substitution_cost is not None:
+            costs.append(self.unit_substitution_cost)
+        return min(costs)
+
+
+default_costs = EditCosts()
+
+
+def prepare(linear_code_expression):
+    '''
+    Converts a glycan to the arrays Zhang-Shasha works over:
+        (postorder labels, leftmost leaf of each node, keyroots)
+    where nodes are numbered in postorder over the glycan's canonical tree.
+    '''
+    tree = gregex.canonicalize_tree(gregex.parse_exp(linear_code_expression, 'func-and-args'))
+    labels, leftmost = [], []
+
+    def visit(node):
+        first_leaf = None
+        for arg in node['args']:
+            child_leaf = visit(arg)
+            if first_leaf is None:
+                first_leaf = child_leaf
+        labels.append(gregex.split_bond_information(node['func']))
+        leftmost.append(first_leaf if first_leaf is not None else len(labels) - 1)
+        return leftmost[-1]
+
+    visit(tree)
+    keyroots = sorted(dict((leaf, i) for i, leaf in enumerate(leftmost)).values())
+    return tuple(labels), tuple(leftmost), tuple(keyroots)
+
+
+def prepared_distance(prepared_a, prepared_b, costs=default_costs):
+    '''
+    Returns the tree edit distance between two glycans converted by `prepare`.
+    '''
+    labels_a, leftmost_a, keyroots_a = prepared_a
+    labels_b, leftmost_b, keyroots_b = prepared_b
+    n, m = len(labels_a), len(labels_b)
+    delete = [costs.indel(label) for label in labels_a]
+    insert = [costs.indel(label) for label in labels_b]
+    relabel = [[costs.relabel(a, b) for b in labels_b] for a in labels_a]
+
+    tree_distance = [[0.0] * m for _ in range(n)]
+    for i in keyroots_a:
+        for j in keyroots_b:
+            i0, j0 = leftmost_a[i], leftmost_b[j]
+            rows, cols = i - i0 + 2, j - j0 + 2
+            forest = [[0.0] * cols for _ in range(rows)]
+            for x in range(1, rows):
+                forest[x][0] = forest[x - 1][0] + delete[i0 + x - 1]
+            for y in range(1, cols):
+                forest[0][y] = forest[0][y - 1] + insert[j0 + y - 1]
+            for x in range(1, rows):
+                di = i0 + x - 1
+                for y in range(1, cols):
+                    dj = j0 + y - 1
+                    if leftmost_a[di] == i0 and leftmost_b[dj] == j0:
+                        d = min(forest[x - 1][y] + delete[di],
+                                forest[x][y - 1] + insert[dj],
+                                forest[x - 1][y - 1] + relabel[di][dj])
+                        forest[x][y] = d
+                        tree_distance[di][dj] = d
+                    else:
+                        forest[x][y] = min(forest[x - 1][y] + delete[di],
+                                           forest[x][y - 1] + insert[dj],
+                                           forest[leftmost_a[di] - i0][leftmost_b[dj] - j0]
+                                           + tree_distance[di][dj])
+    return tree_distance[n - 1][m - 1]
+
+
+def lower_bound(prepared_a, prepared_b, costs=default_costs):
+    '''
+    Returns a cheap lower bound on the tree edit distance between two glycans
+    converted by `prepare`: every residue unit one has more of than the other
+    needs an edit changing its unit, and each edit fixes at most one on each
+    side.
+    '''
+    units_a = Counter(label[0] for label in prepared_a[0])
+    units_b = Counter(label[0] for label in prepared_b[0])
+    excess_a = sum((units_a - units_b).values())
+    excess_b = sum((units_b - units_a).values())
+    return max(excess_a, excess_b) * costs.minimum_unit_cost()
+
+
+def tree_edit_distance(linear_code_expression_a, linear_code_expression_b,
+                       costs=default_costs, threshold=None):
+    '''
+    Returns the tree edit distance between two glycans under `costs`.
+
+    If `threshold` is given, returns None as soon as the distance is known to
+    exceed it - often from `lower_bound` alone, without running the dynamic
+    program.
+    '''
+    a = prepare(linear_code_expression_a)
+    b = prepare(linear_code_expression_b)
+    if threshold is not None and lower_bound(a, b, costs) > threshold:
+        return None
+    distance = prepared_distance(a, b, costs)
+    if threshold is not None and distance > threshold:
+        return None
+    return distance
+
+
+def within_distance(query, linear_code_expressions, threshold, costs=default_costs):
+    '''
+    Returns (index, distance) for each of `linear_code_expressions` within
+    tree edit distance `threshold` of `query`, nearest first. Candidates are
+    screened with `lower_bound` before any distance is computed.
+    '''
+    prepared_query = prepare(query)
+    result = []
+    for index, lce in enumerate(linear_code_expressions):
+        candidate = prepare(lce)
+        if lower_bound(prepared_query, candidate, costs) > threshold:
+            continue
+        distance = prepared_distance(prepared_query, candidate, costs)
+        if distance <= threshold:
+            result.append((index, distance))
+    return sorted(result, key=lambda pair: (pair[1], pair[0]))
+
+
+def matrix_row(prepared, costs, i):
+    return i, [prepared_distance(prepared[i], prepared[j], costs)
+               for j in range(i + 1, len(prepared))]
+
+
+# Workers are handed the corpus once, by the pool initializer, instead of with
+# every task. Only worker processes set this, so concurrent calls in one
+# process never share it.
+_matrix_worker_state = dict()
+
+
+def _init_matrix_worker(prepared, costs):
+    _matrix_worker_state['prepared'], _matrix_worker_state['costs'] = prepared, costs
+
+
+def _matrix_row(i):
+    return matrix_row(_matrix_worker_state['prepared'], _matrix_worker_state['costs'], i)
+
+
+def distance_matrix(linear_code_expressions, costs=default_costs,
+                    processes=None, filepath=None):
+    '''
+    Returns the symmetric matrix (a NumPy array) of tree edit distances between
+    every pair of `linear_code_expressions`, computed across `processes`
+    worker processes (by default, one per core; 1 computes it in this
+    process). If `filepath` is given, the matrix is also saved there with
+    `numpy.save`.
+    '''
+    prepared = [prepare(lce) for lce in linear_code_expressions]
+    n = len(prepared)
+    matrix = np.zeros((n, n))
+    pool = (multiprocessing.Pool(processes, _init_matrix_worker, (prepared, costs))
+            if processes != 1 else None)
+    try:
+        if pool is None:
+            rows = (matrix_row(prepared, costs, i) for i in range(n))
+        else:
+            # longest rows first, so no worker is left with a long row at the end
+            rows = pool.imap_unordered(_matrix_row, range(n))
+        for i, row in rows:
+            matrix[i, i + 1:] = row
+            matrix[i + 1:, i] = row
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if filepath is not None:
+        np.save(filepath, matrix)
+    return matrix
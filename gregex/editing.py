@@ -0,0 +1,236 @@
+'''
+An editable linear code expression for interactive tools (e.g. a glycan
+editor) that grow or change a structure one residue or branch at a time.
+
+`EditableExpression` keeps the expression's tokens, its paren-depth profile,
+its well-formedness and the spans matching each uncertainty operator up to
+date as it is edited, redoing only the work an edit can affect:
+  - only the edited characters (plus any token reaching into them from the
+    left) are re-tokenized;
+  - the Earley recognizer resumes from the Earley set at the edit, since each
+    set depends only on the tokens before it;
+  - only operator matches touching the edited region are recomputed; matches
+    entirely before or after it are kept (the latter shifted).
+'''
+
+import gregex
+
+vocabulary = set(gregex.parentheses) | gregex.SUs_with_bonds | gregex.SU_bare
+max_token_length = max(map(len, vocabulary))
+
+
+def token_ending_at(text, end):
+    '''
+    Returns the token `tokenizer` would choose ending at character `end` of
+    `text`: the shortest suffix of text[:end] that is a token.
+    '''
+    for length in range(1, min(max_token_length, end) + 1):
+        if text[end - length:end] in vocabulary:
+            return text[end - length:end]
+    e = 'Untokenizable text ending at character {0}: {1}'
+    raise Exception(e.format(end, text[:end]))
+
+
+def terminals(token):
+    '''
+    Returns the grammar terminals (see `tokenizer(lce, True)`) of one token.
+    '''
+    if token in gregex.parentheses:
+        return (token,)
+    return tuple(part for part in gregex.split_bond_information(token) if part != '')
+
+
+def operator_spans(tokens, uncertainty_operator, region_start=0, region_end=None):
+    '''
+    Returns the spans (i, j) with tokens[i:j] a nonempty match of
+    `uncertainty_operator` that touch the region of tokens
+    [region_start, region_end): i < region_end and j > region_start. (By
+    default, the region is all of `tokens`.)
+
+    All start indices are swept left to right at once, with starts whose
+    automaton states coincide merged into one group, so the sweep costs
+    O(len(tokens) * number of distinct states) plus the size of the output.
+    '''
+    initial, step, accepts = gregex.operator_automata[uncertainty_operator]
+    deltas = [gregex.paren_delta.get(token, 0) for token in tokens]
+    n = len(tokens)
+    if region_end is None:
+        region_end = n
+
+    spans = []
+    groups = dict()
+    for k in range(n):
+        if k < region_end:
+            groups.setdefault(initial, []).append(k)
+        elif not groups:
+            break
+        stepped = dict()
+        for state, starts in groups.items():
+            state = step(state, deltas[k])
+            if state is not None:
+                stepped.setdefault(state, []).extend(starts)
+        groups = stepped
+        if k + 1 > region_start:
+            for state, starts in groups.items():
+                if accepts(state):
+                    spans.extend((i, k + 1) for i in starts)
+    return spans
+
+
+class EditableExpression(object):
+    '''
+    A linear code expression supporting `insert`, `delete` and `replace` at
+    token positions, keeping up to date
+      - `tokens` (as `tokenizer` would tokenize `text`)
+      - `depths`, the paren depth before each token (and at the end)
+      - `wff()`, well-formedness under a grammar (see `get_grammar`)
+      - `match_spans(op)`, the spans of tokens matching each operator
+    '''
+    def __init__(self, linear_code_expression='', grammar=None):
+        self.grammar = gregex.get_grammar(grammar)
+        self.text = ''
+        self.tokens = []
+        self.starts = []
+        self.terminal_counts = []
+        self.depths = [0]
+        self.chart = None
+        self._wff = None
+        self.spans = dict((op, set()) for op in gregex.operator_automata)
+        if linear_code_expression != '':
+            self.insert(0, linear_code_expression)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'EditableExpression({0!r})'.format(self.text)
+
+    def insert(self, position, fragment):
+        '''
+        Inserts the linear code `fragment` before the token at `position`.
+        '''
+        self.replace(position, position, fragment)
+
+    def delete(self, start, end):
+        '''
+        Deletes tokens[start:end].
+        '''
+        self.replace(start, end, '')
+
+    def replace(self, start, end, fragment):
+        '''
+        Replaces tokens[start:end] with the linear code `fragment`. Raises an
+        exception (leaving the expression unchanged) if the result cannot be
+        tokenized.
+        '''
+        assert 0 <= start <= end <= len(self.tokens), "Invalid token range: {0}:{1}".format(start, end)
+        text_start = self.starts[start] if start < len(self.tokens) else len(self.text)
+        text_end = self.starts[end] if end < len(self.tokens) else len(self.text)
+        text = self.text[:text_start] + fragment + self.text[text_end:]
+
+        # Tokens after the edit are unchanged (each token depends only on its
+        # own characters); tokenize leftwards from the end of the fragment
+        # until reaching a token boundary at or before the edit.
+        boundaries = dict((char, i) for i, char in enumerate(self.starts[:start]))
+        boundaries[text_start] = start
+        position = text_start + len(fragment)
+        fresh = []
+        while position > 0 and not (position <= text_start and position in boundaries):
+            token = token_ending_at(text, position)
+            fresh.append(token)
+            position -= len(token)
+        first = boundaries.get(position, 0)
+        fresh.reverse()
+        self._splice(first, end, fresh, text)
+
+    def _splice(self, first, end, fresh, text):
+        '''
+        Replaces tokens[first:end] with the tokens `fresh`, `text` being the
+        resulting expression, and brings everything derived from the tokens up
+        to date.
+        '''
+        shift = len(fresh) - (end - first)
+        char_shift = len(text) - len(self.text)
+        fresh_starts, char = [], self.starts[first] if first < len(self.tokens) else len(self.text)
+        for token in fresh:
+            fresh_starts.append(char)
+            char += len(token)
+
+        terminal_start = sum(self.terminal_counts[:first])
+        self.text = text
+        self.tokens[first:end] = fresh
+        self.starts[first:end] = fresh_starts
+        for k in range(first + len(fresh), len(self.starts)):
+            self.starts[k] += char_shift
+        self.terminal_counts[first:end] = [len(terminals(token)) for token in fresh]
+
+        del self.depths[first + 1:]
+        for token in self.tokens[first:]:
+            self.depths.append(self.depths[-1] + gregex.paren_delta.get(token, 0))
+
+        if self.chart is not None:
+            sets, waiting = self.chart
+            k = min(terminal_start, len(sets) - 1)
+            self.chart = (sets[:k + 1], waiting[:k])
+        self._wff = None
+
+        region_end = first + len(fresh)
+        for op, spans in self.spans.items():
+            kept = set((i, j) for i, j in spans if j <= first)
+            kept.update((i + shift, j + shift) for i, j in spans if i >= end)
+            kept.update(operator_spans(self.tokens, op, first, region_end))
+            self.spans[op] = kept
+
+    @property
+    def min_depth(self):
+        '''
+        The lowest paren depth reached anywhere in the expression.
+        '''
+        return min(self.depths)
+
+    @property
+    def final_depth(self):
+        '''
+        The paren depth at the end of the expression.
+        '''
+        return self.depths[-1]
+
+    def balanced(self):
+        '''
+        Indicates whether the expression's parentheses are balanced.
+        '''
+        return self.min_depth == 0 and self.final_depth == 0
+
+    def wff(self):
+        '''
+        Indicates whether the expression is well-formed according to the
+        grammar, resuming the Earley recognizer from the last edit.
+        '''
+        if self._wff is None:
+            tokens = [t for token in self.tokens for t in terminals(token)]
+            self.chart = self.grammar.earley_chart(tokens, self.chart)
+            self._wff = self.grammar.accepts(self.chart[0], len(tokens))
+        return self._wff
+
+    def match_spans(self, uncertainty_operator):
+        '''
+        Returns the sorted spans (i, j) such that tokens[i:j] is a nonempty
+        match of `uncertainty_operator` (cf. `gregex.iter_match_spans`).
+        '''
+        return sorted(self.spans[uncertainty_operator])
+
+    def matches(self, uncertainty_operator, with_contexts=False):
+        '''
+        Returns what `gregex.analyze_matches(text, uncertainty_operator,
+        with_context=with_contexts)` would: the sorted distinct matching
+        substrings, or (left context, match, right context) triples in span
+        order.
+        '''
+        spans = self.match_spans(uncertainty_operator)
+        if with_contexts:
+            return tuple(gregex.span_to_match(self.tokens, span, True) for span in spans)
+        distinct = sorted(set(tuple(self.tokens[i:j]) for i, j in spans))
+        return tuple(map(gregex.to_str, distinct))
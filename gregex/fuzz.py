@@ -0,0 +1,365 @@
+'''
+Differential fuzzing of gregex's fast paths against the reference
+implementations they replace.
+
+Each property pairs a generator of random cases with a reference engine and
+one or more candidate engines computing the same thing:
+  - 'tokenize'          : `tokenizer` (right-greedy) vs `bulk_tokenizer` and
+                          `editing.EditableExpression`
+  - 'wff'               : `RTF_UOF_g_string` through NLTK's chart parser vs the
+                          compiled Earley recognizer and `EditableExpression`
+  - 'parses'            : counting NLTK's parses one by one vs counting them
+                          in the shared packed parse forest
+  - 'matches'           : `generate_subsequences` + each operator's predicate
+                          vs `iter_matches` and `EditableExpression`
+  - 'distinct_matches'  : the same reference, deduplicated, vs
+                          `distinct_matches` and `analyze_matches`
+  - 'check_match'       : each operator's predicate + `has_balanced_parens`
+                          vs `check_match`
+  - 'instance'          : `matches_by_enumeration` vs `matches`
+  - 'compare_matches'   : `compare_matches` vs a partition computed with
+                          `distinct_matches`
+Cases are built from random well-formed glycans (see
+`benchmarks.random_glycan`), often mutated into near-well-formed ones, and
+random substitutions. Every engine's outcome on a case is its (normalized)
+result, or that it raised an exception; any disagreement is a mismatch, which
+is shrunk (by deleting ever smaller runs of tokens, then characters) to a
+minimal case on which the engines still disagree.
+
+Run as a script to fuzz every property:
+    python -m gregex.fuzz [N_CASES [SEED]]
+'''
+
+import random
+import sys
+from collections import OrderedDict
+from timeit import default_timer
+
+import gregex
+import benchmarks
+import bulk_tokenizer
+import editing
+
+mutation_tokens = ('(', ')', 'M', 'GN', 'Ma?', 'Ma3', 'GNb4', 'NNa6', 'S', 'Fa3')
+mutation_characters = '()Mab3468GNS-?x '
+
+
+##############
+# Generators #
+##############
+
+def mutate_tokens(tokens, rng):
+    '''
+    Applies one random token-level mutation to a copy of `tokens`: deleting,
+    duplicating or swapping tokens, or inserting a paren or saccharide unit.
+    '''
+    tokens = list(tokens)
+    k = rng.randrange(len(tokens) + 1)
+    mutation = rng.choice(('delete', 'duplicate', 'swap', 'insert', 'replace'))
+    if mutation == 'insert' or k == len(tokens):
+        tokens.insert(k, rng.choice(mutation_tokens))
+    elif mutation == 'delete':
+        del tokens[k]
+    elif mutation == 'duplicate':
+        tokens.insert(k, tokens[k])
+    elif mutation == 'swap' and k + 1 < len(tokens):
+        tokens[k], tokens[k + 1] = tokens[k + 1], tokens[k]
+    else:
+        tokens[k] = rng.choice(mutation_tokens)
+    return tokens
+
+
+def mutate_characters(text, rng):
+    '''
+    Applies one random character-level insertion or deletion to `text`.
+    '''
+    k = rng.randrange(len(text) + 1)
+    if k < len(text) and rng.random() < 0.5:
+        return text[:k] + text[k + 1:]
+    return text[:k] + rng.choice(mutation_characters) + text[k:]
+
+
+def random_expression(rng, max_residues=8, p_mutated=0.5, characters=False):
+    '''
+    Returns a random well-formed glycan with at most `max_residues` residues,
+    mutated with probability `p_mutated` by one to three token-level mutations
+    (and, if `characters` is True, sometimes character-level ones, which can
+    make it untokenizable). Otherwise, the expression is always tokenizable.
+    '''
+    tokens = gregex.tokenizer(benchmarks.random_glycan(rng.randint(1, max_residues), rng))
+    if rng.random() < p_mutated:
+        for _ in range(rng.randint(1, 3)):
+            tokens = mutate_tokens(tokens, rng)
+    text = gregex.to_str(tokens)
+    if characters and rng.random() < 0.25:
+        return mutate_characters(text, rng)
+    try:
+        gregex.tokenizer(text)
+    except Exception:
+        # adjacent mutated tokens can run together into untokenizable text
+        return random_expression(rng, max_residues, p_mutated, characters)
+    return text
+
+
+def random_span(tokens, rng):
+    i = rng.randrange(len(tokens) + 1)
+    return i, rng.randint(i, len(tokens))
+
+
+def random_substitution(rng, max_residues=8):
+    '''
+    Returns a random (pattern, substitution) pair: a random expression with a
+    random run of its tokens replaced by an operator token, and either that run
+    or a mutation of it.
+    '''
+    tokens = gregex.tokenizer(random_expression(rng, max_residues))
+    i, j = random_span(tokens, rng)
+    substitution = tokens[i:j]
+    if rng.random() < 0.5:
+        substitution = mutate_tokens(substitution, rng)
+    pattern = tokens[:i] + [rng.choice(gregex.uncertainty_operators)] + tokens[j:]
+    return gregex.to_str(pattern), gregex.to_str(substitution)
+
+
+#########################
+# Engines by property #
+#########################
+
+def by_tokenizer(text):
+    return tuple(gregex.tokenizer(text))
+
+
+def by_bulk_tokenizer(text):
+    # a final newline makes even an empty text one record
+    ids, offsets, errors = bulk_tokenizer.tokenize_buffer(text.encode('ascii') + b'\n')
+    if len(errors) > 0:
+        raise Exception('Untokenizable: {0}'.format(text))
+    return tuple(bulk_tokenizer.record_tokens(ids, offsets, 0))
+
+
+def by_editable_expression(text):
+    return tuple(editing.EditableExpression(text).tokens)
+
+
+predicates = {'...':gregex.is_ligand_match,
+              '_':gregex.is_continuation_match,
+              '|':gregex.is_possible_branch_point_match}
+
+
+def reference_matches(text, op):
+    subsequences = gregex.generate_subsequences(gregex.tokenizer(text), True, True)
+    return tuple(tuple(map(gregex.to_str, triple)) for triple in subsequences
+                 if predicates[op](triple[1]))
+
+
+def reference_distinct_matches(text, op):
+    return tuple(sorted(set(match for left, match, right in reference_matches(text, op))))
+
+
+def reference_check_match(pattern, substitution):
+    pieces = gregex.uncertainty_operator_pattern.split(pattern)
+    if len(pieces) != 3:
+        raise Exception('Expected one operator token in {0}'.format(pattern))
+    left, op, right = pieces
+    return bool(predicates[op](substitution) and
+                gregex.has_balanced_parens(left + substitution + right))
+
+
+def instance(pattern, substitution):
+    return gregex.uncertainty_operator_pattern.sub(lambda m: substitution, pattern)
+
+
+def spans_compare_matches(op_a, op_b, text):
+    tokens = gregex.tokenizer(text)
+    everything = set(gregex.to_str(tokens[i:j])
+                     for i in range(len(tokens)) for j in range(i + 1, len(tokens) + 1))
+    a = set(map(gregex.to_str, gregex.distinct_matches(tokens, op_a)))
+    b = set(map(gregex.to_str, gregex.distinct_matches(tokens, op_b)))
+    return {'both':a & b, 'just_A':a - b, 'just_B':b - a, 'neither':everything - (a & b)}
+
+
+def random_operator(rng):
+    return rng.choice(gregex.uncertainty_operators)
+
+
+properties = OrderedDict([
+    ('tokenize',
+     {'generate':lambda rng, n: (random_expression(rng, n, characters=True),),
+      'engines':OrderedDict([('tokenizer', by_tokenizer),
+                             ('bulk_tokenizer', by_bulk_tokenizer),
+                             ('editing', by_editable_expression)])}),
+    ('wff',
+     {'generate':lambda rng, n: (random_expression(rng, n),),
+      'engines':OrderedDict([('nltk', lambda text: gregex.wff(text, backend='nltk')),
+                             ('earley', lambda text: gregex.wff(text, backend='earley')),
+                             ('editing', lambda text: editing.EditableExpression(text).wff())])}),
+    ('parses',
+     {'generate':lambda rng, n: (random_expression(rng, n),),
+      'engines':OrderedDict([('nltk', lambda text: sum(1 for _ in gregex.get_parses(text))),
+                             ('forest', gregex.count_parses)])}),
+    ('matches',
+     {'generate':lambda rng, n: (random_expression(rng, n), random_operator(rng)),
+      'engines':OrderedDict([('generate_subsequences', reference_matches),
+                             ('iter_matches',
+                              lambda text, op: tuple(gregex.iter_matches(text, op, True))),
+                             ('editing',
+                              lambda text, op: editing.EditableExpression(text).matches(op, True))])}),
+    ('distinct_matches',
+     {'generate':lambda rng, n: (random_expression(rng, n), random_operator(rng)),
+      'engines':OrderedDict([('generate_subsequences', reference_distinct_matches),
+                             ('distinct_matches',
+                              lambda text, op: tuple(sorted(set(map(gregex.to_str,
+                                                                    gregex.distinct_matches(gregex.tokenizer(text), op)))))),
+                             ('analyze_matches',
+                              lambda text, op: tuple(sorted(gregex.analyze_matches(text, op))))])}),
+    ('check_match',
+     {'generate':lambda rng, n: random_substitution(rng, n),
+      'engines':OrderedDict([('predicates', reference_check_match),
+                             ('check_match', gregex.check_match)])}),
+    ('instance',
+     {'generate':lambda rng, n: random_substitution(rng, n),
+      'engines':OrderedDict([('matches_by_enumeration',
+                              lambda pattern, sub: gregex.matches_by_enumeration(pattern, instance(pattern, sub)) is not None),
+                             ('matches',
+                              lambda pattern, sub: gregex.matches(pattern, instance(pattern, sub)) is not None)])}),
+    ('compare_matches',
+     {'generate':lambda rng, n: (random_operator(rng), random_operator(rng), random_expression(rng, n)),
+      'engines':OrderedDict([('compare_matches', gregex.compare_matches),
+                             ('distinct_matches', spans_compare_matches)])}),
+])
+
+
+###########################
+# Running and shrinking #
+###########################
+
+def outcome(engine, case):
+    '''
+    Returns ('ok', result) or, if `engine` raises on `case`, ('error', message).
+    '''
+    try:
+        return ('ok', engine(*case))
+    except Exception as e:
+        return ('error', '{0}: {1}'.format(type(e).__name__, e))
+
+
+def agree(outcomes):
+    '''
+    Indicates whether all `outcomes` are equal, counting any two errors as
+    equal.
+    '''
+    kinds = [o if o[0] == 'ok' else ('error',) for o in outcomes]
+    return all(kind == kinds[0] for kind in kinds[1:])
+
+
+def disagree_on(engines, case):
+    return not agree([outcome(engine, case) for engine in engines.values()])
+
+
+def units(value):
+    '''
+    Splits a string into tokens if it can be tokenized, and characters
+    otherwise.
+    '''
+    try:
+        return gregex.tokenize_pattern(value)
+    except Exception:
+        return list(value)
+
+
+def shrink(case, fails):
+    '''
+    Returns a minimal variant of `case` (a tuple) on which `fails` still holds,
+    found by repeatedly deleting runs of tokens, halving the run length each
+    round down to single tokens, and then single characters, from each string
+    in the case.
+    '''
+    case = tuple(case)
+    changed = True
+    while changed:
+        changed = False
+        for c, value in enumerate(case):
+            if not isinstance(value, str) or value in gregex.uncertainty_operators:
+                continue
+            for split in (units, list):
+                pieces = split(case[c])
+                run = max(len(pieces) // 2, 1)
+                while run >= 1 and pieces:
+                    k = 0
+                    while k < len(pieces):
+                        candidate = case[:c] + (gregex.to_str(pieces[:k] + pieces[k + run:]),) + case[c + 1:]
+                        if fails(candidate):
+                            case, pieces, changed = candidate, pieces[:k] + pieces[k + run:], True
+                        else:
+                            k += run
+                    run //= 2
+    return case
+
+
+def fuzz_property(name, n_cases=1000, seed=0, max_residues=8, max_reported=5,
+                  shrink_mismatches=True):
+    '''
+    Runs every engine of property `name` (see `properties`) on `n_cases`
+    random cases and returns a dict with
+      - 'cases'      : the number of cases
+      - 'mismatched' : the number of cases on which the engines disagreed
+      - 'mismatches' : for (at most `max_reported` of) those, dicts with the
+                       'case', its shrunk form 'shrunk' and each engine's
+                       'outcomes' on the shrunk case
+      - 'seconds'    : the total time spent in each engine
+      - 'throughput' : the cases per second each engine handled
+    '''
+    spec = properties[name]
+    engines = spec['engines']
+    rng = random.Random(seed)
+    seconds = OrderedDict((engine_name, 0.0) for engine_name in engines)
+    mismatched, mismatches = 0, []
+    for _ in range(n_cases):
+        case = spec['generate'](rng, max_residues)
+        outcomes = []
+        for engine_name, engine in engines.items():
+            start = default_timer()
+            outcomes.append(outcome(engine, case))
+            seconds[engine_name] += default_timer() - start
+        if agree(outcomes):
+            continue
+        mismatched += 1
+        if len(mismatches) < max_reported:
+            shrunk = shrink(case, lambda c: disagree_on(engines, c)) if shrink_mismatches else case
+            mismatches.append({'case':case,
+                               'shrunk':shrunk,
+                               'outcomes':OrderedDict((engine_name, outcome(engine, shrunk))
+                                                      for engine_name, engine in engines.items())})
+    throughput = OrderedDict((engine_name, n_cases / s if s > 0 else float('inf'))
+                             for engine_name, s in seconds.items())
+    return {'cases':n_cases,
+            'mismatched':mismatched,
+            'mismatches':mismatches,
+            'seconds':seconds,
+            'throughput':throughput}
+
+
+def fuzz(n_cases=1000, seed=0, names=None, max_residues=8, max_reported=5):
+    '''
+    Runs `fuzz_property` for each property in `names` (by default, all of
+    `properties`) and returns an OrderedDict of their reports.
+    '''
+    names = list(properties) if names is None else names
+    return OrderedDict((name, fuzz_property(name, n_cases, seed, max_residues, max_reported))
+                       for name in names)
+
+
+if __name__ == '__main__':
+    n_cases = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    total = 0
+    for name, report in fuzz(n_cases, seed).items():
+        total += report['mismatched']
+        print('{0}: {1} of {2} cases mismatched'.format(name, report['mismatched'], report['cases']))
+        for engine_name, rate in report['throughput'].items():
+            print('\t{0}: {1:.1f} cases/s'.format(engine_name, rate))
+        for mismatch in report['mismatches']:
+            print('\tshrunk case: {0!r}'.format(mismatch['shrunk']))
+            for engine_name, o in mismatch['outcomes'].items():
+                print('\t\t{0}: {1!r}'.format(engine_name, o))
+    sys.exit(1 if total > 0 else 0)
@@ -6,13 +6,22 @@ illuminate the behavior of Krambeck et al.'s uncertainty operators.
 #str_join, what else???
 from funcy import *
 
-from itertools import product
+from itertools import product, islice
 
 from copy import deepcopy
 
 from collections import OrderedDict
 from json import dumps
 
+import os
+import re
+import hashlib
+import pickle
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+from array import array
+from collections import deque, defaultdict
+
 import nltk
 
 import glypy
@@ -413,7 +422,7 @@ def tokenizer(linear_code_expression, tokenize_saccharide_units=False):
 # and the identities
 #  X* = XP -> '' | XP X
 #  X+ = XP -> X  | XP X
-RTF_UOF_g = nltk.CFG.fromstring("""
+RTF_UOF_g_string = """
     exp -> subexp non_main_branch_phrase stem | stem | empty
     stem -> SU_with_bond_info_phrase_star SU_bare
     non_main_branch_phrase -> non_main_branch_phrase non_main_branch | empty
@@ -427,38 +436,400 @@ RTF_UOF_g = nltk.CFG.fromstring("""
     bond_location -> '1' | '2' | '3' | '4' | '5' | '6' | '7' | '8' | '9' | '?'
     SU_bare -> 'A' | 'AN' | 'B' | 'E' | 'F' | 'G' | 'GN' | 'G[Q]' | 'H' | 'H[2Q, 4Q]' | 'I' | 'K' | 'L' | 'M' | 'NG' | 'NJ' | 'NN' | 'NN[9N]' | 'N[5Q]' | 'O' | 'P' | 'PH' | 'R' | 'S' | 'U' | 'W' | 'X'
     empty ->
-""")
+"""
+
+# The grammar is compiled (and, for NLTK, parsed into an `nltk.CFG`) only when
+# first used; see `get_grammar`.
+
+
+#########################################
+# Compiled grammars and on-disk caching #
+#########################################
+
+# Bump whenever the layout of compiled grammar tables changes, so that stale
+# cache entries are ignored rather than misread.
+grammar_table_format = 1
+
+
+def gregex_cache_dir(*subdirectories):
+    '''
+    Returns the path of (and creates if necessary) the directory gregex caches
+    data in, joined with `subdirectories`.
+
+    The cache root is `$GREGEX_CACHE_DIR` if that is set and `~/.cache/gregex`
+    otherwise.
+    '''
+    default_root = os.path.join(os.path.expanduser('~'), '.cache', 'gregex')
+    root = os.environ.get('GREGEX_CACHE_DIR', default_root)
+    path = os.path.join(root, *subdirectories)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def grammar_digest(grammar_string):
+    '''
+    Returns a hex digest identifying the content of `grammar_string` (and the
+    compiled table format).
+    '''
+    if not isinstance(grammar_string, bytes):
+        grammar_string = grammar_string.encode('utf-8')
+    h = hashlib.sha256(grammar_string)
+    h.update(str(grammar_table_format).encode('utf-8'))
+    return h.hexdigest()
+
+
+def compile_grammar_tables(cfg):
+    '''
+    Compiles an `nltk.CFG` into the tables used by `CompiledGrammar`'s Earley
+    recognizer. Symbols are interned as integers (nonterminals first), and
+    every dotted production ('LR(0) item') gets an integer id such that
+    advancing the dot over a symbol is just `item + 1`.
+
+    Returns a dict with entries
+      - 'symbols'         : symbol names, indexed by symbol id
+      - 'n_nonterminals'  : symbols with smaller ids are nonterminals
+      - 'start'           : the start symbol's id
+      - 'terminals'       : terminal string -> symbol id
+      - 'nullable'        : per nonterminal, whether it can derive ''
+      - 'item_next'       : per item, the symbol after the dot (-1 if none)
+      - 'item_lhs'        : per item, the left-hand side of its production
+      - 'item_production' : per item, the index of its production
+      - 'item_dot'        : per item, the position of its dot
+      - 'productions'     : (lhs, rhs) per production, as symbol ids
+      - 'predict'         : per nonterminal, the dot-initial items of every
+                            production Earley prediction would (transitively)
+                            add when that nonterminal is expected
+      - 'predicted'       : per nonterminal, the set of nonterminals whose
+                            productions are in its 'predict' entry
+    '''
+    productions = cfg.productions()
+    nonterminals = list(distinct([cfg.start().symbol()] +
+                                 [p.lhs().symbol() for p in productions]))
+    nonterminal_ids = dict((nt, i) for i, nt in enumerate(nonterminals))
+    terminals = list(distinct(sym for p in productions for sym in p.rhs()
+                              if not isinstance(sym, nltk.Nonterminal)))
+    n_nonterminals = len(nonterminals)
+    terminal_ids = dict((t, n_nonterminals + i) for i, t in enumerate(terminals))
+
+    def symbol_id(sym):
+        if isinstance(sym, nltk.Nonterminal):
+            return nonterminal_ids[sym.symbol()]
+        return terminal_ids[sym]
+
+    coded = [(nonterminal_ids[p.lhs().symbol()],
+              tuple(map(symbol_id, p.rhs())))
+             for p in productions]
+
+    nullable = [False] * n_nonterminals
+    changed = True
+    while changed:
+        changed = False
+        for lhs, rhs in coded:
+            if not nullable[lhs] and all(sym < n_nonterminals and nullable[sym]
+                                         for sym in rhs):
+                nullable[lhs] = changed = True
+
+    item_next, item_lhs, item_production, item_dot = [], [], [], []
+    first_item = []
+    for p_index, (lhs, rhs) in enumerate(coded):
+        first_item.append(len(item_next))
+        for dot in range(len(rhs) + 1):
+            item_next.append(rhs[dot] if dot < len(rhs) else -1)
+            item_lhs.append(lhs)
+            item_production.append(p_index)
+            item_dot.append(dot)
+
+    productions_of = [[] for _ in range(n_nonterminals)]
+    for p_index, (lhs, rhs) in enumerate(coded):
+        productions_of[lhs].append(p_index)
+
+    # nonterminals that can appear leftmost (modulo nullable prefixes) in a
+    # right-hand side of each nonterminal
+    left_corners = [set() for _ in range(n_nonterminals)]
+    for lhs, rhs in coded:
+        for sym in rhs:
+            if sym >= n_nonterminals:
+                break
+            left_corners[lhs].add(sym)
+            if not nullable[sym]:
+                break
+
+    predict, predicted = [], []
+    for nt in range(n_nonterminals):
+        reached, frontier = set([nt]), [nt]
+        while frontier:
+            for corner in left_corners[frontier.pop()]:
+                if corner not in reached:
+                    reached.add(corner)
+                    frontier.append(corner)
+        predicted.append(reached)
+        predict.append(tuple(first_item[p_index]
+                             for each in sorted(reached)
+                             for p_index in productions_of[each]))
+
+    return {'symbols':tuple(nonterminals) + tuple(terminals),
+            'n_nonterminals':n_nonterminals,
+            'start':nonterminal_ids[cfg.start().symbol()],
+            'terminals':terminal_ids,
+            'nullable':nullable,
+            'item_next':item_next,
+            'item_lhs':item_lhs,
+            'item_production':item_production,
+            'item_dot':item_dot,
+            'productions':coded,
+            'predict':predict,
+            'predicted':predicted}
+
+
+class CompiledGrammar(object):
+    '''
+    A context-free grammar (written in `nltk.CFG.fromstring` syntax over the
+    tokens of `tokenizer(lce, True)`) compiled once into tables for a
+    table-driven Earley recognizer.
+
+    `recognize` decides membership without building any parse trees;
+    `parse_forest` packs every parse into a shared forest, and `chart_parser`
+    gives an NLTK parser over the same grammar.
+    '''
+    def __init__(self, grammar_string, tables):
+        self.grammar_string = grammar_string
+        self.digest = grammar_digest(grammar_string)
+        self.tables = tables
+        self._cfg = None
+        self._chart_parser = None
+
+    @property
+    def cfg(self):
+        if self._cfg is None:
+            self._cfg = nltk.CFG.fromstring(self.grammar_string)
+        return self._cfg
+
+    def chart_parser(self):
+        if self._chart_parser is None:
+            self._chart_parser = nltk.parse.chart.ChartParser(self.cfg)
+        return self._chart_parser
+
+    def earley_chart(self, tokens, prefix_chart=None):
+        '''
+        Runs the Earley recognizer over `tokens` and returns its chart
+            (list of Earley sets, list of waiting items per set)
+        where each Earley set is a set of (item, origin) pairs. Recognition
+        stops early (with fewer than len(tokens) + 1 sets) if the input cannot
+        be parsed.
+
+        Earley set k depends only on the first k tokens, so if `prefix_chart`
+        is a chart returned for an input sharing its first k tokens with
+        `tokens`, passing
+            (sets[:k+1], waiting[:k])
+        resumes recognition at token k instead of starting over.
+        '''
+        t = self.tables
+        item_next, item_lhs = t['item_next'], t['item_lhs']
+        predict, predicted, nullable = t['predict'], t['predicted'], t['nullable']
+        n_nonterminals = t['n_nonterminals']
+        terminals = t['terminals']
+
+        symbols = [terminals.get(token) for token in tokens]
+        n = len(symbols)
+        if prefix_chart is None:
+            sets = [set((item, 0) for item in predict[t['start']])]
+            waiting = []
+        else:
+            sets, waiting = list(prefix_chart[0]), list(prefix_chart[1])
+            assert len(sets) == len(waiting) + 1 and len(sets) <= n + 1
+        for k in range(len(sets) - 1, n + 1):
+            current = sets[k]
+            waiting.append(dict())
+            waiting_k = waiting[k]
+            next_set = set()
+            already_predicted = set()
+            agenda = list(current)
+            while agenda:
+                item, origin = agenda.pop()
+                sym = item_next[item]
+                if sym == -1:
+                    for w_item, w_origin in waiting[origin].get(item_lhs[item], ()):
+                        advanced = (w_item + 1, w_origin)
+                        if advanced not in current:
+                            current.add(advanced)
+                            agenda.append(advanced)
+                elif sym < n_nonterminals:
+                    waiting_k.setdefault(sym, []).append((item, origin))
+                    if sym not in already_predicted:
+                        already_predicted.update(predicted[sym])
+                        for p_item in predict[sym]:
+                            if (p_item, k) not in current:
+                                current.add((p_item, k))
+                                agenda.append((p_item, k))
+                    if nullable[sym] and (item + 1, origin) not in current:
+                        current.add((item + 1, origin))
+                        agenda.append((item + 1, origin))
+                elif k < n and symbols[k] == sym:
+                    next_set.add((item + 1, origin))
+            if k == n:
+                break
+            if not next_set:
+                break
+            sets.append(next_set)
+        return sets, waiting
+
+    def earley_sets(self, tokens):
+        '''
+        Runs the Earley recognizer over `tokens` and returns the list of Earley
+        sets (each a set of (item, origin) pairs), stopping early (with fewer
+        than len(tokens) + 1 sets) if the input cannot be parsed.
+        '''
+        return self.earley_chart(tokens)[0]
+
+    def accepts(self, sets, n_tokens):
+        '''
+        Indicates whether the Earley sets `sets` for an input of `n_tokens`
+        tokens recognize it.
+        '''
+        t = self.tables
+        if len(sets) != n_tokens + 1:
+            return False
+        start, item_next, item_lhs = t['start'], t['item_next'], t['item_lhs']
+        return any(origin == 0 and item_next[item] == -1 and item_lhs[item] == start
+                   for item, origin in sets[-1])
+
+    def recognize(self, tokens):
+        '''
+        Indicates whether `tokens` (a sequence of terminals) is generated by
+        the grammar.
+        '''
+        return self.accepts(self.earley_sets(tokens), len(tokens))
+
+    def parse_forest(self, tokens):
+        '''
+        Returns the shared packed parse forest (a `ParseForest`) of `tokens`,
+        or None if the grammar does not generate them.
+        '''
+        sets = self.earley_sets(tokens)
+        if not self.accepts(sets, len(tokens)):
+            return None
+        return ParseForest(self, tokens, sets)
+
+
+compiled_grammars = dict()
+
+
+def compile_grammar(grammar_string, use_cache=True):
+    '''
+    Returns a `CompiledGrammar` for `grammar_string` (in `nltk.CFG.fromstring`
+    syntax).
 
-RTF_UOF_g_parser = nltk.parse.chart.ChartParser(RTF_UOF_g)
+    Compiled tables are memoized in-process and, if `use_cache` is True, also
+    stored on disk under `gregex_cache_dir('grammars')`, keyed by the content
+    of the grammar, so each grammar is only ever compiled once.
+    '''
+    digest = grammar_digest(grammar_string)
+    if digest in compiled_grammars:
+        return compiled_grammars[digest]
+
+    cache_fp = os.path.join(gregex_cache_dir('grammars'), digest + '.pickle') if use_cache else None
+    tables = None
+    if cache_fp is not None and os.path.exists(cache_fp):
+        try:
+            with open(cache_fp, 'rb') as cache_file:
+                tables = pickle.load(cache_file)
+        except Exception:
+            tables = None
+    if tables is None:
+        tables = compile_grammar_tables(nltk.CFG.fromstring(grammar_string))
+        if cache_fp is not None:
+            temp_fp = '{0}.{1}.tmp'.format(cache_fp, os.getpid())
+            with open(temp_fp, 'wb') as cache_file:
+                pickle.dump(tables, cache_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_fp, cache_fp)
+
+    grammar = CompiledGrammar(grammar_string, tables)
+    compiled_grammars[digest] = grammar
+    return grammar
+
+
+def load_grammar(grammar_fp, use_cache=True):
+    '''
+    Reads a grammar file (in `nltk.CFG.fromstring` syntax, over the tokens
+    produced by `tokenizer(lce, True)`) and returns it as a `CompiledGrammar`.
+    '''
+    with open(grammar_fp, 'r') as grammar_file:
+        return compile_grammar(grammar_file.read(), use_cache)
 
 
-def get_parses(lce):
+def get_grammar(grammar=None):
+    '''
+    Resolves the `grammar` argument accepted throughout gregex to a
+    `CompiledGrammar`:
+      - None                    -> the default grammar, `RTF_UOF_g_string`
+      - a `CompiledGrammar`     -> itself
+      - a filepath              -> the grammar in that file
+      - any other string        -> the grammar it spells out
+    '''
+    if grammar is None:
+        return compile_grammar(RTF_UOF_g_string)
+    if isinstance(grammar, CompiledGrammar):
+        return grammar
+    if os.path.isfile(grammar):
+        return load_grammar(grammar)
+    return compile_grammar(grammar)
+
+
+def get_parses(lce, grammar=None, backend='nltk'):
     '''
     Given a linear code expression with no uncertainty operators (except
     potentially for bond type and/or bond location), this returns a generator
     yielding all parses for the expression.
 
+    `grammar` defaults to `RTF_UOF_g_string`; see `get_grammar` for other options.
+
+    `backend` is one of
+      - 'nltk'   : NLTK's chart parser
+      - 'forest' : enumeration of the shared packed parse forest (see
+                   `parse_forest`, which also counts parses without
+                   enumerating them)
+
     In the future, this may support linear code expressions containing more
     uncertainty operators.
     '''
+    assert backend in {'nltk', 'forest'}, "Unknown backend:\n\t{0}".format(backend)
     tokenized_lce = tokenizer(lce, True)
     #print(tokenized_lce)
-    parse_generator = RTF_UOF_g_parser.parse(tokenized_lce)
+    if backend == 'forest':
+        forest = get_grammar(grammar).parse_forest(tokenized_lce)
+        return forest.trees() if forest is not None else iter(())
+    parser = get_grammar(grammar).chart_parser()
+    parse_generator = parser.parse(tokenized_lce)
     return parse_generator
 
 
-def wff(lce):
+def wff(lce, grammar=None, backend='earley'):
     '''
     Given a linear code expression with no uncertainty operators (except
     potentially for bond type and/or bond location), this returns a Boolean
     indicating whether or not the expression has any parses = whether or not
     the expression is a well-formed formula according to the current grammar.
 
+    `grammar` defaults to `RTF_UOF_g_string`; see `get_grammar` for other options.
+
+    `backend` is one of
+      - 'earley' : the table-driven recognizer of `CompiledGrammar`
+      - 'nltk'   : NLTK's chart parser (the reference implementation, which 
+                   can be very slow and memory-hungry for large glycans)
+
     In the future, this may support linear code expressions containing more
     uncertainty operators.
     '''
+    assert backend in {'earley', 'nltk'}, "Unknown backend:\n\t{0}".format(backend)
+    if backend == 'earley':
+        return get_grammar(grammar).recognize(tokenizer(lce, True))
     try:
-        first_parse = get_parses(lce).next()
+        first_parse = next(get_parses(lce, grammar))
         return True
     except StopIteration:
         # for tree in get_parses(lce):
@@ -466,6 +837,266 @@ def wff(lce):
         return False
 
 
+###############################
+# Shared packed parse forests #
+###############################
+
+# Nodes of a parse forest are
+#   ('symbol', symbol id, i, k)       : the symbol derives tokens[i:k]
+#   ('prefix', item, i, k)            : the symbols before the dot of `item`
+#                                       derive tokens[i:k]
+# A nonterminal symbol node's alternatives are the 'prefix' nodes of its
+# completed items; a 'prefix' node's alternatives are the ways to split it into
+# a shorter prefix (None if that prefix is empty) and the symbol before the dot.
+# Every alternative is read off the Earley sets, so the whole forest takes
+# polynomial space however many parses it packs.
+
+
+class ParseForest(object):
+    '''
+    The shared packed parse forest of a token sequence under a
+    `CompiledGrammar`, built from its Earley sets (see
+    `CompiledGrammar.parse_forest`).
+
+    `count()` is the number of parses (float('inf') if a cyclic grammar gives
+    infinitely many), computed without enumerating them; `canonical_tree()`
+    extracts one parse cheaply; `trees()` enumerates them all.
+    '''
+    def __init__(self, grammar, tokens, sets):
+        t = grammar.tables
+        self.grammar = grammar
+        self.tokens = tuple(tokens)
+        self.symbols = [t['terminals'].get(token) for token in tokens]
+        self.n_nonterminals = t['n_nonterminals']
+        self.item_next, self.item_lhs = t['item_next'], t['item_lhs']
+        self.item_dot, self.item_production = t['item_dot'], t['item_production']
+        self.sets = sets
+        self.completed = []
+        for current in sets:
+            completed = dict()
+            for item, origin in current:
+                if self.item_next[item] == -1:
+                    completed.setdefault((self.item_lhs[item], origin), []).append(item)
+            for items in completed.values():
+                items.sort()
+            self.completed.append(completed)
+        self.root = ('symbol', t['start'], 0, len(tokens))
+        self.alternatives = dict()
+        self._counts = None
+        self._choices = None
+        self.build()
+
+    def symbol_before_dot(self, item):
+        return self.grammar.tables['productions'][self.item_production[item]][1][self.item_dot[item] - 1]
+
+    def expand(self, node):
+        '''
+        Returns the alternatives of `node` (see the comment above `ParseForest`).
+        '''
+        kind, x, i, k = node
+        if kind == 'symbol':
+            if x >= self.n_nonterminals:
+                return []
+            return [('prefix', item, i, k) for item in self.completed[k].get((x, i), ())]
+        if self.item_dot[x] == 0:
+            return []
+        previous, sym = x - 1, self.symbol_before_dot(x)
+        result = []
+        for m in range(i, k + 1):
+            if (previous, i) not in self.sets[m]:
+                continue
+            if sym >= self.n_nonterminals:
+                if m != k - 1 or self.symbols[m] != sym:
+                    continue
+            elif (sym, m) not in self.completed[k]:
+                continue
+            left = None if self.item_dot[previous] == 0 else ('prefix', previous, i, m)
+            result.append((left, ('symbol', sym, m, k)))
+        return result
+
+    def build(self):
+        '''
+        Expands every node reachable from the root.
+        '''
+        agenda = [self.root]
+        while agenda:
+            node = agenda.pop()
+            if node in self.alternatives:
+                continue
+            alternatives = self.expand(node)
+            self.alternatives[node] = alternatives
+            for alternative in alternatives:
+                for child in (alternative if node[0] == 'prefix' else (alternative,)):
+                    if child is not None and child not in self.alternatives:
+                        agenda.append(child)
+
+    def children(self, node, alternative):
+        if node[0] == 'symbol':
+            return (alternative,)
+        return tuple(child for child in alternative if child is not None)
+
+    def __len__(self):
+        return len(self.alternatives)
+
+    def count(self):
+        '''
+        Returns the number of parses.
+        '''
+        if self._counts is None:
+            self._analyze()
+        return self._counts[self.root]
+
+    def _analyze(self):
+        # Counts parses bottom-up in a depth-first postorder. An alternative
+        # leading back to a node still being visited lies on a cycle: it makes
+        # the count infinite and is never chosen for the canonical tree.
+        # `choices` gets an entry for every node with a finite derivation.
+        counts, choices = dict(), dict()
+        on_stack = set()
+        cyclic = set()
+        stack = [(self.root, 0)]
+        on_stack.add(self.root)
+        while stack:
+            node, a = stack[-1]
+            alternatives = self.alternatives[node]
+            if a < len(alternatives):
+                stack[-1] = (node, a + 1)
+                for child in self.children(node, alternatives[a]):
+                    if child in on_stack:
+                        cyclic.add((node, a))
+                    elif child not in counts:
+                        on_stack.add(child)
+                        stack.append((child, 0))
+                continue
+            stack.pop()
+            on_stack.discard(node)
+            kind, x, i, k = node
+            if (kind == 'symbol' and x >= self.n_nonterminals or
+                kind == 'prefix' and self.item_dot[x] == 0):
+                counts[node], choices[node] = 1, None
+                continue
+            total, choice = 0, None
+            for b, alternative in enumerate(alternatives):
+                if (node, b) in cyclic:
+                    total = float('inf')
+                    continue
+                children = self.children(node, alternative)
+                child_counts = [counts.get(child, 0) for child in children]
+                product = 0 if 0 in child_counts else 1
+                for child_count in child_counts:
+                    product *= child_count
+                # only alternatives with a finite derivation can be chosen
+                if choice is None and all(child in choices for child in children):
+                    choice = b
+                total += product
+            counts[node] = total
+            if choice is not None:
+                choices[node] = choice
+        self._counts, self._choices = counts, choices
+
+    def _tree(self, node):
+        '''
+        Returns the tree for `node` following the chosen alternatives: an
+        `nltk.Tree` for a nonterminal symbol, the token for a terminal, and a
+        list of subtrees for a prefix.
+        '''
+        kind, x, i, k = node
+        if kind == 'symbol' and x >= self.n_nonterminals:
+            return self.tokens[i]
+        if kind == 'prefix' and self.item_dot[x] == 0:
+            return []
+        choice = self._choices[node]
+        if kind == 'prefix':
+            left, right = self.alternatives[node][choice]
+            return (self._tree(left) if left is not None else []) + [self._tree(right)]
+        label = self.grammar.tables['symbols'][x]
+        return nltk.Tree(label, self._tree(self.alternatives[node][choice]))
+
+    def canonical_tree(self):
+        '''
+        Returns one parse as an `nltk.Tree`: at every node, the first
+        alternative (by production, then by split point) that has a finite
+        parse.
+        '''
+        if self._choices is None:
+            self._analyze()
+        if self.root not in self._choices:
+            raise ValueError('No finite parse could be extracted')
+        return self._tree(self.root)
+
+    def _trees(self, node, path):
+        kind, x, i, k = node
+        if kind == 'symbol' and x >= self.n_nonterminals:
+            yield self.tokens[i]
+            return
+        if kind == 'prefix' and self.item_dot[x] == 0:
+            yield []
+            return
+        path = path | set([node])
+        for alternative in self.alternatives[node]:
+            if any(child in path for child in self.children(node, alternative)):
+                continue
+            if kind == 'symbol':
+                for subtrees in self._trees(alternative, path):
+                    yield nltk.Tree(self.grammar.tables['symbols'][x], subtrees)
+                continue
+            left, right = alternative
+            lefts = self._trees(left, path) if left is not None else iter([[]])
+            for left_tree in lefts:
+                for right_tree in self._trees(right, path):
+                    yield left_tree + [right_tree]
+
+    def trees(self):
+        '''
+        Lazily generates every parse (every acyclic one, for a cyclic grammar)
+        as an `nltk.Tree`.
+        '''
+        return self._trees(self.root, frozenset())
+
+
+def parse_forest(lce, grammar=None):
+    '''
+    Returns the `ParseForest` of a linear code expression with no uncertainty
+    operators under `grammar` (by default `RTF_UOF_g_string`; see `get_grammar`), or
+    None if it has no parses.
+    '''
+    return get_grammar(grammar).parse_forest(tokenizer(lce, True))
+
+
+def count_parses(lce, grammar=None):
+    '''
+    Returns the number of parses of `lce` under `grammar` (see
+    `parse_forest`) without enumerating them.
+    '''
+    forest = parse_forest(lce, grammar)
+    return 0 if forest is None else forest.count()
+
+
+def canonical_parse(lce, grammar=None):
+    '''
+    Returns one parse of `lce` under `grammar` as an `nltk.Tree` (see
+    `ParseForest.canonical_tree`), or None if it has none.
+    '''
+    forest = parse_forest(lce, grammar)
+    return None if forest is None else forest.canonical_tree()
+
+
+def audit_ambiguity(lces, grammar=None):
+    '''
+    Counts the parses of each of `lces` under `grammar` and returns a dict with
+      - 'counts'    : a dict from number of parses to number of expressions
+      - 'ambiguous' : (expression, number of parses) for each expression with
+                      more than one parse
+    '''
+    counts, ambiguous = defaultdict(int), []
+    for lce in lces:
+        n = count_parses(lce, grammar)
+        counts[n] += 1
+        if n > 1:
+            ambiguous.append((lce, n))
+    return {'counts':dict(counts), 'ambiguous':ambiguous}
+
+
 ########################################
 # Conversion to JSON and s-expressions #
 ########################################
@@ -663,6 +1294,103 @@ def func_and_args_to_sexps(func_and_args, unwrap_leaves=False, separate_args=Fal
     return s
 
 
+##########################################
+# Canonical forms and structural hashing #
+##########################################
+
+
+def func_and_args_to_linear_code(func_and_args):
+    '''
+    Inverse of `parse_exp(..., 'func-and-args')`: writes a func-and-args tree
+    back out as linear code. The last argument of each node is written as the
+    continuation of the chain, and the others as parenthesized branches, the
+    first argument nearest the node.
+    '''
+    tree = func_and_args
+    args = tuple(tree['args'])
+    if len(args) == 0:
+        return tree['func']
+    branches, chain = args[:-1], args[-1]
+    return str_join('', [func_and_args_to_linear_code(chain)] +
+                        ['(' + func_and_args_to_linear_code(branch) + ')'
+                         for branch in reversed(branches)] +
+                        [tree['func']])
+
+
+def canonicalize_tree(func_and_args):
+    '''
+    Returns a copy of the func-and-args tree `func_and_args` with the
+    arguments of every node sorted in descending order of
+        (bond location, bond type, canonical linear code of the argument)
+    so that any two ways of writing the same glycan yield the same tree. The
+    last argument in this order is the one `func_and_args_to_linear_code`
+    writes as the chain continuation, so (as is conventional for linear code)
+    the branch with the lowest linkage position continues the chain and
+    higher ones are parenthesized.
+    '''
+    def key(arg):
+        SU_alone, bond_type, bond_location = split_bond_information(arg['func'])
+        return (bond_location, bond_type, func_and_args_to_linear_code(arg))
+    tree = OrderedDict()
+    tree['func'] = func_and_args['func']
+    tree['args'] = sorted(map(canonicalize_tree, func_and_args['args']),
+                          key=key, reverse=True)
+    return tree
+
+
+def canonical_linear_code(linear_code_expression):
+    '''
+    Returns the canonical linear code of `linear_code_expression`: the same
+    glycan with branches written in the order given by `canonicalize_tree`.
+    Two expressions describe the same tree iff their canonical linear codes
+    are equal.
+    '''
+    tree = parse_exp(linear_code_expression, 'func-and-args')
+    return func_and_args_to_linear_code(canonicalize_tree(tree))
+
+
+def subtree_hashes(func_and_args):
+    '''
+    Returns a list of (hash, subtree) pairs for every node of the func-and-args
+    tree `func_and_args`, children before parents (the last pair is the whole
+    tree's).
+
+    Hashes are Merkle-style: a node's hash digests its label together with the
+    sorted hashes of its arguments, so it depends only on the (unordered) tree
+    structure below the node and not on how branches were written.
+    '''
+    result = []
+
+    def visit(tree):
+        arg_hashes = sorted(visit(arg) for arg in tree['args'])
+        h = hashlib.sha1(str_join('\x00', [tree['func']] + arg_hashes).encode('utf-8'))
+        digest = h.hexdigest()
+        result.append((digest, tree))
+        return digest
+
+    visit(func_and_args)
+    return result
+
+
+def structural_hash(linear_code_expression):
+    '''
+    Returns a hash of the tree structure of `linear_code_expression` (see
+    `subtree_hashes`): two expressions have the same hash iff (barring hash
+    collisions) they describe the same glycan, whatever their branch order.
+    '''
+    tree = parse_exp(linear_code_expression, 'func-and-args')
+    return subtree_hashes(tree)[-1][0]
+
+
+def structurally_distinct(linear_code_expressions):
+    '''
+    Returns the expressions in `linear_code_expressions` that describe distinct
+    glycans (the first expression found for each), computing one structural
+    hash per expression rather than comparing trees pairwise.
+    '''
+    return list(distinct(linear_code_expressions, key=structural_hash))
+
+
 ##############################################
 # Krambeck et al. 2009 ligand `...` operator #
 ##############################################
@@ -682,16 +1410,20 @@ def is_ligand_match(linear_code_expression):
 def get_ligand_matches(linear_code_expression, as_generator=False, with_contexts=False):
     '''
     Returns the nonempty substrings within `linear_code_expression` that match
-    Krambeck et al's `ligand` uncertainty operator `...`.
+    Krambeck et al's `ligand` uncertainty operator `...`, as token lists (or,
+    if `with_contexts` is True, (left context, match, right context) triples of
+    token lists), ordered by start and then end position. If `as_generator` is
+    True, they are generated lazily.
     '''
     s = linear_code_expression
     subsequences = generate_subsequences(list(tokenizer(s)), True, with_contexts)
 #     subsequences = generate_subsequences(s, True)
+    matches = (subseq for subseq in subsequences
+               if is_ligand_match(subseq[1] if with_contexts else subseq))
     if as_generator:
-        return (is_ligand_match(subseq)
-                for subseq in subsequences)
+        return matches
     else:
-        return tuple(filter(is_ligand_match, subsequences))
+        return tuple(matches)
 
 
 ####################################################
@@ -713,16 +1445,18 @@ def is_continuation_match(linear_code_expression):
 def get_continuation_matches(linear_code_expression, as_generator=False, with_contexts=False):
     '''
     Returns the nonempty substrings within `linear_code_expression` that match 
-    Krambeck et al's `continuation` uncertainty operator `_`.
+    Krambeck et al's `continuation` uncertainty operator `_`, in the same form
+    and order as `get_ligand_matches`.
     '''
     s = linear_code_expression
     subsequences = generate_subsequences(list(tokenizer(s)), True, with_contexts)
 #     subsequences = generate_subsequences(s, True)
+    matches = (subseq for subseq in subsequences
+               if is_continuation_match(subseq[1] if with_contexts else subseq))
     if as_generator:
-        return (is_continuation_match(subseq) 
-                for subseq in subsequences)
+        return matches
     else:
-        return tuple(filter(is_continuation_match, subsequences))
+        return tuple(matches)
 
 
 ###########################################################
@@ -757,16 +1491,413 @@ def get_possible_branch_point_matches(linear_code_expression,
                                       with_contexts=False):
     '''
     Returns the nonempty substrings within `linear_code_expression` that match 
-    Krambeck et al's `possible branch point` uncertainty operator `...`.
+    Krambeck et al's `possible branch point` uncertainty operator `|`, in the
+    same form and order as `get_ligand_matches`.
     '''
     s = linear_code_expression
     subsequences = generate_subsequences(list(tokenizer(s)), True, with_contexts)
 #     subsequences = generate_subsequences(s, True)
+    matches = (subseq for subseq in subsequences
+               if is_possible_branch_point_match(subseq[1] if with_contexts else subseq))
     if as_generator:
-        return (is_possible_branch_point_match(subseq) 
-                for subseq in subsequences)
+        return matches
     else:
-        return tuple(filter(is_possible_branch_point_match, subsequences))
+        return tuple(matches)
+
+
+##############################################################
+# Enumerating distinct operator matches via suffix automata #
+##############################################################
+
+
+paren_delta = {'(':1, ')':-1}
+
+
+def token_ids(tokens):
+    '''
+    Interns the token types of `tokens` as integers, assigning ids in the same
+    order as the token strings sort. Returns
+        (tuple of token ids, tuple mapping each id back to its token)
+    '''
+    vocabulary = tuple(sorted(set(tokens)))
+    lookup = dict((token, i) for i, token in enumerate(vocabulary))
+    return tuple(lookup[token] for token in tokens), vocabulary
+
+
+def build_suffix_automaton(seq):
+    '''
+    Builds the suffix automaton of the sequence `seq` in O(len(seq)) time and
+    space and returns its transition function as a list of dicts (state 0 is
+    the initial state).
+
+    Every distinct nonempty contiguous subsequence of `seq` is spelled out by
+    exactly one path starting at state 0.
+    '''
+    transitions, links, lengths = [dict()], [-1], [0]
+    last = 0
+    for x in seq:
+        current = len(transitions)
+        transitions.append(dict())
+        links.append(0)
+        lengths.append(lengths[last] + 1)
+        p = last
+        while p != -1 and x not in transitions[p]:
+            transitions[p][x] = current
+            p = links[p]
+        if p != -1:
+            q = transitions[p][x]
+            if lengths[p] + 1 == lengths[q]:
+                links[current] = q
+            else:
+                clone = len(transitions)
+                transitions.append(dict(transitions[q]))
+                links.append(links[q])
+                lengths.append(lengths[p] + 1)
+                while p != -1 and transitions[p].get(x) == q:
+                    transitions[p][x] = clone
+                    p = links[p]
+                links[q] = clone
+                links[current] = clone
+        last = current
+    return transitions
+
+
+# Each operator's match predicate, re-expressed as a left-to-right automaton
+# over the paren delta (+1, -1 or 0) of each token:
+#   (initial state, step function, acceptance predicate)
+# A step function returns None when no extension of the sequence read so far
+# can match the operator.
+
+def _ligand_step(depth, delta):
+    depth += delta
+    return None if depth < 0 else depth
+
+
+def _continuation_step(unclosed, delta):
+    return max(unclosed + delta, 0)
+
+
+def _possible_branch_point_step(state, delta):
+    phase, depth = state
+    if phase == 'closing':
+        if delta == -1:
+            return state
+        if delta == 1:
+            return ('branch', 0)
+        return None
+    if depth < 0:
+        return None
+    return ('branch', depth + delta)
+
+
+operator_automata = {'...':(0, _ligand_step, lambda depth: depth == 0),
+                     '_':(0, _continuation_step, lambda unclosed: unclosed == 0),
+                     '|':(('closing', 0),
+                          _possible_branch_point_step,
+                          lambda state: state[0] == 'closing' or state[1] == -1)}
+
+
+def iter_distinct_matches(tokens, uncertainty_operator):
+    '''
+    Lazily generates the distinct nonempty contiguous subsequences of `tokens`
+    (each as a tuple of tokens) that match `uncertainty_operator`, in sorted
+    order.
+
+    The subsequences are enumerated by a depth-first walk of the suffix
+    automaton of `tokens`, so each distinct subsequence is visited exactly once
+    and tested incrementally against the operator, no matter how many times it
+    occurs. Visiting transitions in token order makes the walk emit matches in
+    sorted order.
+    '''
+    op = uncertainty_operator
+    assert op in operator_automata, "Unknown uncertainty operator:\n\t{0}".format(op)
+    initial, step, accepts = operator_automata[op]
+
+    ids, vocabulary = token_ids(tokens)
+    deltas = tuple(paren_delta.get(token, 0) for token in vocabulary)
+    transitions = build_suffix_automaton(ids)
+
+    path, op_states = [], [initial]
+    stack = [iter(sorted(transitions[0].items()))]
+    while stack:
+        edge = next(stack[-1], None)
+        if edge is None:
+            stack.pop()
+            if path:
+                path.pop()
+                op_states.pop()
+            continue
+        symbol, target = edge
+        op_state = step(op_states[-1], deltas[symbol])
+        if op_state is None:
+            continue
+        path.append(symbol)
+        op_states.append(op_state)
+        if accepts(op_state):
+            yield tuple(vocabulary[i] for i in path)
+        stack.append(iter(sorted(transitions[target].items())))
+
+
+def distinct_matches(tokens, uncertainty_operator):
+    '''
+    Returns a sorted tuple of the distinct nonempty contiguous subsequences of
+    `tokens` (each as a tuple of tokens) that match `uncertainty_operator`
+    (see `iter_distinct_matches`).
+    '''
+    return tuple(iter_distinct_matches(tokens, uncertainty_operator))
+
+
+##########################################
+# Lazy, paginated enumeration of matches #
+##########################################
+
+# Matches (with their contexts) are enumerated in span order: by start index
+# and then end index, the order of `generate_subsequences`. A span (i, j)
+# stands for tokens[i:j] and doubles as a cursor: enumeration can resume right
+# after any span without revisiting earlier start indices.
+
+
+def iter_match_spans(tokens, uncertainty_operator, after=None):
+    '''
+    Lazily generates the spans (i, j) such that `tokens[i:j]` is a nonempty
+    match of `uncertainty_operator`, in span order. If `after` is a span,
+    generation starts with the first span following it.
+
+    From each start index the operator's automaton (see `operator_automata`)
+    is run rightwards, abandoning the start index as soon as no extension can
+    match; start indices before `after` are never visited.
+    '''
+    op = uncertainty_operator
+    assert op in operator_automata, "Unknown uncertainty operator:\n\t{0}".format(op)
+    initial, step, accepts = operator_automata[op]
+    deltas = tuple(paren_delta.get(token, 0) for token in tokens)
+    n = len(tokens)
+
+    first_start, last_end = (0, 0) if after is None else after
+    for i in range(first_start, n):
+        state = initial
+        for j in range(i, n):
+            state = step(state, deltas[j])
+            if state is None:
+                break
+            if accepts(state) and (i > first_start or j + 1 > last_end):
+                yield (i, j + 1)
+
+
+def span_to_match(tokens, span, with_contexts=False):
+    '''
+    Returns the match `tokens[i:j]` for `span` (i, j) as a string, or as a
+    (left context, match, right context) triple of strings if `with_contexts`
+    is True.
+    '''
+    i, j = span
+    if with_contexts:
+        return (to_str(tokens[:i]), to_str(tokens[i:j]), to_str(tokens[j:]))
+    return to_str(tokens[i:j])
+
+
+def iter_matches(linear_code_expression, uncertainty_operator,
+                 with_contexts=False, offset=0, limit=None, after=None):
+    '''
+    Lazily generates the nonempty matches of `uncertainty_operator` in
+    `linear_code_expression` (as strings, or as (left context, match, right
+    context) triples of strings if `with_contexts` is True) in span order,
+    including every occurrence of a repeated match.
+
+    `offset` matches are skipped and at most `limit` (if not None) generated;
+    `after` resumes after a span (see `iter_match_spans` and `match_page`).
+    Only the generated matches are ever converted to strings.
+    '''
+    tokens = tokenizer(linear_code_expression)
+    stop = None if limit is None else offset + limit
+    spans = islice(iter_match_spans(tokens, uncertainty_operator, after), offset, stop)
+    for span in spans:
+        yield span_to_match(tokens, span, with_contexts)
+
+
+def match_page(linear_code_expression, uncertainty_operator, limit,
+               offset=0, after=None, with_contexts=False):
+    '''
+    Returns one page of the matches generated by `iter_matches`, together with
+    a cursor for the next page:
+        (tuple of at most `limit` matches, cursor)
+    where the cursor is the span of the page's last match if there are further
+    matches (pass it as `after` to get the next page), and None otherwise.
+    '''
+    assert limit > 0, "Pages must hold at least one match"
+    tokens = tokenizer(linear_code_expression)
+    spans = tuple(islice(iter_match_spans(tokens, uncertainty_operator, after),
+                         offset, offset + limit + 1))
+    cursor = spans[limit - 1] if len(spans) > limit else None
+    page = tuple(span_to_match(tokens, span, with_contexts)
+                 for span in spans[:limit])
+    return page, cursor
+
+
+##########################################
+# Parallel enumeration of matching spans #
+##########################################
+
+# Workers get the paren delta of every token through shared memory handed to
+# the pool initializer, rather than as pickled task arguments; each task is
+# just a block (first start, stop start) of start indices. Only worker
+# processes set this, so concurrent searches in one process (e.g. by the
+# threaded server) never share it.
+_span_worker_state = dict()
+
+
+def _init_span_worker(deltas, uncertainty_operators):
+    _span_worker_state['deltas'] = deltas
+    _span_worker_state['operators'] = uncertainty_operators
+
+
+def balanced_start_blocks(n, n_blocks):
+    '''
+    Splits the start indices range(n) into at most `n_blocks` consecutive
+    blocks (first, stop) of about equal work, taking the work from start i to
+    be the n - i ends that may follow it.
+    '''
+    total = n * (n + 1) // 2
+    blocks, first, work = [], 0, 0
+    for i in range(n):
+        work += n - i
+        if work * n_blocks >= total * (len(blocks) + 1) or i == n - 1:
+            blocks.append((first, i + 1))
+            first = i + 1
+    return blocks
+
+
+def operator_match_ends(deltas, start, uncertainty_operator):
+    '''
+    Returns the ends j of the spans (start, j) matching `uncertainty_operator`,
+    in order, by running its automaton (see `operator_automata`) over the
+    paren delta of each token from `start`.
+    '''
+    initial, step, accepts = operator_automata[uncertainty_operator]
+    ends = []
+    state = initial
+    for j in range(start, len(deltas)):
+        state = step(state, deltas[j])
+        if state is None:
+            break
+        if accepts(state):
+            ends.append(j + 1)
+    return ends
+
+
+def block_match_ends(deltas, uncertainty_operators, block):
+    '''
+    Returns, for each of `uncertainty_operators`, the ends of its matching
+    spans from the starts in `block` (flattened, in span order) and the
+    number of them from each start, given the paren delta of each token.
+    '''
+    first, stop = block
+    result = []
+    for op in uncertainty_operators:
+        ends, counts = array('i'), array('i')
+        for i in range(first, stop):
+            op_ends = operator_match_ends(deltas, i, op)
+            ends.extend(op_ends)
+            counts.append(len(op_ends))
+        result.append((ends, counts))
+    return result
+
+
+def _block_match_ends(block):
+    return block_match_ends(_span_worker_state['deltas'],
+                            _span_worker_state['operators'], block)
+
+
+def parallel_match_spans(tokens, uncertainty_operators, processes=None,
+                         blocks_per_process=4, offset=0, limit=None):
+    '''
+    Returns, for each of `uncertainty_operators`, the list of spans (i, j)
+    such that `tokens[i:j]` is a nonempty match of it, in span order - the
+    same spans as `iter_match_spans` - from position `offset` onwards (at
+    most `limit` of them).
+
+    The start indices are split into balanced blocks (see
+    `balanced_start_blocks`), `blocks_per_process` per worker, that are
+    searched across `processes` worker processes (by default, one per core; 1
+    searches them in this process). Blocks are merged in order, so the result
+    does not depend on the number of workers. Workers return the spans of a
+    block as compact arrays of ends; only the spans within offset and limit
+    are turned into tuples, and no block is waited for once every operator
+    has `offset + limit` spans.
+    '''
+    for op in uncertainty_operators:
+        assert op in operator_automata, "Unknown uncertainty operator:\n\t{0}".format(op)
+    n = len(tokens)
+    n_workers = processes if processes is not None else multiprocessing.cpu_count()
+    blocks = balanced_start_blocks(n, max(1, n_workers * blocks_per_process))
+    end = None if limit is None else offset + limit
+
+    deltas = RawArray('b', [paren_delta.get(token, 0) for token in tokens])
+    ops = tuple(uncertainty_operators)
+    pool = (multiprocessing.Pool(processes, _init_span_worker, (deltas, ops))
+            if processes != 1 and len(blocks) > 1 else None)
+    try:
+        block_results = (pool.imap(_block_match_ends, blocks) if pool is not None
+                         else (block_match_ends(deltas, ops, block) for block in blocks))
+        spans = [[] for _ in uncertainty_operators]
+        n_seen = [0 for _ in uncertainty_operators]
+        for (first, stop), result in zip(blocks, block_results):
+            for k, (ends, counts) in enumerate(result):
+                # Keep positions [lo, hi) of this block's len(ends) spans.
+                lo = max(0, offset - n_seen[k])
+                hi = len(ends) if end is None else min(len(ends), end - n_seen[k])
+                n_seen[k] += len(ends)
+                e = 0
+                for i, count in zip(range(first, stop), counts):
+                    if e >= hi:
+                        break
+                    if e + count > lo:
+                        spans[k].extend((i, j) for j in ends[max(e, lo):min(e + count, hi)])
+                    e += count
+            if end is not None and min(n_seen) >= end:
+                break
+        else:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return spans
+
+
+def substitution_span_validity(tokens, substitution):
+    '''
+    Returns a function deciding in constant time, for a span (i, j) of
+    `tokens`, whether replacing tokens[i:j] with the string `substitution`
+    yields an expression with balanced parentheses (see
+    `has_balanced_parens`).
+
+    Only paren depths matter: the left context must never go below depth 0,
+    and the substitution and right context, shifted to the depth they start
+    at, must neither go below 0 nor end above it.
+    '''
+    depths = [0]
+    for token in tokens:
+        depths.append(depths[-1] + paren_delta.get(token, 0))
+    left_ok = []
+    for depth in depths:
+        left_ok.append(depth >= 0 and (not left_ok or left_ok[-1]))
+    suffix_min = list(depths)
+    for k in range(len(depths) - 2, -1, -1):
+        suffix_min[k] = min(suffix_min[k], suffix_min[k + 1])
+    sub_depth, sub_min = 0, 0
+    for x in substitution:
+        sub_depth += paren_delta.get(x, 0)
+        sub_min = min(sub_min, sub_depth)
+
+    def valid(span):
+        i, j = span
+        entry = depths[i] + sub_depth
+        return (left_ok[i] and depths[i] + sub_min >= 0 and
+                suffix_min[j] - depths[j] + entry >= 0 and
+                depths[-1] - depths[j] + entry == 0)
+    return valid
 
 
 ########################################
@@ -776,15 +1907,17 @@ def get_possible_branch_point_matches(linear_code_expression,
 
 def check_match(linear_code_expression, substitution, verbose=False):
     '''
-    Given a linear code expression with a single instance of one of Krambeck 
+    Given a linear code expression with any number of instances of Krambeck 
     et al. 2009's uncertainty operators 
      - '...'
      - '_'
      - '|'
     and a string representing a possible substitution for the uncertainty 
-    operator, returns a boolean indicating whether both conditions hold:
-      - the substitution string is a match for the uncertainty operator.
-      - substituting the string in for the uncertainty operator results in a
+    operator (or, if there is more than one operator token, a sequence of
+    strings: one substitution per operator token, in order), returns a boolean
+    indicating whether both conditions hold:
+      - each substitution string is a match for its uncertainty operator.
+      - substituting the strings in for the uncertainty operators results in a
         syntactically well-formed linear code expression.
           - Note that a syntactically well-formed linear code expression need
             not be a physically possible glycan.
@@ -792,6 +1925,10 @@ def check_match(linear_code_expression, substitution, verbose=False):
             expression resulting from the substitution has balanced 
             parentheses.
 
+    All of this is checked in a single left-to-right pass over the expression
+    with its substitutions, tracking paren depth and the state of each
+    operator's automaton (see `operator_automata`) as it goes.
+
     If no operator token is detected, then the only valid substitution values 
     are
       - ''
@@ -799,59 +1936,50 @@ def check_match(linear_code_expression, substitution, verbose=False):
     '''
     lce = linear_code_expression
     sub = substitution
-    #op = uncertainty_operator
-
-    #assert op in {'...','_','|'}, "Unknown uncertainty operator:\n\t{0}".format(op)
-
-    pred_mapper = {'...':is_ligand_match,
-                   '_':is_continuation_match,
-                   '|':is_possible_branch_point_match}
-    #get_mapper = {'...':get_ligand_matches,
-    #              '_':get_continuation_matches,
-    #              '|':get_possible_branch_point_matches}
-    #my_pred = pred_mapper[op]
-    #my_getter = get_mapper[uncertainty_operator]
-    
-    ligand_ops_present = lce.count('...')
-    continuation_ops_present = lce.count('_')
-    possible_branch_ops_present = lce.count('|')
 
-    total_op_tokens_present = sum([ligand_ops_present, 
-                                   continuation_ops_present, 
-                                   possible_branch_ops_present])
-    if total_op_tokens_present > 1:
-        raise Exception("There is more than one token of at least one uncertainty operator present in\n\t{0}".format(lce))
+    pieces = uncertainty_operator_pattern.split(lce)
+    texts, ops = pieces[0::2], pieces[1::2]
 
-    if total_op_tokens_present == 0:
+    if len(ops) == 0:
         if verbose:
             print("No uncertainty operators detected in '{0}'".format(lce))
         if sub == '' or sub is None:
             return True
         return False
-    
-    if ligand_ops_present > 1:
-        op = '...'
-    elif continuation_ops_present > 1:
-        op = '_'
-    else:
-        op = '|'
-    #if verbose:
-    #    print("Op identified as '{0}'".format(op))
-    my_pred = pred_mapper[op]
 
-    sub_is_match = my_pred(sub)
-    if not sub_is_match:
-        if verbose:
-            print('{0} cannot match {1}'.format(sub, op))
-        return False
-    lce_with_sub = lce.replace(op, sub) 
-    result_has_balanced_parens = has_balanced_parens(lce_with_sub)
-    result_is_wellformed = result_has_balanced_parens
-    return sub_is_match and result_is_wellformed
+    subs = tuple(sub) if isinstance(sub, (list, tuple)) else (sub,)
+    if len(subs) != len(ops):
+        raise Exception("Expected {0} substitutions for the uncertainty operators in\n\t{1}\ngot {2}".format(len(ops), lce, len(subs)))
+
+    depth = 0
+    for text, op, sub in zip(texts, ops, subs):
+        for x in text:
+            depth += paren_delta.get(x, 0)
+            if depth < 0:
+                return False
+        initial, step, accepts = operator_automata[op]
+        op_state = initial
+        for x in sub:
+            delta = paren_delta.get(x, 0)
+            if op_state is not None:
+                op_state = step(op_state, delta)
+            depth += delta
+            if depth < 0 and op_state is not None:
+                return False
+        if op_state is None or not accepts(op_state):
+            if verbose:
+                print('{0} cannot match {1}'.format(sub, op))
+            return False
+    for x in texts[-1]:
+        depth += paren_delta.get(x, 0)
+        if depth < 0:
+            return False
+    return depth == 0
 
 
 def analyze_matches(linear_code_expression, uncertainty_operator,
-                    substitution=None, with_context=False, verbose=False):
+                    substitution=None, with_context=False, verbose=False,
+                    offset=0, limit=None, processes=1):
     '''
     Given 
      - a linear code expression representing a single glycan 
@@ -875,6 +2003,20 @@ def analyze_matches(linear_code_expression, uncertainty_operator,
     If with_context is False, the output type will be a tuple of 2-tuples...
     Similarly, if with_context is True, the output type will be a tuple of 
     4-tuples.
+
+    If offset and/or limit are given, only the results from position offset
+    onwards (at most limit of them) are returned. Matches with context are
+    listed in span order (see `iter_match_spans`) and matches without context
+    in sorted order. Except when a substitution is checked without context,
+    matches before offset are still found but never turned into strings or
+    checked; to page through matches without finding the earlier ones again,
+    use `match_page` with the cursor of the previous page as `after`.
+
+    If processes is not 1, matches with context and substitution checks are
+    computed across that many worker processes (None for one per core; see
+    `parallel_match_spans`), with the same results. Workers search whole
+    blocks of start indices, so matches before offset are still found, but
+    only those within offset and limit are kept.
     '''
     lce = linear_code_expression
     sub = substitution
@@ -903,38 +2045,35 @@ def analyze_matches(linear_code_expression, uncertainty_operator,
                                    continuation_ops_present, 
                                    possible_branch_ops_present])
     if total_op_tokens_present > 0:
-        raise Exception("There are uncertainty operators already present in '{0}'".format(lce)) 
-
-    if verbose:
-        print('Calculating non-empty subsequence matches w/ contexts...')
-    matches = tuple(filter(lambda lmr: my_pred(lmr[1]),
-                           generate_subsequences(tokenizer(lce),
-                                                 with_contexts=True)))
-    # if verbose:
-    #     print('Sorting...')
-    # sorted_matches = tuple(map(lambda match: tuple(map(tuple, match)),
-    #                            sorted(matches, key=lambda tup: tup[1])))
-    # if verbose:
-    #     print('Removing duplicates (including contexts)...')
-    # unique_sorted_matches = distinct(sorted_matches)
-    sorted_matches = tuple(map(lambda match: tuple(map(tuple, match)),
-                               matches))
-    unique_sorted_matches = list(sorted_matches)
+        raise Exception("There are uncertainty operators already present in '{0}'".format(lce))
 
     detokenize = lambda match_col: str_join('', match_col)
-    #columnify = lambda match_cols: str_join('\t', match_cols)
 
-    if sub is None:
+    stop = None if limit is None else offset + limit
+    tokens = tokenizer(lce)
+
+    if sub is None and not with_context:
+        if verbose:
+            print('Enumerating distinct non-empty subsequence matches...')
+        return tuple(map(detokenize, islice(iter_distinct_matches(tokens, op),
+                                            offset, stop)))
+
+    if verbose:
+        print('Calculating non-empty subsequence matches w/ contexts...')
+    if processes != 1:
         if with_context:
-            readable = lambda match: tuple(map(detokenize, match))
-            return tuple(map(readable, unique_sorted_matches)) 
+            spans = parallel_match_spans(tokens, [op], processes,
+                                         offset=offset, limit=limit)[0]
         else:
-            if verbose:
-                print('Removing contexts, sorting, and uniquifying...')
-            no_contexts = distinct(sorted(map(lambda t: t[1],
-                                              unique_sorted_matches)))
-            readable = lambda match: detokenize(match)
-            return tuple(map(readable, no_contexts))
+            spans = parallel_match_spans(tokens, [op], processes)[0]
+    elif with_context:
+        spans = islice(iter_match_spans(tokens, op), offset, stop)
+    else:
+        spans = iter_match_spans(tokens, op)
+    readable_matches = tuple(span_to_match(tokens, span, True) for span in spans)
+
+    if sub is None:
+        return readable_matches
     
     sub_is_match = my_pred(sub)
     if not sub_is_match:
@@ -945,21 +2084,438 @@ def analyze_matches(linear_code_expression, uncertainty_operator,
         combine = lambda lmr: str_join('', [lmr[0], sub, lmr[2]])
         yields_well_formed_lce = lambda lmr: has_balanced_parens(combine(lmr))
 
-    readable = lambda match: tuple(map(detokenize, match))
-    readable_unique_sorted_matches = tuple(map(readable, unique_sorted_matches))
     if verbose:
         print('Adding well-formedness result to every match...')
     add_sub_result = lambda t: tuple(list(t) + [yields_well_formed_lce(t)])
-    results = tuple(map(add_sub_result, readable_unique_sorted_matches))
+    if processes != 1:
+        span_is_valid = substitution_span_validity(tokens, sub)
+        results = tuple(tuple(list(t) + [sub_is_match and span_is_valid(span)])
+                        for t, span in zip(readable_matches, spans))
+    else:
+        results = tuple(map(add_sub_result, readable_matches))
     if with_context:
         return results
-        #return tuple(map(readable, results))    
     else:
         if verbose:
             print('Removing contexts, sorting, and uniquifying...')
         no_contexts = distinct(sorted(map(lambda t: (t[1],t[3]),
                                           results)))
-        return no_contexts
+        return tuple(no_contexts)[offset:stop]
+
+
+#############################################
+# Patterns containing uncertainty operators #
+#############################################
+
+
+uncertainty_operators = ('...', '_', '|')
+
+uncertainty_operator_pattern = re.compile(r'(\.\.\.|_|\|)')
+
+
+def tokenize_pattern(pattern, tokenize_saccharide_units=False):
+    '''
+    Tokenizes a linear code expression that may contain any number of
+    uncertainty operator tokens ('...', '_', '|'); each operator token becomes a
+    token of its own, and the text between operators is tokenized by
+    `tokenizer` (with `tokenize_saccharide_units` passed along).
+    '''
+    tokens = []
+    for piece in uncertainty_operator_pattern.split(pattern):
+        if piece in uncertainty_operators:
+            tokens.append(piece)
+        elif piece != '':
+            tokens.extend(tokenizer(piece, tokenize_saccharide_units))
+    return tokens
+
+
+def _automaton_depth(op_state):
+    return op_state[1] if isinstance(op_state, tuple) else op_state
+
+
+def operator_token_automaton(uncertainty_operator, max_depth=1):
+    '''
+    Returns a finite automaton over grammar terminals (the tokens of
+    `tokenizer(lce, True)`) accepting the token sequences that match
+    `uncertainty_operator` and nest parentheses at most `max_depth` deep, as
+        (states, initial state, accepting states, edges, epsilon edges)
+    where edges are (state, terminal, state) triples and states are
+    (operator automaton state, position within a saccharide unit) pairs.
+
+    Matches are read with the operator automata of `distinct_matches`; the
+    depth bound is what makes the language regular.
+    '''
+    initial, step, accepts = operator_automata[uncertainty_operator]
+    bond_types = tuple('ab?')
+    bond_locations = tuple('123456789?')
+
+    start = (initial, 'between')
+    states, edges, epsilons = set([start]), [], []
+    frontier = [initial]
+    seen = set([initial])
+    while frontier:
+        op_state = frontier.pop()
+        between = (op_state, 'between')
+        for paren in parentheses:
+            target = step(op_state, paren_delta[paren])
+            if target is None or _automaton_depth(target) > max_depth:
+                continue
+            edges.append((between, paren, (target, 'between')))
+            if target not in seen:
+                seen.add(target)
+                frontier.append(target)
+        if step(op_state, 0) == op_state:
+            bare, typed = (op_state, 'bare'), (op_state, 'typed')
+            states.update([between, bare, typed])
+            edges.extend((between, su, bare) for su in SU_bare)
+            edges.extend((bare, bond_type, typed) for bond_type in bond_types)
+            edges.extend((typed, bond_location, between) for bond_location in bond_locations)
+            epsilons.append((bare, between))
+        states.add(between)
+    accepting = set(s for s in states if s[1] == 'between' and accepts(s[0]))
+    return states, start, accepting, edges, epsilons
+
+
+def pattern_automaton(pattern, max_depth=1):
+    '''
+    Returns a finite automaton over grammar terminals that accepts exactly the
+    instantiations of `pattern` (a linear code expression with any number of
+    uncertainty operator tokens) whose substitutions nest parentheses at most
+    `max_depth` deep, as
+        (number of states, initial state, final state, edges, epsilon edges)
+    States are integers, and each edge is a (state, terminal, state, slot)
+    4-tuple, where slot is the index of the operator token whose substitution
+    the terminal belongs to (None for the pattern's own tokens).
+    '''
+    edges, epsilons = [], []
+    current = 0
+    n_states = 1
+    slot = 0
+    for token in tokenize_pattern(pattern, True):
+        if token not in uncertainty_operators:
+            edges.append((current, token, n_states, None))
+            current = n_states
+            n_states += 1
+            continue
+        states, start, accepting, op_edges, op_epsilons = operator_token_automaton(token, max_depth)
+        numbering = dict((state, n_states + i) for i, state in enumerate(states))
+        n_states += len(numbering)
+        exit_state = n_states
+        n_states += 1
+        epsilons.append((current, numbering[start]))
+        edges.extend((numbering[a], terminal, numbering[b], slot)
+                     for a, terminal, b in op_edges)
+        epsilons.extend((numbering[a], numbering[b]) for a, b in op_epsilons)
+        epsilons.extend((numbering[state], exit_state) for state in accepting)
+        current = exit_state
+        slot += 1
+    return n_states, 0, current, edges, epsilons
+
+
+def earley_intersect(grammar, automaton):
+    '''
+    Runs Earley deduction for the (compiled) grammar over the language of the
+    finite automaton `automaton` (as returned by `pattern_automaton`) - i.e. the
+    Bar-Hillel intersection of the two, in time polynomial in the sizes of the
+    grammar and the automaton.
+
+    Chart entries are (item, origin state, current state) triples; returns
+        (accepting entry or None, back pointers of every entry)
+    where the back pointer of an entry records how it was first derived.
+    '''
+    t = grammar.tables
+    item_next, item_lhs = t['item_next'], t['item_lhs']
+    predict, nullable = t['predict'], t['nullable']
+    n_nonterminals, start = t['n_nonterminals'], t['start']
+    terminal_ids = t['terminals']
+
+    n_states, initial, final, edges, epsilons = automaton
+    out_edges = [[] for _ in range(n_states)]
+    for a, terminal, b, slot in edges:
+        if terminal in terminal_ids:
+            out_edges[a].append((terminal_ids[terminal], b, terminal, slot))
+    out_epsilons = [[] for _ in range(n_states)]
+    for a, b in epsilons:
+        out_epsilons[a].append(b)
+
+    back = dict()
+    agenda = deque()
+    waiting = defaultdict(list)     # (nonterminal, state) -> [(item, origin)]
+    completed = defaultdict(list)   # (nonterminal, origin) -> [entry]
+    predicted = set()
+
+    def add(entry, pointer):
+        if entry not in back:
+            back[entry] = pointer
+            agenda.append(entry)
+
+    for item in predict[start]:
+        add((item, initial, initial), None)
+    while agenda:
+        entry = agenda.popleft()
+        item, origin, state = entry
+        for target in out_epsilons[state]:
+            add((item, origin, target), ('epsilon', entry))
+        sym = item_next[item]
+        if sym == -1:
+            lhs = item_lhs[item]
+            if lhs == start and origin == initial and state == final:
+                return entry, back
+            completed[(lhs, origin)].append(entry)
+            for w_item, w_origin in waiting[(lhs, origin)]:
+                add((w_item + 1, w_origin, state), ('complete', (w_item, w_origin, origin), entry))
+        elif sym < n_nonterminals:
+            waiting[(sym, state)].append((item, origin))
+            for completer in completed[(sym, state)]:
+                add((item + 1, origin, completer[2]), ('complete', entry, completer))
+            if (sym, state) not in predicted:
+                predicted.add((sym, state))
+                for p_item in predict[sym]:
+                    add((p_item, state, state), None)
+            if nullable[sym]:
+                add((item + 1, origin, state), ('nullable', entry))
+        else:
+            for terminal_id, target, terminal, slot in out_edges[state]:
+                if terminal_id == sym:
+                    add((item + 1, origin, target), ('scan', entry, terminal, slot))
+    return None, back
+
+
+def derived_terminals(entry, back):
+    '''
+    Follows the back pointers recorded by `earley_intersect` from `entry` and
+    returns the (terminal, slot) pairs of the string its derivation spans.
+    '''
+    result = []
+    stack = [entry]
+    while stack:
+        top = stack.pop()
+        if top[0] == 'terminal':
+            result.append(top[1:])
+            continue
+        pointer = back[top]
+        if pointer is None:
+            continue
+        kind = pointer[0]
+        if kind in ('epsilon', 'nullable'):
+            stack.append(pointer[1])
+        elif kind == 'scan':
+            stack.append(('terminal', pointer[2], pointer[3]))
+            stack.append(pointer[1])
+        else:
+            stack.append(pointer[2])
+            stack.append(pointer[1])
+    return result
+
+
+def wff_pattern(pattern, grammar=None, with_witness=False, max_depth=1):
+    '''
+    Given a linear code expression `pattern` containing any number of
+    uncertainty operator tokens ('...', '_', '|'), indicates whether there is
+    some substitution of a match for each operator token that yields a 
+    well-formed expression according to `grammar` (by default `RTF_UOF_g_string`; see
+    `get_grammar`). Patterns without operator tokens go through the same
+    intersection below, with an automaton accepting just the pattern itself,
+    so the answer is the one `wff` gives (`wff` itself is never called).
+
+    Each operator is treated as a regular language (its matches, with paren
+    nesting inside a substitution at most `max_depth` deep) and the grammar is
+    intersected with the resulting automaton for the whole pattern, so this
+    takes polynomial time. For the default grammar `max_depth=1` loses nothing:
+    any branch nested inside a substitution can be replaced by a single
+    saccharide unit without affecting well-formedness.
+
+    If with_witness is True, returns a pair
+        (Boolean, tuple with one substitution string per operator token)
+    where the tuple is None if there is no well-formed instantiation.
+    '''
+    automaton = pattern_automaton(pattern, max_depth)
+    entry, back = earley_intersect(get_grammar(grammar), automaton)
+    if not with_witness:
+        return entry is not None
+    if entry is None:
+        return False, None
+    n_slots = len(uncertainty_operator_pattern.findall(pattern))
+    substitutions = [[] for _ in range(n_slots)]
+    for terminal, slot in derived_terminals(entry, back):
+        if slot is not None:
+            substitutions[slot].append(terminal)
+    return True, tuple(map(partial(str_join, ''), substitutions))
+
+
+def matches(pattern, glycan):
+    '''
+    Given a linear code expression `pattern` with any number of uncertainty
+    operator tokens and a linear code expression `glycan` without any,
+    indicates whether `glycan` is an instance of `pattern`: whether substituting
+    some match of each operator for its token in `pattern` yields `glycan`
+    (token for token).
+
+    If so, returns the witnessing split of `glycan` into alternating pattern
+    text and operator matches,
+        (text, match, text, match, ..., text)
+    with one match per operator token; for a single operator token this is
+        (left context, match, right context)
+    Returns None otherwise.
+
+    This is one left-to-right pass over the tokens of `glycan`, simulating the
+    automaton that reads the pattern's own tokens literally and each operator
+    token's match with its operator automaton (see `operator_automata`). Each
+    step only tracks (pattern position, operator automaton state) pairs, so the
+    whole check is polynomial - O(len(glycan)^2 * len(pattern)) at worst -
+    rather than trying combinations of matches for each operator.
+    '''
+    pattern_tokens = tokenize_pattern(pattern)
+    glycan_tokens = tokenizer(glycan)
+    m = len(pattern_tokens)
+
+    def initial_state(p):
+        if p < m and pattern_tokens[p] in uncertainty_operators:
+            return (p, operator_automata[pattern_tokens[p]][0])
+        return (p, None)
+
+    def close(back_pointers):
+        # an operator token may stop matching wherever its automaton accepts
+        agenda = list(back_pointers)
+        while agenda:
+            p, op_state = agenda.pop()
+            if op_state is None:
+                continue
+            accepts = operator_automata[pattern_tokens[p]][2]
+            following = initial_state(p + 1)
+            if accepts(op_state) and following not in back_pointers:
+                back_pointers[following] = ((p, op_state), False)
+                agenda.append(following)
+        return back_pointers
+
+    # back[j] maps each state reachable after reading j glycan tokens to
+    # (previous state, whether a glycan token was read to get here)
+    back = [close({initial_state(0):None})]
+    for token in glycan_tokens:
+        delta = paren_delta.get(token, 0)
+        reached = dict()
+        for state in back[-1]:
+            p, op_state = state
+            if p == m:
+                continue
+            if op_state is not None:
+                stepped = operator_automata[pattern_tokens[p]][1](op_state, delta)
+                if stepped is not None:
+                    reached.setdefault((p, stepped), (state, True))
+            elif pattern_tokens[p] == token:
+                reached.setdefault(initial_state(p + 1), (state, True))
+        if not reached:
+            return None
+        back.append(close(reached))
+
+    state, j = (m, None), len(glycan_tokens)
+    if state not in back[j]:
+        return None
+    read_by = [None] * len(glycan_tokens)
+    while back[j][state] is not None:
+        previous, read = back[j][state]
+        if read:
+            j -= 1
+            read_by[j] = previous[0]
+        state = previous
+
+    detokenize = partial(str_join, '')
+    split, text = [], []
+    for p, token in enumerate(pattern_tokens):
+        if token in uncertainty_operators:
+            split.append(detokenize(text))
+            split.append(detokenize(glycan_tokens[j] for j in range(len(glycan_tokens))
+                                    if read_by[j] == p))
+            text = []
+        else:
+            text.append(token)
+    split.append(detokenize(text))
+    return tuple(split)
+
+
+def matches_by_enumeration(pattern, glycan):
+    '''
+    Brute-force reference implementation of `matches` (for patterns with exactly
+    one operator token): enumerates every (left context, match, right context)
+    split of `glycan` whose match matches the operator and searches for one
+    whose contexts agree with `pattern`.
+    '''
+    pattern_tokens = tokenize_pattern(pattern)
+    slot = [i for i, token in enumerate(pattern_tokens)
+            if token in uncertainty_operators]
+    assert len(slot) == 1, "Expected exactly one uncertainty operator token in\n\t{0}".format(pattern)
+    left = str_join('', pattern_tokens[:slot[0]])
+    right = str_join('', pattern_tokens[slot[0]+1:])
+    op = pattern_tokens[slot[0]]
+    for l, m, r in analyze_matches(glycan, op, with_context=True):
+        if l == left and r == right:
+            return (l, m, r)
+    if left + right == glycan:
+        return (left, '', right)
+    return None
+
+
+def iter_instance_splits(pattern, glycan):
+    '''
+    Lazily generates every witnessing split of `glycan` as an instance of
+    `pattern` (in the form `matches` returns one), in order of the span of
+    each operator token's match: earlier and then shorter spans first.
+
+    The search reads `glycan` left to right as `matches` does, but follows every
+    way of matching each operator token; (pattern position, glycan position,
+    operator state, match start) configurations with no completion are
+    remembered, so each is explored at most once.
+    '''
+    pattern_tokens = tokenize_pattern(pattern)
+    glycan_tokens = tokenizer(glycan)
+    m, n = len(pattern_tokens), len(glycan_tokens)
+    dead = set()
+
+    def initial_state(p):
+        if p < m and pattern_tokens[p] in uncertainty_operators:
+            return operator_automata[pattern_tokens[p]][0]
+        return None
+
+    def completions(p, j, op_state, start):
+        # spans of the matches of pattern_tokens[p:] reading glycan_tokens[j:],
+        # the operator at p (if any) having read glycan_tokens[start:j]
+        configuration = (p, j, op_state, start)
+        if configuration in dead:
+            return
+        found = False
+        if p == m:
+            if j == n:
+                found = True
+                yield ()
+        elif op_state is not None:
+            initial, step, accepts = operator_automata[pattern_tokens[p]]
+            # ending the match here before extending it yields shorter spans first
+            if accepts(op_state):
+                for rest in completions(p + 1, j, initial_state(p + 1), j):
+                    found = True
+                    yield ((start, j),) + rest
+            if j < n:
+                stepped = step(op_state, paren_delta.get(glycan_tokens[j], 0))
+                if stepped is not None:
+                    for rest in completions(p, j + 1, stepped, start):
+                        found = True
+                        yield rest
+        elif j < n and pattern_tokens[p] == glycan_tokens[j]:
+            for rest in completions(p + 1, j + 1, initial_state(p + 1), j + 1):
+                found = True
+                yield rest
+        if not found:
+            dead.add(configuration)
+
+    detokenize = partial(str_join, '')
+    for spans in completions(0, 0, initial_state(0), 0):
+        split, previous_end = [], 0
+        for start, end in spans:
+            split.append(detokenize(glycan_tokens[previous_end:start]))
+            split.append(detokenize(glycan_tokens[start:end]))
+            previous_end = end
+        split.append(detokenize(glycan_tokens[previous_end:]))
+        yield tuple(split)
 
 
 #####################################################
@@ -969,7 +2525,7 @@ def analyze_matches(linear_code_expression, uncertainty_operator,
 
 def compare_matches(uncertainty_operator_A, uncertainty_operator_B,
                     linear_code_expression, with_contexts=False,
-                    include_contexts_in_uniqueness=True):
+                    include_contexts_in_uniqueness=True, processes=1):
     '''
     Uncertainty operators must be one of Krambeck et al. 2009's three 
     operators: 
@@ -991,7 +2547,14 @@ def compare_matches(uncertainty_operator_A, uncertainty_operator_B,
     from the same operator or distinct operators) are considered the same iff
     not only their match string is the same, but their left and right contexts
     are the same as well.
+
+    If processes is not 1, the matches of both operators are found across
+    that many worker processes (None for one per core; see
+    `parallel_match_spans`), with the same results.
     '''
+    if processes != 1:
+        return parallel_compare_matches(uncertainty_operator_A, uncertainty_operator_B,
+                                        linear_code_expression, with_contexts, processes)
     pred_mapper = {'...':is_ligand_match,
                    '_':is_continuation_match,
                    '|':is_possible_branch_point_match}
@@ -1009,7 +2572,7 @@ def compare_matches(uncertainty_operator_A, uncertainty_operator_B,
     #B_matches = tuple(filter(B_pred,
     #                         generate_subsequences(tokenizer(linear_code_expression),
     #                                               with_contexts=with_contexts)))
-    extract_from_context = lambda match: match if type(match) == str else match[1]
+    extract_from_context = lambda match: match[1] if with_contexts else match
     A_matches, A_nonmatches = split(lambda m: A_pred(extract_from_context(m)),
                                     generate_subsequences(tokenizer(linear_code_expression),
                                                           with_contexts=with_contexts))
@@ -1024,7 +2587,7 @@ def compare_matches(uncertainty_operator_A, uncertainty_operator_B,
         uniquifier_single = uniquifier
         uniquifier_match = lambda match: set(map(uniquifier_single, match))
     else:
-        uniquifier_match = uniquifier
+        uniquifier_match = lambda matches: set(uniquifier(matches))
     A_matches_unique, A_nonmatches_unique = uniquifier_match(A_matches), uniquifier_match(A_nonmatches)
     B_matches_unique, B_nonmatches_unique = uniquifier_match(B_matches), uniquifier_match(B_nonmatches)
 
@@ -1046,12 +2609,38 @@ def compare_matches(uncertainty_operator_A, uncertainty_operator_B,
     return result_dict
 
 
+def parallel_compare_matches(uncertainty_operator_A, uncertainty_operator_B,
+                             linear_code_expression, with_contexts=False,
+                             processes=None):
+    '''
+    `compare_matches`, classifying every span by the spans of each operator
+    found by `parallel_match_spans` rather than by testing every subsequence
+    against each operator's predicate.
+    '''
+    tokens = tokenizer(linear_code_expression)
+    A_spans, B_spans = map(set, parallel_match_spans(tokens,
+                                                     (uncertainty_operator_A,
+                                                      uncertainty_operator_B),
+                                                     processes))
+    A_matches, A_nonmatches, B_matches, B_nonmatches = set(), set(), set(), set()
+    for i in range(len(tokens)):
+        for j in range(i + 1, len(tokens) + 1):
+            match = span_to_match(tokens, (i, j), with_contexts)
+            (A_matches if (i, j) in A_spans else A_nonmatches).add(match)
+            (B_matches if (i, j) in B_spans else B_nonmatches).add(match)
+    return {'both':A_matches & B_matches,
+            'just_A':A_matches - B_matches,
+            'just_B':B_matches - A_matches,
+            'neither':A_nonmatches | B_nonmatches}
+
+
 def glypy_plottable(linear_code_expression):
     '''
     Returns whether `linear_code_expression` causes glypy's plotting 
     facilities to raise an exception or not.
 
-    (Will statefully induce a plot as a side-effect where possible.)
+    (Will statefully induce a plot as a side-effect where possible; see
+    `glypy_compatible` for a check without one.)
     '''
     try:
         parsePlot(linear_code_expression)
@@ -1060,3 +2649,125 @@ def glypy_plottable(linear_code_expression):
         return False
 
 
+
+
+#############################################
+# Converting parsed trees directly to glypy #
+#############################################
+
+glypy_monosaccharide_templates = dict()
+
+def glypy_monosaccharide(saccharide_unit):
+    '''
+    Returns a fresh `glypy.Monosaccharide` for the bare saccharide unit
+    `saccharide_unit` (an element of `SU_bare`, without anomer or bond
+    information).
+
+    The residue (with any substituents) is built by glypy's linear code
+    machinery once per saccharide unit and cached; every call after the first
+    just clones the cached template. Raises whatever glypy raises if it has no
+    interpretation of `saccharide_unit`.
+    '''
+    if saccharide_unit not in glypy_monosaccharide_templates:
+        try:
+            template, _ = glypy.io.linear_code.monosaccharide_from_linear_code(saccharide_unit)
+            template.anomer = None
+        except Exception as e:
+            template = e
+        glypy_monosaccharide_templates[saccharide_unit] = template
+    template = glypy_monosaccharide_templates[saccharide_unit]
+    if isinstance(template, Exception):
+        raise template
+    return template.clone()
+
+
+def func_and_args_to_glycan(func_and_args, canonicalize=True):
+    '''
+    Converts a func-and-args tree (see `parse_exp`) to a `glypy.Glycan`
+    without going back through a linear code string.
+
+    Each residue's bond type becomes its anomer and its bond location the
+    position on its parent it attaches to; the root's bond information (if
+    any) is ignored. Residues are linked in the order
+    `glypy.io.linear_code.parse_linear_code` links them (reading right to
+    left, a branch is attached to its parent once the whole branch is built),
+    so the result is the glycan `parse` would return. If `canonicalize` is
+    True, the result is canonicalized the way `parse` canonicalizes its results.
+    '''
+    def residue(tree):
+        saccharide_unit, bond_type, bond_location = split_bond_information(tree['func'])
+        monosaccharide = glypy_monosaccharide(saccharide_unit)
+        monosaccharide.anomer = glypy.io.linear_code.anomer_map_from.get(bond_type, None)
+        position = int(bond_location) if bond_location not in ('', '?') else -1
+        return monosaccharide, position
+
+    def attach(parent, child, position):
+        parent.add_monosaccharide(child, position=position,
+                                  child_position=min(child.open_attachment_sites()[0]))
+
+    def build(tree):
+        top, top_position = residue(tree)
+        node = top
+        while len(tree['args']) > 0:
+            branches, chain = tree['args'][:-1], tree['args'][-1]
+            for branch in branches:
+                attach(node, *build(branch))
+            child, position = residue(chain)
+            attach(node, child, position)
+            node, tree = child, chain
+        return top, top_position
+
+    glycan = glypy.Glycan(root=build(func_and_args)[0]).reindex()
+    if canonicalize:
+        glycan.canonicalize()
+    return glycan
+
+
+def to_glycan(linear_code_expression, canonicalize=True):
+    '''
+    Parses `linear_code_expression` with gregex and converts the result to a
+    `glypy.Glycan` (see `func_and_args_to_glycan`).
+
+    Unlike `parse`, this always returns a `glypy.Glycan`, even for a single
+    residue.
+    '''
+    tree = parse_exp(linear_code_expression, 'func-and-args')
+    return func_and_args_to_glycan(tree, canonicalize)
+
+
+def to_glycans(linear_code_expressions, canonicalize=True, invalid_behavior='raise'):
+    '''
+    Converts each of `linear_code_expressions` to a `glypy.Glycan` (see
+    `to_glycan`) and returns them as a list, in order.
+
+    If `invalid_behavior` is 'raise', the first expression that can't be
+    converted raises its exception; if it is 'none', that expression's entry
+    is None instead.
+    '''
+    assert invalid_behavior in ('raise', 'none')
+    glycans = []
+    for lce in linear_code_expressions:
+        try:
+            glycans.append(to_glycan(lce, canonicalize))
+        except Exception as e:
+            if invalid_behavior == 'raise':
+                raise e
+            glycans.append(None)
+    return glycans
+
+
+def glypy_compatible(linear_code_expression):
+    '''
+    Returns whether `linear_code_expression` can be converted to a
+    `glypy.Glycan` (see `to_glycan`) - i.e. whether gregex's grammar accepts
+    it and glypy has an interpretation of each of its residues and linkages.
+
+    Unlike `glypy_plottable`, this never renders anything.
+    '''
+    if not wff(linear_code_expression):
+        return False
+    try:
+        to_glycan(linear_code_expression, False)
+        return True
+    except Exception as e:
+        return False
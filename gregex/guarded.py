@@ -0,0 +1,193 @@
+'''
+Validation and analysis with per-expression resource budgets, so that one
+pathological expression in a batch can't take down the host (see README NOTE
+3: NLTK's chart parser can need tens of GB for large glycans).
+
+Each guarded call runs in a forked worker process with its address space
+limited (via `resource.setrlimit`) to its current size plus the memory budget,
+while the parent enforces the wall-time budget and kills the worker if it runs
+over. Span budgets are checked cooperatively, by counting the matching spans
+(see `gregex.iter_match_spans`) before enumerating them.
+
+Results are dicts with a 'status' of
+  - 'ok'              : the call finished ('value' holds its result)
+  - 'invalid'         : (validation only) the expression is not well-formed
+  - 'budget-exceeded' : 'budget' names the budget: 'time', 'memory' or 'spans'
+  - 'error'           : the call raised an exception ('error' describes it,
+                        and 'exception' names its type)
+plus the wall time taken in 'seconds'.
+'''
+
+import multiprocessing
+import os
+from itertools import islice
+from timeit import default_timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import gregex
+
+default_time_limit = 60
+default_memory_limit = 4 * 1024 * 1024 * 1024
+
+
+class BudgetExceeded(Exception):
+    '''
+    Raised (cooperatively) by guarded work that has exhausted a budget.
+    '''
+    def __init__(self, budget):
+        Exception.__init__(self, 'Budget exceeded: {0}'.format(budget))
+        self.budget = budget
+
+
+def address_space_size():
+    '''
+    Returns the current size in bytes of this process's address space, or 0 if
+    it can't be determined.
+    '''
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def _worker(connection, function, args, kwargs, memory_limit):
+    if memory_limit is not None and resource is not None:
+        limit = address_space_size() + memory_limit
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        message = ('ok', function(*args, **kwargs))
+    except MemoryError:
+        message = ('budget-exceeded', 'memory')
+    except BudgetExceeded as e:
+        message = ('budget-exceeded', e.budget)
+    except Exception as e:
+        message = ('error', (type(e).__name__, str(e)))
+    connection.send(message)
+    connection.close()
+
+
+def run_guarded(function, args=(), kwargs=None, time_limit=default_time_limit,
+                memory_limit=default_memory_limit):
+    '''
+    Calls `function(*args, **kwargs)` in a worker process limited to
+    `time_limit` seconds of wall time and `memory_limit` more bytes of memory
+    (either may be None for no limit) and returns a result dict (see the
+    module docstring). The result must be picklable.
+    '''
+    kwargs = dict() if kwargs is None else kwargs
+    receiver, sender = multiprocessing.Pipe(False)
+    worker = multiprocessing.Process(target=_worker,
+                                     args=(sender, function, args, kwargs, memory_limit))
+    start = default_timer()
+    worker.start()
+    sender.close()
+    message = None
+    if receiver.poll(time_limit):
+        try:
+            message = receiver.recv()
+        except EOFError:
+            message = None
+    elif worker.is_alive():
+        worker.terminate()
+        message = ('budget-exceeded', 'time')
+    worker.join()
+    receiver.close()
+    seconds = default_timer() - start
+
+    if message is None:
+        # the worker died without reporting back: killed for exceeding its
+        # address space limit (or by the OOM killer); the time budget is only
+        # ever enforced by polling above
+        message = ('budget-exceeded', 'memory')
+    status, value = message
+    result = {'status':status, 'seconds':seconds}
+    if status == 'ok':
+        result['value'] = value
+    elif status == 'budget-exceeded':
+        result['budget'] = value
+    else:
+        result['exception'] = value[0]
+        result['error'] = '{0}: {1}'.format(*value)
+    return result
+
+
+def guarded_wff(linear_code_expression, grammar=None, backend='nltk',
+                time_limit=default_time_limit, memory_limit=default_memory_limit,
+                fallback=True):
+    '''
+    Checks `wff(linear_code_expression, grammar, backend)` within the given
+    budgets and returns a result dict (see the module docstring) whose status
+    is 'ok' or 'invalid' if the check finished, and which records the
+    'backend' that decided it.
+
+    If the NLTK backend runs over budget and `fallback` is True, the check is
+    retried (within the same budgets) with the compiled Earley recognizer,
+    which accepts the same language far more cheaply.
+    '''
+    result = run_guarded(gregex.wff, (linear_code_expression, grammar, backend),
+                         time_limit=time_limit, memory_limit=memory_limit)
+    if result['status'] == 'budget-exceeded' and fallback and backend == 'nltk':
+        seconds = result['seconds']
+        result = run_guarded(gregex.wff, (linear_code_expression, grammar, 'earley'),
+                             time_limit=time_limit, memory_limit=memory_limit)
+        result['seconds'] += seconds
+        result['fallback'] = True
+        backend = 'earley'
+    if result['status'] == 'ok' and not result.pop('value'):
+        result['status'] = 'invalid'
+    result['backend'] = backend
+    return result
+
+
+def check_span_budget(linear_code_expression, uncertainty_operator, max_spans):
+    '''
+    Raises `BudgetExceeded('spans')` if `uncertainty_operator` has more than
+    `max_spans` matching spans in `linear_code_expression`. Only up to
+    max_spans + 1 spans are ever enumerated.
+    '''
+    if max_spans is None:
+        return
+    spans = gregex.iter_match_spans(gregex.tokenizer(linear_code_expression),
+                                    uncertainty_operator)
+    if sum(1 for _ in islice(spans, max_spans + 1)) > max_spans:
+        raise BudgetExceeded('spans')
+
+
+def _analyze_within_span_budget(linear_code_expression, uncertainty_operator,
+                                substitution, with_context, max_spans):
+    check_span_budget(linear_code_expression, uncertainty_operator, max_spans)
+    return gregex.analyze_matches(linear_code_expression, uncertainty_operator,
+                                  substitution, with_context)
+
+
+def guarded_analyze_matches(linear_code_expression, uncertainty_operator,
+                            substitution=None, with_context=False,
+                            time_limit=default_time_limit,
+                            memory_limit=default_memory_limit, max_spans=None):
+    '''
+    Runs `analyze_matches` within the given budgets - including at most
+    `max_spans` matching spans, if not None - and returns a result dict (see
+    the module docstring).
+    '''
+    return run_guarded(_analyze_within_span_budget,
+                       (linear_code_expression, uncertainty_operator,
+                        substitution, with_context, max_spans),
+                       time_limit=time_limit, memory_limit=memory_limit)
+
+
+def validate_all(linear_code_expressions, grammar=None, backend='nltk',
+                 time_limit=default_time_limit, memory_limit=default_memory_limit,
+                 fallback=True):
+    '''
+    Lazily generates `guarded_wff` results for each of
+    `linear_code_expressions`, with each result's 'expression' set.
+    '''
+    for lce in linear_code_expressions:
+        result = guarded_wff(lce, grammar, backend, time_limit, memory_limit, fallback)
+        result['expression'] = lce
+        yield result
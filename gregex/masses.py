@@ -0,0 +1,302 @@
+'''
+Monoisotopic and average masses of glycans and of their fragments (e.g.
+operator matches), for annotating mass spectra, without building glypy
+objects.
+
+The mass of each bare saccharide unit (see `gregex.SU_bare`) is derived once
+from glypy (see `gregex.glypy_monosaccharide`) and cached on disk under
+`gregex_cache_dir('masses')`. A residue's mass is its monosaccharide's mass
+less one water, lost to the glycosidic bond, so
+  - the mass of a glycan is the sum of its residue masses plus one water
+  - the mass of a span of tokens (see `gregex.iter_match_spans`) is the sum of
+    the residue masses in it (the neutral mass of the residues as a fragment
+    still bonded to the rest); parens weigh nothing
+`SpanMasses` answers the latter in O(1) per span from prefix sums over the
+tokens. Units glypy has no interpretation of have NaN masses, and so does
+anything containing them.
+
+`MassIndex` sorts the masses of a library of glycans (one per line) and keeps
+them in .npy files next to the library, which are memory-mapped when loaded,
+so that glycans within a tolerance window of a mass are found by binary
+search.
+
+Run as a script to find the glycans in a library within a tolerance of a mass:
+    python -m gregex.masses LIBRARY MASS [--tolerance DA | --ppm PPM] [--average]
+'''
+
+import argparse
+import json
+import os
+
+import numpy as np
+from glypy.composition import Composition
+
+import gregex
+import bulk_tokenizer
+
+# Bump whenever the layout of the cached mass table changes.
+mass_table_format = 1
+
+_residue_masses = dict()
+
+
+def glypy_version():
+    try:
+        import pkg_resources
+        return pkg_resources.get_distribution('glypy').version
+    except Exception:
+        return 'unknown'
+
+
+def water_mass(average=False):
+    return Composition('H2O').calc_mass(average=average)
+
+
+def compute_residue_masses():
+    '''
+    Returns a dict from each bare saccharide unit to its (monoisotopic,
+    average) residue masses, or to None if glypy can't interpret it.
+    '''
+    masses = dict()
+    water = (water_mass(False), water_mass(True))
+    for unit in sorted(gregex.SU_bare):
+        try:
+            monosaccharide = gregex.glypy_monosaccharide(unit)
+        except Exception:
+            masses[unit] = None
+            continue
+        masses[unit] = (monosaccharide.mass() - water[0],
+                        monosaccharide.mass(average=True) - water[1])
+    return masses
+
+
+def residue_masses(use_cache=True):
+    '''
+    Returns the residue masses of the bare saccharide units (see
+    `compute_residue_masses`), memoized in-process and, if `use_cache` is
+    True, stored on disk keyed by the glypy version.
+    '''
+    if 'table' in _residue_masses:
+        return _residue_masses['table']
+    cache_fp = None
+    if use_cache:
+        name = 'residues-{0}-{1}.json'.format(glypy_version(), mass_table_format)
+        cache_fp = os.path.join(gregex.gregex_cache_dir('masses'), name)
+    table = None
+    if cache_fp is not None and os.path.exists(cache_fp):
+        try:
+            with open(cache_fp, 'r') as cache_file:
+                saved = json.load(cache_file)
+            table = dict((str(unit), None if masses is None else tuple(masses))
+                         for unit, masses in saved.items())
+            if set(table) != set(gregex.SU_bare):
+                table = None
+        except Exception:
+            table = None
+    if table is None:
+        table = compute_residue_masses()
+        if cache_fp is not None:
+            temp_fp = '{0}.{1}.tmp'.format(cache_fp, os.getpid())
+            with open(temp_fp, 'w') as cache_file:
+                json.dump(table, cache_file, indent=1, sort_keys=True)
+            os.rename(temp_fp, cache_fp)
+    _residue_masses['table'] = table
+    return table
+
+
+def token_masses(average=False):
+    '''
+    Returns an array of the residue mass of each token in
+    `bulk_tokenizer.vocabulary` (0 for parens, NaN for uninterpretable units).
+    '''
+    key = 'average' if average else 'monoisotopic'
+    if key not in _residue_masses:
+        table = residue_masses()
+        masses = np.zeros(len(bulk_tokenizer.vocabulary))
+        for i, token in enumerate(bulk_tokenizer.vocabulary):
+            if token in gregex.parentheses:
+                continue
+            unit_masses = table[gregex.split_bond_information(token)[0]]
+            masses[i] = np.nan if unit_masses is None else unit_masses[int(average)]
+        _residue_masses[key] = masses
+    return _residue_masses[key]
+
+
+def tokenize(linear_code_expression):
+    ids, offsets, errors = bulk_tokenizer.tokenize_buffer((linear_code_expression + '\n').encode('ascii'))
+    if len(errors) > 0:
+        raise Exception('Untokenizable linear code expression: {0}'.format(linear_code_expression))
+    return ids
+
+
+class SpanMasses(object):
+    '''
+    The masses of every span of tokens of one glycan: `prefix[k]` is the mass
+    of the residues among its first k tokens, so the mass of span (i, j) is
+    prefix[j] - prefix[i]. (Residues of unknown mass are counted separately,
+    in `unknown`, so that they only make the spans containing them NaN.)
+    '''
+    def __init__(self, linear_code_expression, average=False):
+        self.average = average
+        masses = token_masses(average)[tokenize(linear_code_expression)]
+        is_unknown = np.isnan(masses)
+        self.prefix = np.zeros(len(masses) + 1)
+        np.cumsum(np.where(is_unknown, 0.0, masses), out=self.prefix[1:])
+        self.unknown = np.zeros(len(masses) + 1, dtype=np.int64)
+        np.cumsum(is_unknown, out=self.unknown[1:])
+
+    def __len__(self):
+        return len(self.prefix) - 1
+
+    def span(self, i, j):
+        '''
+        Returns the mass of the residues in tokens[i:j].
+        '''
+        if self.unknown[j] > self.unknown[i]:
+            return np.nan
+        return self.prefix[j] - self.prefix[i]
+
+    def spans(self, starts, ends):
+        '''
+        Returns the masses of the spans (starts[k], ends[k]) as an array.
+        '''
+        starts, ends = np.asarray(starts), np.asarray(ends)
+        masses = self.prefix[ends] - self.prefix[starts]
+        masses[self.unknown[ends] > self.unknown[starts]] = np.nan
+        return masses
+
+    def glycan(self):
+        '''
+        Returns the mass of the whole glycan.
+        '''
+        return self.span(0, len(self)) + water_mass(self.average)
+
+
+def glycan_mass(linear_code_expression, average=False):
+    return SpanMasses(linear_code_expression, average).glycan()
+
+
+def match_masses(linear_code_expression, uncertainty_operator, average=False):
+    '''
+    Returns the spans matching `uncertainty_operator` in span order (see
+    `gregex.iter_match_spans`) and their masses, as (starts, ends, masses)
+    arrays.
+    '''
+    span_masses = SpanMasses(linear_code_expression, average)
+    tokens = [bulk_tokenizer.vocabulary[i] for i in tokenize(linear_code_expression)]
+    spans = np.array(list(gregex.iter_match_spans(tokens, uncertainty_operator)),
+                     dtype=np.int64).reshape(-1, 2)
+    return spans[:, 0], spans[:, 1], span_masses.spans(spans[:, 0], spans[:, 1])
+
+
+def library_masses(ids, offsets, errors, average=False):
+    '''
+    Returns the mass of each record of a tokenized library (the output of
+    `bulk_tokenizer.tokenize_buffer`), NaN for records that could not be
+    tokenized and for empty (blank) records.
+    '''
+    n_records = len(offsets) - 1
+    lengths = np.diff(offsets)
+    record = np.repeat(np.arange(n_records), lengths)
+    masses = np.bincount(record, weights=token_masses(average)[ids], minlength=n_records)
+    masses += water_mass(average)
+    masses[errors] = np.nan
+    masses[lengths == 0] = np.nan
+    return masses
+
+
+class MassIndex(object):
+    '''
+    The glycans of a library sorted by mass: `masses` is ascending and
+    `records[k]` is the record (line) of the library with mass `masses[k]`.
+    Records with NaN masses are left out.
+    '''
+    def __init__(self, masses, records):
+        self.masses = masses
+        self.records = records
+
+    def __len__(self):
+        return len(self.masses)
+
+    @classmethod
+    def from_masses(cls, masses):
+        known = np.flatnonzero(~np.isnan(masses))
+        order = known[np.argsort(masses[known], kind='mergesort')]
+        return cls(masses[order], order)
+
+    @classmethod
+    def from_file(cls, library_fp, average=False):
+        return cls.from_masses(library_masses(*bulk_tokenizer.tokenize_file(library_fp),
+                                              average=average))
+
+    @staticmethod
+    def paths(prefix):
+        return prefix + '.masses.npy', prefix + '.records.npy'
+
+    @classmethod
+    def for_library(cls, library_fp, average=False):
+        '''
+        Returns the index of the library file at `library_fp`, memory-mapped
+        from the files saved next to it if they are at least as new as the
+        library, and otherwise built and saved there first.
+        '''
+        prefix = '{0}.{1}'.format(library_fp, 'average' if average else 'monoisotopic')
+        saved = cls.paths(prefix)
+        if not all(os.path.exists(fp) and os.path.getmtime(fp) >= os.path.getmtime(library_fp)
+                   for fp in saved):
+            cls.from_file(library_fp, average).save(prefix)
+        return cls.load(prefix)
+
+    def save(self, prefix):
+        '''
+        Writes the index to `prefix + '.masses.npy'` and
+        `prefix + '.records.npy'`.
+        '''
+        for fp, array in zip(self.paths(prefix), (self.masses, self.records)):
+            temp_fp = '{0}.{1}.tmp.npy'.format(fp, os.getpid())
+            np.save(temp_fp, array)
+            os.rename(temp_fp, fp)
+
+    @classmethod
+    def load(cls, prefix):
+        '''
+        Memory-maps an index written by `save`.
+        '''
+        masses_fp, records_fp = cls.paths(prefix)
+        return cls(np.load(masses_fp, mmap_mode='r'), np.load(records_fp, mmap_mode='r'))
+
+    def window(self, low, high):
+        '''
+        Returns the positions in the index of the masses in [low, high], as a
+        slice.
+        '''
+        return slice(int(np.searchsorted(self.masses, low, side='left')),
+                     int(np.searchsorted(self.masses, high, side='right')))
+
+    def query(self, mass, tolerance=0.01, ppm=None):
+        '''
+        Returns the records within `tolerance` Da of `mass` (or within `ppm`
+        parts per million, if given) and their masses, as two arrays in order
+        of mass.
+        '''
+        if ppm is not None:
+            tolerance = mass * ppm * 1e-6
+        window = self.window(mass - tolerance, mass + tolerance)
+        return np.array(self.records[window]), np.array(self.masses[window])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find the glycans in a library within a tolerance of a mass.')
+    parser.add_argument('library', metavar='LIBRARY', help='file of linear code expressions, one per line')
+    parser.add_argument('mass', metavar='MASS', type=float, help='the (neutral) mass to look for')
+    parser.add_argument('--tolerance', metavar='DA', type=float, default=0.01,
+                        help='the tolerance in daltons (default: 0.01)')
+    parser.add_argument('--ppm', metavar='PPM', type=float, default=None,
+                        help='the tolerance in parts per million (overrides --tolerance)')
+    parser.add_argument('--average', action='store_true',
+                        help='use average rather than monoisotopic masses')
+    args = parser.parse_args()
+    index = MassIndex.for_library(args.library, args.average)
+    records, masses = index.query(args.mass, args.tolerance, args.ppm)
+    for record, mass in zip(records, masses):
+        print('{0}\t{1:.6f}'.format(record, mass))
@@ -0,0 +1,306 @@
+'''
+Out-of-core match tables for glycans too large for `analyze_matches` and
+`compare_matches`.
+
+For a glycan of n tokens, the left/match/right tables those functions build
+have up to n(n+1)/2 rows of strings, which for polymeric or multi-antennary
+glycans of thousands of tokens does not fit in memory. Here the rows are
+instead computed in chunks of consecutive start indices (each holding about
+`chunk_rows` rows) and each chunk is written to its own .npz file of columns:
+  - 'matches' tables (`write_match_table`): one row per matching span, with
+    int32 columns 'start' and 'end' and, if a substitution is checked, a
+    boolean 'valid_sub' column (as in `analyze_matches`)
+  - 'comparison' tables (`write_comparison_table`): one row per nonempty span,
+    with 'start', 'end' and boolean columns 'A' and 'B' marking whether it
+    matches each operator (`compare_matches`' sets are unions of these rows)
+A span (i, j) stands for tokens[i:j]; contexts and matches are only turned
+back into strings when rows are read (`iter_rows`).
+
+Progress is recorded in the table directory's manifest ('manifest.json'),
+rewritten after every chunk. Chunk files and the manifest are replaced
+atomically, so a run that is interrupted (or stopped after `max_chunks`) can
+be resumed from the first start index not yet written by calling the same
+function again.
+
+Expressions are tokenized with `bulk_tokenizer`, which (unlike the recursive
+`tokenizer`) handles expressions of any length. Run as a script to print a
+table as tab-separated rows:
+    python -m gregex.match_tables TABLE_DIR
+'''
+
+import json
+import os
+import sys
+
+import numpy as np
+
+from funcy import str_join
+import gregex
+import bulk_tokenizer
+
+manifest_name = 'manifest.json'
+table_format = 1
+default_chunk_rows = 1000000
+
+
+def expression_tokens(linear_code_expression):
+    '''
+    Returns the tokens of `linear_code_expression` (as `tokenizer` would split
+    it) as a list of strings, raising an Exception if it can't be tokenized.
+    '''
+    buffer = (linear_code_expression + '\n').encode('ascii')
+    ids, offsets, errors = bulk_tokenizer.tokenize_buffer(buffer)
+    if len(errors) > 0:
+        raise Exception('Untokenizable linear code expression: {0}'.format(linear_code_expression))
+    return [bulk_tokenizer.vocabulary[i] for i in ids]
+
+
+def character_offsets(tokens):
+    '''
+    Returns an array whose k-th entry is the character offset of token k (the
+    last entry being the length of the expression).
+    '''
+    offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum([len(token) for token in tokens], out=offsets[1:])
+    return offsets
+
+
+def manifest_path(table_dir):
+    return os.path.join(table_dir, manifest_name)
+
+
+def read_manifest(table_dir):
+    '''
+    Returns the manifest of the table in `table_dir`, or None if there is none.
+    '''
+    if not os.path.exists(manifest_path(table_dir)):
+        return None
+    with open(manifest_path(table_dir), 'r') as manifest_file:
+        return json.load(manifest_file)
+
+
+def table_manifest(table_dir):
+    '''
+    Returns the manifest of the table in `table_dir`, raising ValueError if
+    there is none.
+    '''
+    manifest = read_manifest(table_dir)
+    if manifest is None:
+        raise ValueError('No match table in {0}'.format(table_dir))
+    return manifest
+
+
+def write_manifest(table_dir, manifest):
+    temp_fp = '{0}.{1}.tmp'.format(manifest_path(table_dir), os.getpid())
+    with open(temp_fp, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.rename(temp_fp, manifest_path(table_dir))
+
+
+def write_chunk(table_dir, index, columns):
+    name = 'chunk-{0:06d}.npz'.format(index)
+    temp_fp = os.path.join(table_dir, '{0}.{1}.tmp.npz'.format(name, os.getpid()))
+    np.savez(temp_fp, **columns)
+    os.rename(temp_fp, os.path.join(table_dir, name))
+    return name
+
+
+def open_table(table_dir, identity, resume):
+    '''
+    Returns the manifest to continue writing the table described by
+    `identity` in `table_dir`: the saved one if `resume` is True and it
+    describes the same table, and otherwise a fresh one (after deleting any
+    chunks listed in the saved one).
+    '''
+    if not os.path.isdir(table_dir):
+        os.makedirs(table_dir)
+    manifest = read_manifest(table_dir)
+    if manifest is not None and resume:
+        if any(manifest.get(key) != value for key, value in identity.items()):
+            e = '{0} holds a different table; pass resume=False to replace it'
+            raise ValueError(e.format(table_dir))
+        return manifest
+    if manifest is not None:
+        for chunk in manifest['chunks']:
+            chunk_fp = os.path.join(table_dir, chunk['file'])
+            if os.path.exists(chunk_fp):
+                os.remove(chunk_fp)
+    manifest = dict(identity)
+    manifest.update({'chunks':[], 'next_start':0, 'rows':0, 'complete':False})
+    return manifest
+
+
+def fill_table(table_dir, manifest, n_tokens, start_rows, chunk_rows, max_chunks):
+    '''
+    Writes chunks to `table_dir` from `manifest['next_start']` onwards, where
+    `start_rows(i)` returns the columns (a dict of arrays) of the rows with
+    start index i, and returns a summary of the table (see
+    `write_match_table`).
+    '''
+    resumed_from = manifest['next_start']
+    written = 0
+    start = resumed_from
+    while start < n_tokens and (max_chunks is None or written < max_chunks):
+        first_start, blocks, n_rows = start, [], 0
+        while start < n_tokens and n_rows < chunk_rows:
+            block = start_rows(start)
+            blocks.append(block)
+            n_rows += len(block['start'])
+            start += 1
+        columns = dict((name, np.concatenate([block[name] for block in blocks]))
+                       for name in manifest['columns'])
+        name = write_chunk(table_dir, len(manifest['chunks']), columns)
+        manifest['chunks'].append({'file':name, 'first_start':first_start,
+                                   'stop_start':start, 'rows':n_rows})
+        manifest['next_start'] = start
+        manifest['rows'] += n_rows
+        manifest['complete'] = start >= n_tokens
+        write_manifest(table_dir, manifest)
+        written += 1
+    if n_tokens == 0 and not manifest['complete']:
+        manifest['complete'] = True
+        write_manifest(table_dir, manifest)
+    return {'rows':manifest['rows'],
+            'chunks':len(manifest['chunks']),
+            'complete':manifest['complete'],
+            'resumed_from':resumed_from}
+
+
+def write_match_table(linear_code_expression, uncertainty_operator, table_dir,
+                      substitution=None, chunk_rows=default_chunk_rows,
+                      resume=True, max_chunks=None):
+    '''
+    Writes the spans of `linear_code_expression` matching
+    `uncertainty_operator` (the rows of `analyze_matches` with contexts, in
+    span order) to a chunked table in `table_dir` (see the module docstring),
+    checking `substitution` against each if it is not None.
+
+    If `resume` is True and `table_dir` holds a partial table of the same
+    matches, writing continues where it stopped. At most `max_chunks` chunks
+    are written by this call (if not None). Returns a dict with the total
+    number of 'rows' and 'chunks' written so far, whether the table is
+    'complete', and the start index this call 'resumed_from'.
+    '''
+    op = uncertainty_operator
+    assert op in gregex.operator_automata, "Unknown uncertainty operator:\n\t{0}".format(op)
+    columns = ['start', 'end'] + (['valid_sub'] if substitution is not None else [])
+    identity = {'format':table_format,
+                'kind':'matches',
+                'expression':linear_code_expression,
+                'operators':[op],
+                'substitution':substitution,
+                'columns':columns}
+    manifest = open_table(table_dir, identity, resume)
+
+    tokens = expression_tokens(linear_code_expression)
+    deltas = [gregex.paren_delta.get(token, 0) for token in tokens]
+    if substitution is not None:
+        pred_mapper = {'...':gregex.is_ligand_match,
+                       '_':gregex.is_continuation_match,
+                       '|':gregex.is_possible_branch_point_match}
+        sub_is_match = pred_mapper[op](substitution)
+        span_is_valid = gregex.substitution_span_validity(tokens, substitution)
+
+    def start_rows(i):
+        ends = np.array(gregex.operator_match_ends(deltas, i, op), dtype=np.int32)
+        starts = np.full(len(ends), i, dtype=np.int32)
+        block = {'start':starts, 'end':ends}
+        if substitution is not None:
+            block['valid_sub'] = np.array([sub_is_match and span_is_valid((i, j)) for j in ends],
+                                          dtype=bool)
+        return block
+
+    return fill_table(table_dir, manifest, len(tokens), start_rows, chunk_rows, max_chunks)
+
+
+def write_comparison_table(uncertainty_operator_A, uncertainty_operator_B,
+                           linear_code_expression, table_dir,
+                           chunk_rows=default_chunk_rows, resume=True,
+                           max_chunks=None):
+    '''
+    Writes every nonempty span of `linear_code_expression`, in span order,
+    with whether it matches `uncertainty_operator_A` and
+    `uncertainty_operator_B` (the information `compare_matches` returns with
+    contexts), to a chunked table in `table_dir`. Resuming and the result are
+    as for `write_match_table`.
+    '''
+    op_A, op_B = uncertainty_operator_A, uncertainty_operator_B
+    for op in (op_A, op_B):
+        assert op in gregex.operator_automata, "Unknown uncertainty operator:\n\t{0}".format(op)
+    identity = {'format':table_format,
+                'kind':'comparison',
+                'expression':linear_code_expression,
+                'operators':[op_A, op_B],
+                'substitution':None,
+                'columns':['start', 'end', 'A', 'B']}
+    manifest = open_table(table_dir, identity, resume)
+
+    tokens = expression_tokens(linear_code_expression)
+    deltas = [gregex.paren_delta.get(token, 0) for token in tokens]
+    n = len(tokens)
+
+    def start_rows(i):
+        block = {'start':np.full(n - i, i, dtype=np.int32),
+                 'end':np.arange(i + 1, n + 1, dtype=np.int32)}
+        for column, op in (('A', op_A), ('B', op_B)):
+            flags = np.zeros(n - i, dtype=bool)
+            flags[np.array(gregex.operator_match_ends(deltas, i, op), dtype=np.int64) - (i + 1)] = True
+            block[column] = flags
+        return block
+
+    return fill_table(table_dir, manifest, n, start_rows, chunk_rows, max_chunks)
+
+
+def iter_chunks(table_dir):
+    '''
+    Lazily generates the chunks of the table in `table_dir`, in order, each as
+    a dict from column names to arrays; only one chunk is loaded at a time.
+    '''
+    manifest = table_manifest(table_dir)
+    for chunk in manifest['chunks']:
+        with np.load(os.path.join(table_dir, chunk['file'])) as saved:
+            yield dict((name, saved[name]) for name in manifest['columns'])
+
+
+def read_column(table_dir, name):
+    '''
+    Returns a whole column of the table in `table_dir` as one array.
+    '''
+    return np.concatenate([chunk[name] for chunk in iter_chunks(table_dir)])
+
+
+def iter_rows(table_dir):
+    '''
+    Lazily generates the rows of the table in `table_dir` with their spans
+    turned back into (left context, match, right context) strings, followed
+    by the table's boolean columns, as in `analyze_matches`.
+    '''
+    manifest = table_manifest(table_dir)
+    lce = manifest['expression']
+    offsets = character_offsets(expression_tokens(lce))
+    flags = manifest['columns'][2:]
+    for chunk in iter_chunks(table_dir):
+        starts, ends = offsets[chunk['start']], offsets[chunk['end']]
+        flag_columns = [chunk[name] for name in flags]
+        for r in range(len(starts)):
+            i, j = starts[r], ends[r]
+            yield (lce[:i], lce[i:j], lce[j:]) + tuple(bool(column[r]) for column in flag_columns)
+
+
+def column_names(table_dir):
+    '''
+    Returns the column names of `iter_rows` for the table in `table_dir`.
+    '''
+    manifest = table_manifest(table_dir)
+    names = {'valid_sub':'valid_sub?',
+             'A':'{0}?'.format(manifest['operators'][0]),
+             'B':'{0}?'.format(manifest['operators'][-1])}
+    return ['left_context', 'match', 'right_context'] + [names[name] for name in manifest['columns'][2:]]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('Usage: python -m gregex.match_tables TABLE_DIR')
+    print(str_join('\t', column_names(sys.argv[1])))
+    for row in iter_rows(sys.argv[1]):
+        print(str_join('\t', map(str, row)))
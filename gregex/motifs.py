@@ -0,0 +1,207 @@
+'''
+Searching glycans for a panel of motifs (epitopes such as sialyl-Lewis x,
+LacNAc repeats or core fucose) all at once.
+
+A motif is a linear code fragment, e.g. 'NNa3Ab4(Fa3)GN', matched against the
+tokens of a glycan (so a motif never matches part of a token). The rightmost
+residue of a motif is written without its linkage (like the reducing end of
+a glycan) and matches that residue with any linkage or none: 'Ab4GN' occurs
+twice in 'Ab4GNb2Ma3(Ab4GNb2Ma6)Mb4GNb4GN'.
+
+`MotifAutomaton` compiles every motif into one Aho-Corasick automaton over
+`bulk_tokenizer` token ids, stored as a dense transition table, so each glycan
+is searched for the whole panel in a single left-to-right pass over its
+tokens. A library (the output of `bulk_tokenizer.tokenize_file`) is searched
+with all of its glycans stepped through the table together, one token
+position at a time.
+
+Run as a script to search a library file (one expression per line) for the
+motifs in a file of motifs (one per line, optionally preceded by a name and a
+tab; '#' starts a comment):
+    python -m gregex.motifs MOTIFS LIBRARY
+which prints one 'record, motif, token position' line per occurrence; search
+a single glycan with `python -m gregex LCE --motifs MOTIFS`.
+'''
+
+import sys
+from collections import deque
+
+import numpy as np
+
+import gregex
+import bulk_tokenizer
+
+
+def load_motifs(filepath):
+    '''
+    Reads (name, motif) pairs from a file with one motif per line, as either
+    'name<TAB>motif' or just 'motif' (which is then its own name); blank lines
+    and lines starting with '#' are skipped.
+    '''
+    motifs = []
+    with open(filepath, 'r') as motifs_file:
+        for line in motifs_file:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) > 2:
+                raise ValueError('Expected a motif, optionally preceded by a name and a tab:\n\t{0}'.format(line))
+            motifs.append((fields[0], fields[-1]))
+    return motifs
+
+
+def motif_patterns(motif):
+    '''
+    Returns the token id sequences `motif` stands for: its tokens, with a bare
+    rightmost residue replaced by each token of the same residue.
+    '''
+    ids, offsets, errors = bulk_tokenizer.tokenize_buffer((motif + '\n').encode('ascii'))
+    if len(errors) > 0 or len(ids) == 0:
+        raise ValueError('Invalid motif: {0}'.format(motif))
+    ids = list(ids)
+    last = bulk_tokenizer.vocabulary[ids[-1]]
+    if last not in gregex.SU_bare:
+        return [ids]
+    return [ids[:-1] + [i] for i, token in enumerate(bulk_tokenizer.vocabulary)
+            if token not in gregex.parentheses and gregex.split_bond_information(token)[0] == last]
+
+
+class MotifAutomaton(object):
+    '''
+    An Aho-Corasick automaton recognizing every motif in a panel.
+
+    `motifs` is a sequence of (name, motif) pairs (see `load_motifs`); motifs
+    are referred to by their index in it. `delta[state, token id]` is the
+    state after reading a token, and the motifs recognized on entering a
+    state are `out_motifs[out_offsets[s]:out_offsets[s + 1]]`, each ending
+    with the token just read and spanning the corresponding entry of
+    `out_lengths` tokens.
+    '''
+    def __init__(self, motifs):
+        self.names = [name for name, motif in motifs]
+        self.motifs = [motif for name, motif in motifs]
+        goto, outputs = [dict()], [[]]
+        for m, motif in enumerate(self.motifs):
+            for pattern in motif_patterns(motif):
+                state = 0
+                for token_id in pattern:
+                    if token_id not in goto[state]:
+                        goto.append(dict())
+                        outputs.append([])
+                        goto[state][token_id] = len(goto) - 1
+                    state = goto[state][token_id]
+                outputs[state].append((m, len(pattern)))
+
+        n_states, n_symbols = len(goto), len(bulk_tokenizer.vocabulary)
+        delta = np.zeros((n_states, n_symbols), dtype=np.int32)
+        fail = [0] * n_states
+        queue = deque([0])
+        while queue:
+            state = queue.popleft()
+            if state != 0:
+                delta[state] = delta[fail[state]]
+            for token_id, target in goto[state].items():
+                delta[state, token_id] = target
+            for token_id, target in goto[state].items():
+                fail[target] = delta[fail[state], token_id] if state != 0 else 0
+                outputs[target] = outputs[target] + outputs[fail[target]]
+                queue.append(target)
+        self.delta = delta
+
+        self.out_offsets = np.zeros(n_states + 1, dtype=np.int64)
+        np.cumsum([len(output) for output in outputs], out=self.out_offsets[1:])
+        self.out_motifs = np.array([m for output in outputs for m, length in output], dtype=np.int32)
+        self.out_lengths = np.array([length for output in outputs for m, length in output], dtype=np.int32)
+        self.out_counts = np.diff(self.out_offsets)
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def search_tokens(self, ids, offsets):
+        '''
+        Searches every record of a tokenized library (see
+        `bulk_tokenizer.tokenize_buffer`) and returns its occurrences as three
+        arrays (records, motifs, token positions), sorted by record, then by
+        position.
+
+        Records are ordered by length, so the records still being read are
+        always a prefix; each step advances all of them by one token.
+        '''
+        starts = np.asarray(offsets[:-1], dtype=np.int64)
+        lengths = np.diff(offsets)
+        order = np.argsort(-lengths, kind='mergesort')
+        sorted_lengths = lengths[order]
+        sorted_starts = starts[order]
+        states = np.zeros(len(order), dtype=np.int32)
+        found = []
+        max_length = int(sorted_lengths[0]) if len(order) > 0 else 0
+        for k in range(max_length):
+            active = int(np.searchsorted(-sorted_lengths, -k, side='left'))
+            states[:active] = self.delta[states[:active], ids[sorted_starts[:active] + k]]
+            hits = np.flatnonzero(self.out_counts[states[:active]])
+            if len(hits) == 0:
+                continue
+            counts = self.out_counts[states[hits]]
+            first = np.repeat(self.out_offsets[states[hits]], counts)
+            within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            outputs = first + within
+            found.append((order[np.repeat(hits, counts)],
+                          self.out_motifs[outputs],
+                          k + 1 - self.out_lengths[outputs]))
+        if not found:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty.astype(np.int32), empty
+        records, motifs, positions = [np.concatenate(column) for column in zip(*found)]
+        by_occurrence = np.lexsort((motifs, positions, records))
+        return records[by_occurrence], motifs[by_occurrence], positions[by_occurrence]
+
+    def search_expressions(self, linear_code_expressions):
+        '''
+        Searches each of `linear_code_expressions` (see `search_tokens`);
+        expressions that can't be tokenized have no occurrences.
+        '''
+        buffer = ''.join(lce + '\n' for lce in linear_code_expressions).encode('ascii')
+        ids, offsets, errors = bulk_tokenizer.tokenize_buffer(buffer)
+        return self.search_tokens(ids, offsets)
+
+    def search_file(self, filepath):
+        '''
+        Searches each line of the file at `filepath` (see `search_tokens`);
+        lines that can't be tokenized have no occurrences.
+        '''
+        ids, offsets, errors = bulk_tokenizer.tokenize_file(filepath)
+        return self.search_tokens(ids, offsets)
+
+    def search(self, linear_code_expression):
+        '''
+        Returns the occurrences of the motifs in one glycan as (motif name,
+        token position) pairs, in order of position. Raises an Exception if
+        `linear_code_expression` can't be tokenized.
+        '''
+        buffer = (linear_code_expression + '\n').encode('ascii')
+        ids, offsets, errors = bulk_tokenizer.tokenize_buffer(buffer)
+        if len(errors) > 0:
+            raise Exception('Untokenizable linear code expression: {0}'.format(linear_code_expression))
+        records, motifs, positions = self.search_tokens(ids, offsets)
+        return [(self.names[m], int(p)) for m, p in zip(motifs, positions)]
+
+    def counts(self, ids, offsets):
+        '''
+        Returns the number of occurrences of each motif in each record of a
+        tokenized library, as an array with a row per record and a column per
+        motif.
+        '''
+        records, motifs, positions = self.search_tokens(ids, offsets)
+        n_records = len(offsets) - 1
+        flat = np.bincount(records * len(self) + motifs, minlength=n_records * len(self))
+        return flat.reshape(n_records, len(self))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python -m gregex.motifs MOTIFS LIBRARY')
+    automaton = MotifAutomaton(load_motifs(sys.argv[1]))
+    records, motifs, positions = automaton.search_file(sys.argv[2])
+    for r, m, p in zip(records, motifs, positions):
+        print('{0}\t{1}\t{2}'.format(r, automaton.names[m], p))
@@ -0,0 +1,238 @@
+'''
+Expanding glycosylation reaction networks from rules written with Krambeck et
+al. 2009's uncertainty operators.
+
+A rule rewrites a substrate pattern into a product pattern, e.g. (adding a
+core fucose)
+    core_fucosylation    ...GNb4GN    ...GNb4(Fa6)GN
+Both patterns must contain the same uncertainty operator tokens in the same
+order. A glycan is a substrate of a rule for every way it is an instance of the
+substrate pattern (see `gregex.iter_instance_splits`), and the matching product
+substitutes the same match for each operator token in the product pattern.
+
+Glycans are kept in canonical linear code (see `gregex.canonical_linear_code`),
+so rules should be written against canonical forms. Products that are not
+well-formed are dropped, and the rest are deduplicated by structural hash.
+
+Starting from seed glycans, `iter_network` applies every rule to every glycan
+of each generation (across worker processes), up to a number of iterations
+and of distinct structures, and generates the network as it grows;
+`write_network` streams it to disk.
+
+Run as a script to expand a network from files of rules (one per line: name,
+substrate and product, tab-separated; '#' starts a comment) and seeds (one
+expression per line):
+    python -m gregex.network RULES SEEDS OUTPUT_PREFIX [options]
+'''
+
+import argparse
+import multiprocessing
+
+import gregex
+
+
+def operator_sequence(pattern):
+    return tuple(gregex.uncertainty_operator_pattern.findall(pattern))
+
+
+def make_rule(name, substrate, product):
+    '''
+    Returns a rule as a (name, substrate pattern, product pattern) triple,
+    raising ValueError if the patterns' operator tokens differ.
+    '''
+    if operator_sequence(substrate) != operator_sequence(product):
+        e = "Rule '{0}': substrate {1} and product {2} must contain the same uncertainty operators in the same order"
+        raise ValueError(e.format(name, substrate, product))
+    return (name, substrate, product)
+
+
+def load_rules(filepath):
+    '''
+    Reads rules from a file with one tab-separated (name, substrate, product)
+    triple per line; blank lines and lines starting with '#' are skipped.
+    '''
+    rules = []
+    with open(filepath, 'r') as rules_file:
+        for line in rules_file:
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 3:
+                raise ValueError('Expected name, substrate and product separated by tabs:\n\t{0}'.format(line))
+            rules.append(make_rule(*fields))
+    return rules
+
+
+def apply_rule(rule, glycan):
+    '''
+    Returns the distinct well-formed products (in canonical linear code) of
+    applying `rule` to `glycan` in every way it applies.
+    '''
+    name, substrate, product = rule
+    pieces = gregex.uncertainty_operator_pattern.split(product)
+    texts = pieces[0::2]
+    products = []
+    for split in gregex.iter_instance_splits(substrate, glycan):
+        found = split[1::2]
+        candidate = texts[0] + ''.join(match + text for match, text in zip(found, texts[1:]))
+        try:
+            if not gregex.wff(candidate):
+                continue
+        except Exception:
+            continue
+        canonical = gregex.canonical_linear_code(candidate)
+        if canonical not in products:
+            products.append(canonical)
+    return products
+
+
+def apply_rules(rules, glycan):
+    reactions = []
+    for rule in rules:
+        for product in apply_rule(rule, glycan):
+            reactions.append((rule[0], product, gregex.structural_hash(product)))
+    return glycan, reactions
+
+
+# Workers are handed the rules once, by the pool initializer, instead of with
+# every task. Only worker processes set this, so concurrent expansions in one
+# process never share it.
+_network_worker_state = dict()
+
+
+def _init_network_worker(rules):
+    _network_worker_state['rules'] = rules
+
+
+def _apply_rules(glycan):
+    return apply_rules(_network_worker_state['rules'], glycan)
+
+
+def iter_network(rules, seeds, max_iterations=10, max_structures=100000, processes=None):
+    '''
+    Expands the reaction network generated by `rules` (see `make_rule`) from the
+    glycans `seeds` and lazily generates it as a sequence of events:
+      ('structure', id, generation, glycan)
+      ('reaction', substrate id, rule name, product id)
+    Every structure is generated before any reaction involving it. Seeds are
+    generation 0; generation g + 1 holds the new products of rules applied to
+    generation g, for at most `max_iterations` generations.
+
+    At most `max_structures` distinct structures are generated; once that many
+    are known, reactions to new products are dropped, and a final
+    ('truncated', generation) event marks that the network is incomplete.
+    Rules are applied to each generation across `processes` worker processes
+    (by default, one per core; 1 applies them in this process).
+    '''
+    ids = dict()
+    frontier, truncated = [], False
+    for seed in seeds:
+        glycan = gregex.canonical_linear_code(seed)
+        h = gregex.structural_hash(glycan)
+        if h in ids:
+            continue
+        if len(ids) >= max_structures:
+            truncated = True
+            break
+        ids[h] = len(ids)
+        frontier.append((ids[h], glycan))
+        yield ('structure', ids[h], 0, glycan)
+
+    rules = tuple(rules)
+    pool = (multiprocessing.Pool(processes, _init_network_worker, (rules,))
+            if processes != 1 else None)
+    generation = 0
+    try:
+        while frontier and generation < max_iterations:
+            generation += 1
+            glycan_ids = dict((glycan, i) for i, glycan in frontier)
+            glycans = [glycan for i, glycan in frontier]
+            applied = (pool.imap(_apply_rules, glycans, chunksize=max(1, len(glycans) // 64))
+                       if pool is not None else (apply_rules(rules, glycan) for glycan in glycans))
+            frontier = []
+            for glycan, reactions in applied:
+                for rule_name, product, h in reactions:
+                    if h not in ids:
+                        if len(ids) >= max_structures:
+                            truncated = True
+                            continue
+                        ids[h] = len(ids)
+                        frontier.append((ids[h], product))
+                        yield ('structure', ids[h], generation, product)
+                    yield ('reaction', glycan_ids[glycan], rule_name, ids[h])
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if truncated:
+        yield ('truncated', generation)
+
+
+def expand(rules, seeds, max_iterations=10, max_structures=100000, processes=None):
+    '''
+    Expands a network in memory (see `iter_network`) and returns a dict with
+      - 'structures' : (id, generation, glycan) triples, by id
+      - 'reactions'  : (substrate id, rule name, product id) triples
+      - 'truncated'  : whether `max_structures` cut the network short
+    '''
+    result = {'structures':[], 'reactions':[], 'truncated':False}
+    for event in iter_network(rules, seeds, max_iterations, max_structures, processes):
+        if event[0] == 'structure':
+            result['structures'].append(event[1:])
+        elif event[0] == 'reaction':
+            result['reactions'].append(event[1:])
+        else:
+            result['truncated'] = True
+    return result
+
+
+def write_network(rules, seeds, output_prefix, max_iterations=10,
+                  max_structures=100000, processes=None):
+    '''
+    Expands a network (see `iter_network`), streaming it to the tab-separated
+    files
+      - `output_prefix + '.structures.tsv'` : id, generation, glycan
+      - `output_prefix + '.reactions.tsv'`  : substrate id, rule name, product id
+    each with a header line, as it is generated; neither is held in memory.
+    Returns a dict with the number of 'structures' and 'reactions' written and
+    whether the network was 'truncated'.
+    '''
+    counts = {'structures':0, 'reactions':0, 'truncated':False}
+    with open(output_prefix + '.structures.tsv', 'w') as structures_file, \
+         open(output_prefix + '.reactions.tsv', 'w') as reactions_file:
+        structures_file.write('id\tgeneration\tglycan\n')
+        reactions_file.write('substrate\trule\tproduct\n')
+        for event in iter_network(rules, seeds, max_iterations, max_structures, processes):
+            if event[0] == 'structure':
+                structures_file.write('{0}\t{1}\t{2}\n'.format(*event[1:]))
+                counts['structures'] += 1
+            elif event[0] == 'reaction':
+                reactions_file.write('{0}\t{1}\t{2}\n'.format(*event[1:]))
+                counts['reactions'] += 1
+            else:
+                counts['truncated'] = True
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Expand a glycosylation reaction network from rules and seed glycans.')
+    parser.add_argument('rules', metavar='RULES', help='file of tab-separated (name, substrate, product) rules')
+    parser.add_argument('seeds', metavar='SEEDS', help='file of seed linear code expressions, one per line')
+    parser.add_argument('output_prefix', metavar='OUTPUT_PREFIX',
+                        help='the network is written to OUTPUT_PREFIX.structures.tsv and OUTPUT_PREFIX.reactions.tsv')
+    parser.add_argument('--max-iterations', metavar='N', type=int, default=10,
+                        help='the number of generations to expand (default: 10)')
+    parser.add_argument('--max-structures', metavar='N', type=int, default=100000,
+                        help='the maximum number of distinct structures (default: 100000)')
+    parser.add_argument('--processes', metavar='N', type=int, default=None,
+                        help='the number of worker processes (default: one per core)')
+    args = parser.parse_args()
+    with open(args.seeds, 'r') as seeds_file:
+        seeds = [line.strip() for line in seeds_file if line.strip() != '']
+    counts = write_network(load_rules(args.rules), seeds, args.output_prefix,
+                           args.max_iterations, args.max_structures, args.processes)
+    print('{0} structures, {1} reactions{2}'.format(counts['structures'], counts['reactions'],
+                                                    ' (truncated)' if counts['truncated'] else ''))
@@ -0,0 +1,240 @@
+'''
+The operations behind gregex's command-line interface, as a function from
+parsed arguments (see `gregex.cli.build_parser`) to output, so that the CLI and
+the gregex server (`gregex.server`) share one implementation.
+'''
+
+import copy
+import os
+
+from funcy import str_join
+import gregex
+import guarded
+from result_cache import ResultCache
+from similarity import SimilarityIndex
+import match_tables
+from motifs import MotifAutomaton, load_motifs
+
+cache_arguments = ('cache', 'no_cache', 'clear_cache', 'cache_size')
+
+
+def execute(args):
+    '''
+    Performs the operation described by `args` (an `argparse.Namespace` from
+    `gregex.cli.build_parser`) and returns its result as a dict:
+      - 'lines' : the lines of text the CLI prints
+      - 'table' : None, or (when output goes to an excel file via -x) a dict
+                  with the 'filepath', 'columns', 'rows' and 'include_header'
+                  to write
+
+    If the result cache is enabled (--cache, or $GREGEX_RESULT_CACHE=1, and not
+    --no-cache), the result is read from the cache (see
+    `gregex.result_cache`) when possible and stored in it otherwise. (Similarity
+    and motif searches are never cached, since the index or motif file they
+    read can change, and neither are tables written to --table-dir.)
+
+    If --time-limit, --memory-limit or --max-spans are given and the operation
+    exceeds one of them, the result instead has the single line
+    'Budget exceeded: <budget>' and a 'status' of 'budget-exceeded' (see
+    `gregex.guarded`); such results are never cached.
+
+    Raises ValueError for invalid combinations of arguments.
+    '''
+    use_cache = (args.cache or os.environ.get('GREGEX_RESULT_CACHE') == '1') and not args.no_cache
+    if args.clear_cache or use_cache:
+        cache = ResultCache(max_bytes=args.cache_size * 1024 * 1024)
+    if args.clear_cache:
+        cache.clear()
+        if args.lce is None:
+            return {'lines':[], 'table':None}
+    if args.lce is None:
+        raise ValueError('A linear code expression (LCE) is required.')
+    if (not use_cache or args.similar is not None or args.motifs is not None
+            or args.table_dir is not None):
+        return run(args)
+
+    arguments = sorted((name, value) for name, value in vars(args).items()
+                       if name not in cache_arguments)
+    grammar = args.grammar[0] if args.grammar is not None else None
+    key = cache.key(args.lce, 'cli', arguments, grammar)
+    result = cache.get(key)
+    if result is ResultCache.missing:
+        result = run(args)
+        if result.get('status') != 'budget-exceeded':
+            cache.put(key, result)
+    return result
+
+
+def budget_exceeded(budget):
+    return {'lines':['Budget exceeded: {0}'.format(budget)],
+            'table':None,
+            'status':'budget-exceeded'}
+
+
+def is_wff_check(args):
+    '''
+    Indicates whether `args` describe a well-formedness check of an expression
+    without uncertainty operator tokens - the only operation whose parsing
+    backend (-p) matters.
+    '''
+    return (not args.sexp and not args.canonical and args.similar is None and
+            args.motifs is None and args.operator is None and
+            args.substitution is None and not args.contexts and
+            gregex.uncertainty_operator_pattern.search(args.lce) is None)
+
+
+def run(args):
+    '''
+    Performs the operation described by `args` within its resource budgets
+    (see `execute`), without consulting the result cache.
+    '''
+    if args.time_limit is None and args.memory_limit is None:
+        try:
+            return perform(args)
+        except guarded.BudgetExceeded as e:
+            return budget_exceeded(e.budget)
+
+    memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit is not None else None
+    outcome = guarded.run_guarded(perform, (args,), time_limit=args.time_limit,
+                                  memory_limit=memory_limit)
+    backend = args.parser[0] if args.parser is not None else 'earley'
+    if (outcome['status'] == 'budget-exceeded' and args.fallback and backend == 'nltk'
+            and is_wff_check(args)):
+        fallback_args = copy.copy(args)
+        fallback_args.parser = ['earley']
+        outcome = guarded.run_guarded(perform, (fallback_args,), time_limit=args.time_limit,
+                                      memory_limit=memory_limit)
+    if outcome['status'] == 'ok':
+        return outcome['value']
+    if outcome['status'] == 'budget-exceeded':
+        return budget_exceeded(outcome['budget'])
+    if outcome['exception'] == 'ValueError':
+        raise ValueError(outcome['error'][len('ValueError: '):])
+    raise Exception(outcome['error'])
+
+
+def perform(args):
+    '''
+    Performs the operation described by `args` without consulting the result
+    cache (see `execute`).
+    '''
+    lines = []
+    if args.verbose:
+        lines.append(str(args))
+
+    with_context = args.contexts
+    to_excel_fp = args.excel[0] if args.excel is not None else None
+    lce = args.lce
+    to_sexp = args.sexp
+    operator = args.operator
+    substitution = args.substitution
+    verbose = args.verbose
+    colnames = args.namecolumns
+    grammar = args.grammar[0] if args.grammar is not None else None
+    backend = args.parser[0] if args.parser is not None else 'earley'
+
+    if to_sexp:
+        lines.append(gregex.parse_exp(lce, 's-exp'))
+        return {'lines':lines, 'table':None}
+
+    if args.canonical:
+        lines.append(gregex.canonical_linear_code(lce))
+        return {'lines':lines, 'table':None}
+
+    if args.similar is not None:
+        index = SimilarityIndex.load(args.similar)
+        for hit in index.query(lce, args.top, args.rerank):
+            lines.append(str_join('\t', list(map(str, hit)) + [index.glycans[hit[0]]]))
+        return {'lines':lines, 'table':None}
+
+    if args.motifs is not None:
+        automaton = MotifAutomaton(load_motifs(args.motifs))
+        if colnames:
+            lines.append(str_join('\t', ('motif', 'position')))
+        for name, position in automaton.search(lce):
+            lines.append('{0}\t{1}'.format(name, position))
+        return {'lines':lines, 'table':None}
+
+    if substitution is not None and len(substitution) > 1:
+        sub = tuple(substitution)
+    elif substitution is not None and len(substitution) > 0:
+        sub = substitution[0]
+    else:
+        sub = None
+    if operator is not None and len(operator) > 0:
+        op = operator[0]
+    else:
+        op = None
+
+    if (not to_sexp) and (op is None and sub is None and not with_context):
+        if gregex.uncertainty_operator_pattern.search(lce) is not None:
+            if verbose:
+                lines.append('Checking if some instantiation of the pattern is well-formed...')
+            is_wff, witness = gregex.wff_pattern(lce, grammar, True)
+            if verbose and is_wff:
+                lines.append('Witness substitutions: {0}'.format(witness))
+            lines.append(str(is_wff))
+            return {'lines':lines, 'table':None}
+        if verbose:
+            lines.append('Checking if linear code expression is well-formed...')
+        lines.append(str(gregex.wff(lce, grammar, backend)))
+        return {'lines':lines, 'table':None}
+
+    if type(sub) == tuple and op is not None:
+        raise ValueError('Only one substitution (-s) can be checked against the matches of an operator (-o).')
+
+    if sub is not None and op is None:
+        if verbose:
+            lines.append('Substitution and linear code expression provided.\nChecking if substitution is valid...')
+        if colnames:
+            cols = ('valid_sub?',)
+            col_string = str_join('\t', cols)
+            lines.append(col_string)
+        lines.append(str(gregex.check_match(lce, sub, verbose)))
+        return {'lines':lines, 'table':None}
+
+    if args.table_dir is not None:
+        if op is None:
+            raise ValueError('An operator (-o) is required to write a table (--table-dir).')
+        if args.compare_with is not None:
+            if sub is not None:
+                raise ValueError('A substitution (-s) cannot be checked in a comparison table (--compare-with).')
+            summary = match_tables.write_comparison_table(op, args.compare_with, lce, args.table_dir,
+                                                          args.chunk_rows)
+        else:
+            summary = match_tables.write_match_table(lce, op, args.table_dir, sub, args.chunk_rows)
+        if verbose:
+            lines.append('Resumed from start index {0}'.format(summary['resumed_from']))
+        lines.append('Wrote {0} rows in {1} chunks to {2}'.format(summary['rows'], summary['chunks'],
+                                                                  args.table_dir))
+        return {'lines':lines, 'table':None}
+
+    guarded.check_span_budget(lce, op, args.max_spans)
+    results = gregex.analyze_matches(lce, op, sub, with_context, verbose,
+                                     args.offset, args.limit, args.processes or None)
+    if with_context:
+        cols = ['left_context','match', 'right_context']
+    else:
+        cols = ['match']
+    if sub is not None:
+        cols += ['valid_sub?']
+    cols = tuple(cols)
+
+    if to_excel_fp is not None:
+        rows = [result if type(result) == tuple else (result,)
+                for result in results]
+        return {'lines':lines,
+                'table':{'filepath':to_excel_fp,
+                         'columns':cols,
+                         'rows':rows,
+                         'include_header':colnames}}
+
+    if colnames:
+        lines.append(str_join('\t', cols))
+    columnify = lambda match_result: str_join('\t', match_result)
+    for result in results:
+        if type(result) != tuple:
+            lines.append(result)
+        else:
+            lines.append(columnify(result))
+    return {'lines':lines, 'table':None}
@@ -0,0 +1,213 @@
+'''
+A persistent, content-addressed cache of gregex results, so that reruns over
+largely unchanged sets of glycans reduce to cache reads.
+
+Each result is stored in its own file, named by a hash of
+    (expression, operation, arguments, gregex version, grammar)
+where the gregex version is a digest of gregex's source code (so results
+computed by older code are never served) and the grammar is identified by the
+digest of its content (see `gregex.grammar_digest`).
+
+Several processes can share a cache: entries are written to a temporary file
+and renamed into place, so readers only ever see complete entries, and a
+missing or unreadable entry is just a miss. The total size of the entries is
+kept up to date in the directory's 'size' file by every write, and whenever a
+write takes it over the size bound the least recently used entries are
+evicted (hits refresh an entry's modification time), with one process
+evicting at a time.
+'''
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import gregex
+
+default_max_bytes = 512 * 1024 * 1024
+
+package_dir = os.path.dirname(os.path.abspath(__file__))
+_version = []
+
+
+def ensure_directory(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+
+def gregex_version():
+    '''
+    Returns a digest of the source code of the gregex package.
+    '''
+    if not _version:
+        h = hashlib.sha256()
+        for filepath in sorted(glob.glob(os.path.join(package_dir, '*.py'))):
+            with open(filepath, 'rb') as source_file:
+                h.update(source_file.read())
+        _version.append(h.hexdigest())
+    return _version[0]
+
+
+class ResultCache(object):
+    '''
+    A directory of cached results, by default `gregex_cache_dir('results')`,
+    holding at most (about) `max_bytes` bytes of entries.
+
+    `call` runs a gregex function through the cache; `get` and `put` work with
+    keys from `key` directly.
+    '''
+    missing = object()
+
+    def __init__(self, directory=None, max_bytes=default_max_bytes):
+        self.directory = directory if directory is not None else gregex.gregex_cache_dir('results')
+        ensure_directory(self.directory)
+        self.max_bytes = max_bytes
+
+    def key(self, expression, operation, arguments=(), grammar=None):
+        '''
+        Returns the key for the result of `operation` (a name) applied to
+        `expression` with `arguments` (any value with a stable repr) under
+        `grammar` (anything `gregex.get_grammar` accepts).
+        '''
+        grammar_id = gregex.get_grammar(grammar).digest
+        description = json.dumps([expression, operation, repr(arguments),
+                                  gregex_version(), grammar_id])
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.pickle')
+
+    def get(self, key, default=missing):
+        '''
+        Returns the result stored under `key`, or `default` (`ResultCache.missing`
+        unless given) if there is none.
+        '''
+        entry_fp = self.entry_path(key)
+        try:
+            with open(entry_fp, 'rb') as entry_file:
+                value = pickle.load(entry_file)
+        except Exception:
+            return default
+        try:
+            os.utime(entry_fp, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores `value` under `key`, evicting old entries if this takes the
+        cache over its size bound.
+        '''
+        entry_fp = self.entry_path(key)
+        ensure_directory(os.path.dirname(entry_fp))
+        temp_fp = '{0}.{1}.tmp'.format(entry_fp, os.getpid())
+        with open(temp_fp, 'wb') as entry_file:
+            pickle.dump(value, entry_file, pickle.HIGHEST_PROTOCOL)
+        try:
+            replaced = os.path.getsize(entry_fp)
+        except OSError:
+            replaced = 0
+        os.rename(temp_fp, entry_fp)
+        if self.update_size(os.path.getsize(entry_fp) - replaced) > self.max_bytes:
+            self.evict()
+
+    def call(self, operation, expression, *args, **kwargs):
+        '''
+        Returns `getattr(gregex, operation)(expression, *args, **kwargs)`,
+        from the cache if possible. A grammar must be passed by keyword
+        (`grammar=...`) to be taken into account.
+        '''
+        key = self.key(expression, operation, (args, sorted(kwargs.items())),
+                       kwargs.get('grammar'))
+        value = self.get(key)
+        if value is ResultCache.missing:
+            value = getattr(gregex, operation)(expression, *args, **kwargs)
+            self.put(key, value)
+        return value
+
+    def entries(self):
+        '''
+        Returns (modification time, size, filepath) for every entry.
+        '''
+        result = []
+        for entry_fp in glob.glob(os.path.join(self.directory, '*', '*.pickle')):
+            try:
+                stat = os.stat(entry_fp)
+            except OSError:
+                continue
+            result.append((stat.st_mtime, stat.st_size, entry_fp))
+        return result
+
+    def size(self):
+        '''
+        Returns the total size in bytes of the cache's entries.
+        '''
+        return sum(size for _, size, _ in self.entries())
+
+    def update_size(self, change=0):
+        '''
+        Adds `change` bytes to the running total size of the entries and
+        returns the new total. If there is no running total yet, it is
+        computed from the entries themselves.
+        '''
+        size_fp = os.path.join(self.directory, 'size')
+        with open(os.path.join(self.directory, 'size.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                with open(size_fp, 'r') as size_file:
+                    total = int(size_file.read()) + change
+            except (IOError, OSError, ValueError):
+                total = self.size()
+            temp_fp = '{0}.{1}.tmp'.format(size_fp, os.getpid())
+            with open(temp_fp, 'w') as size_file:
+                size_file.write(str(total))
+            os.rename(temp_fp, size_fp)
+        return total
+
+    def evict(self, max_bytes=None, wait=False):
+        '''
+        Removes least recently used entries until the cache holds at most
+        `max_bytes` (by default, its size bound). If another process is
+        already evicting, waits for it if `wait` is True and otherwise does
+        nothing.
+        '''
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with open(os.path.join(self.directory, 'evict.lock'), 'w') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+                except IOError:
+                    return
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, entry_fp in entries:
+                if total <= max_bytes:
+                    break
+                total -= size
+                try:
+                    os.remove(entry_fp)
+                except OSError:
+                    continue
+                removed += size
+            # Subtract rather than overwrite, so as not to lose what writes
+            # added to the running total while this was evicting.
+            self.update_size(-removed)
+
+    def clear(self):
+        '''
+        Removes every entry.
+        '''
+        self.evict(0, wait=True)
@@ -0,0 +1,164 @@
+'''
+A long-running gregex server, so that callers making many small requests don't
+pay for importing glypy/NLTK, building gregex's vocabularies and compiling
+grammars on every invocation.
+
+Run it with
+    python -m gregex.server [--host HOST] [--port PORT] [--grammar G ...]
+and send it requests over localhost HTTP: POST a JSON object describing one
+CLI invocation, or a JSON list of them to have a whole batch handled in one
+round trip. Each request is either
+    {"argv": ["Ma6(Ma4)M", "-o", "_", "-c"]}
+(exactly the arguments `python -m gregex` takes) or the same thing with long
+flag names as keys:
+    {"lce": "Ma6(Ma4)M", "operator": "_", "contexts": true, "limit": 2}
+(numbers are passed on as their strings). Each response is a JSON object with the 'lines' the CLI would print and any
+excel 'table' it would write (see `gregex.operations.execute`), or an 'error'.
+
+`gregex/client.py` is a thin client taking the same flags as the CLI.
+'''
+
+import argparse
+import json
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import gregex
+import operations
+from cli import build_parser
+
+default_host = '127.0.0.1'
+default_port = 8765
+
+
+def flag_value(value):
+    '''
+    Returns a JSON value (e.g. the number in {"limit": 2}) as the string
+    argparse expects.
+    '''
+    if isinstance(value, (type(''), type(u''))):
+        return value
+    return str(value)
+
+
+def request_to_argv(request):
+    '''
+    Converts a request object (see the module docstring) to a CLI argument
+    list.
+    '''
+    if 'argv' in request:
+        return list(request['argv'])
+    argv = [request['lce']]
+    for key, value in sorted(request.items()):
+        if key == 'lce' or value is None or value is False:
+            continue
+        flag = '--' + key
+        if value is True:
+            argv.append(flag)
+        elif isinstance(value, (list, tuple)):
+            for each in value:
+                argv.extend([flag, flag_value(each)])
+        else:
+            argv.extend([flag, flag_value(value)])
+    return argv
+
+
+def handle_request(request, parser):
+    '''
+    Performs one request (see the module docstring) and returns its response.
+    '''
+    try:
+        args = parser.parse_args(request_to_argv(request))
+        return operations.execute(args)
+    except Exception as e:
+        return {'error':'{0}: {1}'.format(type(e).__name__, e)}
+
+
+def handle(payload):
+    '''
+    Performs a request, or a list of requests, and returns the corresponding
+    response(s).
+    '''
+    parser = build_parser(raise_errors=True)
+    if isinstance(payload, list):
+        return [handle_request(request, parser) for request in payload]
+    return handle_request(payload, parser)
+
+
+class GregexRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Answers JSON requests POSTed to any path.
+    '''
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            status, response = 200, handle(payload)
+        except ValueError as e:
+            status, response = 400, {'error':'Invalid JSON: {0}'.format(e)}
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class GregexServer(ThreadingMixIn, HTTPServer):
+    '''
+    An HTTP server handling each connection on its own thread, so that one
+    slow request doesn't hold up the rest.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+    verbose = False
+
+
+def warm_up(grammars=()):
+    '''
+    Compiles (or loads from the on-disk cache) the default grammar and each
+    grammar (file) in `grammars`, so that the first requests don't pay for it.
+    '''
+    gregex.get_grammar(None)
+    for grammar in grammars:
+        gregex.get_grammar(grammar)
+
+
+def serve(host=default_host, port=default_port, grammars=(), verbose=False):
+    '''
+    Runs a gregex server on `host`:`port` until interrupted.
+    '''
+    warm_up(grammars)
+    server = GregexServer((host, port), GregexRequestHandler)
+    server.verbose = verbose
+    if verbose:
+        print('gregex server listening on {0}:{1}'.format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Serve gregex CLI operations as JSON over localhost HTTP.')
+    arg_parser.add_argument('--host', type=str, default=default_host,
+                            help='Address to listen on (default: {0})'.format(default_host))
+    arg_parser.add_argument('--port', type=int, default=default_port,
+                            help='Port to listen on (default: {0})'.format(default_port))
+    arg_parser.add_argument('-g', '--grammar', metavar='G', type=str, action='append', default=[],
+                            help='A grammar file to compile at startup (may be repeated)')
+    arg_parser.add_argument('-v', '--verbose', action='store_true',
+                            help='If active, log each request to stderr')
+    server_args = arg_parser.parse_args()
+    serve(server_args.host, server_args.port, server_args.grammar, server_args.verbose)
@@ -0,0 +1,242 @@
+'''
+Approximate similarity search over libraries of glycans.
+
+Each glycan is fingerprinted by the set of its structural features (see
+`features`): every residue's neighbourhood up to a small depth, in canonical
+form, and every upward linkage path of a few residues. Sets of features are
+compared by their Jaccard similarity, estimated from MinHash signatures; a
+locality-sensitive hashing index over the signatures finds the glycans likely
+to be similar to a query without comparing it against the whole library, and
+candidates can optionally be re-ranked by exact tree edit distance (see
+`gregex.edit_distance`).
+
+Run as a script to build an index from a file of linear code expressions (one
+per line):
+    python -m gregex.similarity LIBRARY INDEX
+and query a saved index with `python -m gregex LCE --similar INDEX`.
+'''
+
+import hashlib
+import pickle
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+import gregex
+import edit_distance
+
+mersenne_prime = np.uint64((1 << 61) - 1)
+max_hash = np.uint64((1 << 32) - 1)
+
+
+def features(linear_code_expression, depth=2, path_length=3):
+    '''
+    Returns the set of structural features of a glycan:
+      - for each residue and each d <= `depth`, the residue with everything
+        attached below it to depth d, in canonical (branch-order independent)
+        form
+      - for each residue, the labels on the path up from it through at most
+        `path_length` residues
+    '''
+    tree = gregex.parse_exp(linear_code_expression, 'func-and-args')
+    result = set()
+
+    def neighbourhood(node, d):
+        if d == 0 or len(node['args']) == 0:
+            return node['func']
+        children = sorted(neighbourhood(arg, d - 1) for arg in node['args'])
+        return '{0}({1})'.format(node['func'], ','.join(children))
+
+    stack = [(tree, ())]
+    while stack:
+        node, ancestors = stack.pop()
+        for d in range(depth + 1):
+            result.add('N{0}:{1}'.format(d, neighbourhood(node, d)))
+        path = (node['func'],) + ancestors
+        for length in range(2, min(path_length, len(path)) + 1):
+            result.add('P:' + '<'.join(path[:length]))
+        for arg in node['args']:
+            stack.append((arg, path[:path_length - 1]))
+    return result
+
+
+def hash_features(feature_set):
+    '''
+    Returns the features in `feature_set` as an array of 64-bit hashes.
+    '''
+    return np.array(sorted(int(hashlib.md5(feature.encode('utf-8')).hexdigest()[:16], 16)
+                           for feature in feature_set),
+                    dtype=np.uint64)
+
+
+def mulmod_mersenne(a, x):
+    '''
+    Returns a * x mod 2^61 - 1 (elementwise, broadcasting) for uint64 arrays
+    of values below 2^61 - 1, exactly: the factors are split into 31-bit
+    halves so that no partial product overflows, and the powers of 2 above
+    2^61 are folded back down using 2^61 = 1 (mod 2^61 - 1).
+    '''
+    low31, low30 = np.uint64((1 << 31) - 1), np.uint64((1 << 30) - 1)
+    a_hi, a_lo = a >> np.uint64(31), a & low31
+    x_hi, x_lo = x >> np.uint64(31), x & low31
+    middle = a_hi * x_lo + a_lo * x_hi
+    # a * x = a_hi x_hi 2^62 + middle 2^31 + a_lo x_lo, and 2^62 = 2
+    folded = (np.uint64(2) * a_hi * x_hi +
+              ((middle & low30) << np.uint64(31)) + (middle >> np.uint64(30)) +
+              a_lo * x_lo)
+    return folded % mersenne_prime
+
+
+class MinHash(object):
+    '''
+    `n_permutations` random hash functions
+        h(x) = ((a * x + b) mod (2^61 - 1)) mod 2^32
+    mapping a set of hashed features to its signature, the minimum of each
+    function over the set. The fraction of positions at which two signatures
+    agree estimates the Jaccard similarity of the sets.
+    '''
+    def __init__(self, n_permutations=128, seed=0):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 30, n_permutations).astype(np.uint64) << np.uint64(31)
+        self.a |= rng.randint(1, 1 << 30, n_permutations).astype(np.uint64)
+        self.b = rng.randint(0, 1 << 30, n_permutations).astype(np.uint64)
+
+    def signature(self, hashed_features):
+        products = mulmod_mersenne(self.a[:, None], hashed_features[None, :] % mersenne_prime)
+        values = (products + self.b[:, None]) % mersenne_prime
+        return (values & max_hash).min(axis=1).astype(np.uint32)
+
+
+class SimilarityIndex(object):
+    '''
+    A MinHash LSH index over a library of glycans.
+
+    Signatures of `n_permutations` values are cut into `bands` bands; glycans
+    whose signatures agree on a whole band share a bucket, and a query's
+    candidates are the glycans sharing at least one bucket with it. Glycans
+    with feature-set Jaccard similarity s become candidates with probability
+    1 - (1 - s^r)^bands, r being the number of rows per band.
+
+    Ids are positions in `glycans`; the index can be written to and read from
+    disk with `save` and `SimilarityIndex.load`.
+    '''
+    def __init__(self, n_permutations=128, bands=32, seed=0):
+        assert n_permutations % bands == 0, "bands must divide n_permutations"
+        self.n_permutations = n_permutations
+        self.bands = bands
+        self.seed = seed
+        self.minhash = MinHash(n_permutations, seed)
+        self.glycans = []
+        self.signatures = np.zeros((0, n_permutations), dtype=np.uint32)
+        self.pending = []
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.glycans)
+
+    def signature(self, linear_code_expression):
+        return self.minhash.signature(hash_features(features(linear_code_expression)))
+
+    def band_keys(self, signature):
+        rows = self.n_permutations // self.bands
+        return [signature[band * rows:(band + 1) * rows].tobytes()
+                for band in range(self.bands)]
+
+    def add(self, linear_code_expression):
+        '''
+        Adds a glycan to the index and returns its id.
+        '''
+        glycan_id = len(self.glycans)
+        signature = self.signature(linear_code_expression)
+        self.glycans.append(linear_code_expression)
+        self.pending.append(signature)
+        for bucket, key in zip(self.buckets, self.band_keys(signature)):
+            bucket[key].append(glycan_id)
+        return glycan_id
+
+    def extend(self, linear_code_expressions):
+        '''
+        Adds each glycan in `linear_code_expressions` and returns their ids.
+        '''
+        return [self.add(lce) for lce in linear_code_expressions]
+
+    def all_signatures(self):
+        if self.pending:
+            self.signatures = np.vstack([self.signatures] + self.pending)
+            self.pending = []
+        return self.signatures
+
+    def candidates(self, signature):
+        '''
+        Returns the sorted ids of the glycans sharing a bucket with `signature`.
+        '''
+        result = set()
+        for bucket, key in zip(self.buckets, self.band_keys(signature)):
+            result.update(bucket.get(key, ()))
+        return sorted(result)
+
+    def query(self, linear_code_expression, k=10, rerank=False,
+              costs=edit_distance.default_costs):
+        '''
+        Returns up to `k` glycans similar to `linear_code_expression`, as
+        (id, estimated Jaccard similarity of features) pairs, most similar
+        first.
+
+        If `rerank` is True, every candidate's tree edit distance to the query
+        (under `costs`) is computed and the result is instead the `k` nearest
+        candidates as (id, estimated similarity, distance) triples, nearest
+        first.
+        '''
+        signature = self.signature(linear_code_expression)
+        ids = self.candidates(signature)
+        if not ids:
+            return []
+        similarities = (self.all_signatures()[ids] == signature).mean(axis=1)
+        if not rerank:
+            order = sorted(range(len(ids)), key=lambda c: (-similarities[c], ids[c]))
+            return [(ids[c], float(similarities[c])) for c in order[:k]]
+        query_tree = edit_distance.prepare(linear_code_expression)
+        distances = [edit_distance.prepared_distance(query_tree,
+                                                     edit_distance.prepare(self.glycans[glycan_id]),
+                                                     costs)
+                     for glycan_id in ids]
+        order = sorted(range(len(ids)), key=lambda c: (distances[c], -similarities[c], ids[c]))
+        return [(ids[c], float(similarities[c]), distances[c]) for c in order[:k]]
+
+    def save(self, filepath):
+        '''
+        Writes the index to `filepath`.
+        '''
+        state = {'n_permutations':self.n_permutations,
+                 'bands':self.bands,
+                 'seed':self.seed,
+                 'glycans':self.glycans,
+                 'signatures':self.all_signatures(),
+                 'buckets':[dict(bucket) for bucket in self.buckets]}
+        with open(filepath, 'wb') as index_file:
+            pickle.dump(state, index_file, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filepath):
+        '''
+        Reads an index written by `save`; more glycans can still be added.
+        '''
+        with open(filepath, 'rb') as index_file:
+            state = pickle.load(index_file)
+        index = cls(state['n_permutations'], state['bands'], state['seed'])
+        index.glycans = state['glycans']
+        index.signatures = state['signatures']
+        for bucket, saved in zip(index.buckets, state['buckets']):
+            bucket.update(saved)
+        return index
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Usage: python -m gregex.similarity LIBRARY INDEX')
+    library_fp, index_fp = sys.argv[1:]
+    index = SimilarityIndex()
+    with open(library_fp, 'r') as library_file:
+        index.extend(line.strip() for line in library_file if line.strip() != '')
+    index.save(index_fp)
@@ -0,0 +1,190 @@
+'''
+An index over a library of glycans for fast "contains this substructure"
+queries.
+
+For every glycan added, the index records the structural hash (see
+`gregex.subtree_hashes`) of every rooted subtree - a residue together with
+everything attached below it - and the labels of every (parent, child) edge.
+Queries become hash or edge-key lookups, with candidates then verified against
+the glycans themselves.
+'''
+
+import pickle
+from collections import defaultdict
+
+import gregex
+
+
+def compact_tree(func_and_args):
+    '''
+    Converts a func-and-args tree (see `gregex.parse_exp`) to nested tuples
+        (label, (child, child, ...))
+    which take far less memory to keep around for a whole library.
+    '''
+    return (func_and_args['func'],
+            tuple(map(compact_tree, func_and_args['args'])))
+
+
+def embeds(query_tree, tree):
+    '''
+    Indicates whether the compact tree `query_tree` (see `compact_tree`) can be
+    embedded in the compact tree `tree` with the roots aligned: the roots have
+    the same label and each child of the query root embeds (recursively) in a
+    distinct child of the root of `tree`. Branch order is irrelevant, and `tree`
+    may have extra branches anywhere.
+    '''
+    if query_tree[0] != tree[0]:
+        return False
+    query_children, children = query_tree[1], tree[1]
+    if len(query_children) > len(children):
+        return False
+    compatible = [[j for j, child in enumerate(children) if embeds(query_child, child)]
+                  for query_child in query_children]
+
+    # bipartite matching of query children to distinct children (Kuhn)
+    assigned = dict()
+
+    def augment(i, visited):
+        for j in compatible[i]:
+            if j in visited:
+                continue
+            visited.add(j)
+            if j not in assigned or augment(assigned[j], visited):
+                assigned[j] = i
+                return True
+        return False
+
+    return all(augment(i, set()) for i in range(len(query_children)))
+
+
+def nodes(tree):
+    '''
+    Returns every node (subtree) of the compact tree `tree`.
+    '''
+    result, stack = [], [tree]
+    while stack:
+        node = stack.pop()
+        result.append(node)
+        stack.extend(node[1])
+    return result
+
+
+class SubtreeIndex(object):
+    '''
+    Maps the structural hash of every rooted subtree, every residue label and
+    every (parent label, child label) edge occurring in a library of glycans to
+    the ids of the glycans they occur in. The canonical linear code of each
+    distinct subtree and a compact tree per glycan are kept for verifying
+    candidates.
+
+    Glycans can be added at any time (`add`, `extend`); ids are positions in
+    `glycans`. The index can be written to and read from disk with `save` and
+    `SubtreeIndex.load`.
+    '''
+    def __init__(self):
+        self.glycans = []
+        self.trees = []
+        self.subtrees = defaultdict(set)
+        self.codes = dict()
+        self.labels = defaultdict(set)
+        self.edges = defaultdict(set)
+
+    def __len__(self):
+        return len(self.glycans)
+
+    def add(self, linear_code_expression):
+        '''
+        Adds a glycan to the index and returns its id.
+        '''
+        glycan_id = len(self.glycans)
+        tree = gregex.parse_exp(linear_code_expression, 'func-and-args')
+        self.glycans.append(linear_code_expression)
+        self.trees.append(compact_tree(tree))
+        for digest, subtree in gregex.subtree_hashes(tree):
+            self.subtrees[digest].add(glycan_id)
+            if digest not in self.codes:
+                canonical = gregex.canonicalize_tree(subtree)
+                self.codes[digest] = gregex.func_and_args_to_linear_code(canonical)
+            self.labels[subtree['func']].add(glycan_id)
+            for arg in subtree['args']:
+                self.edges[(subtree['func'], arg['func'])].add(glycan_id)
+        return glycan_id
+
+    def extend(self, linear_code_expressions):
+        '''
+        Adds each glycan in `linear_code_expressions` and returns their ids.
+        '''
+        return [self.add(lce) for lce in linear_code_expressions]
+
+    def containing(self, subtree_expression):
+        '''
+        Returns the sorted ids of the glycans in which `subtree_expression`
+        occurs as a complete rooted subtree: some residue of the glycan has
+        exactly the subtree's residues (in any branch order) attached below it.
+
+        This is a single hash lookup; comparing the canonical linear code
+        stored for the hash with the query's rules out hash collisions.
+        '''
+        query_tree = gregex.parse_exp(subtree_expression, 'func-and-args')
+        digest = gregex.subtree_hashes(query_tree)[-1][0]
+        if digest not in self.codes:
+            return []
+        query_code = gregex.func_and_args_to_linear_code(gregex.canonicalize_tree(query_tree))
+        if self.codes[digest] != query_code:
+            return []
+        return sorted(self.subtrees[digest])
+
+    def embedding(self, subtree_expression):
+        '''
+        Returns the sorted ids of the glycans that contain `subtree_expression`
+        as a substructure: some residue of the glycan has the subtree's root
+        label, and the subtree's residues can be found below it with the same
+        labels and parent-child relations (see `embeds`), possibly alongside
+        further branches.
+
+        Candidates are the glycans containing every edge (or, for a single
+        residue, the label) of the subtree; each is then verified.
+        '''
+        query_tree = compact_tree(gregex.parse_exp(subtree_expression, 'func-and-args'))
+        keys = [(self.edges, (node[0], child[0]))
+                for node in nodes(query_tree)
+                for child in node[1]]
+        if len(keys) == 0:
+            keys = [(self.labels, query_tree[0])]
+        postings = sorted((table.get(key, set()) for table, key in keys), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        if len(keys) == 1 and len(query_tree[1]) <= 1:
+            # a single edge or label needs no further verification
+            return sorted(candidates)
+        return sorted(glycan_id for glycan_id in candidates
+                      if any(embeds(query_tree, node)
+                             for node in nodes(self.trees[glycan_id])))
+
+    def save(self, filepath):
+        '''
+        Writes the index to `filepath`.
+        '''
+        state = {'glycans':self.glycans,
+                 'trees':self.trees,
+                 'subtrees':dict(self.subtrees),
+                 'codes':self.codes,
+                 'labels':dict(self.labels),
+                 'edges':dict(self.edges)}
+        with open(filepath, 'wb') as index_file:
+            pickle.dump(state, index_file, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filepath):
+        '''
+        Reads an index written by `save`; more glycans can still be added.
+        '''
+        with open(filepath, 'rb') as index_file:
+            state = pickle.load(index_file)
+        index = cls()
+        index.glycans = state['glycans']
+        index.trees = state['trees']
+        index.codes = state['codes']
+        index.subtrees.update(state['subtrees'])
+        index.labels.update(state['labels'])
+        index.edges.update(state['edges'])
+        return index